@@ -0,0 +1,211 @@
+# clip_embed.py
+# Encoding por lotes de los renders (_vN_lM.png) con open_clip, para compute_and_save_embeddings_for_export (modelo.py).
+#  - decode + preprocess en un pool de threads con prefetch acotado (estilo DataLoader: mientras el modelo codifica
+#    un lote los workers ya preparan los siguientes). Threads y no procesos: modelo.py corre todo a nivel de módulo
+#    y en Windows (spawn) cada worker de un DataLoader volvería a ejecutar el script entero.
+#  - todas las vistas de todos los objetos faltantes van juntas en lotes de batch_size con torch.inference_mode()
+#  - el vector por objeto es el promedio de sus vistas normalizadas, renormalizado (igual que antes,
+#    ViewCache.object_vector)
+# ViewCache guarda los vectores por vista según el contenido del PNG, así re-renderizar un objeto (o cambiar de
+# modelo CLIP) invalida solo lo que cambió y agregar una vista no re-codifica las demás:
+#   embeddings/view_cache.npz  -> {"digests": sha256 de cada PNG, "vectors": (n, D) float32}
+#   embeddings/view_cache.json -> {"version", "model": "<modelo>/<pretrain>", "files": {ruta: {size, mtime, sha256}},
+#                                  "objects": {object_id: firma de las vistas con que se escribió su .pkl},
+#                                  "views": {object_id: sha256 de sus vistas actuales}, "failed": [sha256 que no se pudieron leer]}
+# Al guardar se descartan los vectores (y fallas) de vistas que ya no usa ningún objeto.
+import hashlib, json, os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from PIL import Image
+
+VIEW_CACHE_VECTORS = "view_cache.npz"
+VIEW_CACHE_INDEX = "view_cache.json"
+VIEW_CACHE_VERSION = 1
+
+def load_view(preprocess: Callable, path: Path):
+    with Image.open(path) as im:
+        return preprocess(im.convert("RGB"))
+
+def iter_view_batches(paths: Sequence[Path], preprocess: Callable, batch_size: int = 32, workers: int = 4,
+                      prefetch_batches: int = 2) -> Iterator[Tuple[List[int], list, List[Tuple[int,Exception]]]]:
+    """
+    Lotes (posiciones en paths, tensores preprocesados, errores) en el orden de paths.
+    Como mucho prefetch_batches * batch_size imágenes decodificadas en memoria a la vez.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        pending = deque()
+        todo = iter(enumerate(paths))
+        limit = max(1, prefetch_batches) * batch_size
+
+        def fill():
+            while len(pending) < limit:
+                nxt = next(todo, None)
+                if nxt is None:
+                    return
+                pending.append((nxt[0], ex.submit(load_view, preprocess, nxt[1])))
+
+        fill()
+        idx, tensors, errors = [], [], []
+        while pending:
+            i, fut = pending.popleft()
+            fill()
+            try:
+                tensors.append(fut.result()); idx.append(i)
+            except Exception as e:
+                errors.append((i, e))
+            if len(tensors) == batch_size or not pending:
+                yield idx, tensors, errors
+                idx, tensors, errors = [], [], []
+
+def encode_views(model, preprocess: Callable, paths: Sequence[Path], device: str = "cpu", batch_size: int = 32,
+                 workers: int = 4, on_error: Optional[Callable[[int, Exception], None]] = None):
+    """
+    (vectores (n_ok, D) float32 normalizados por vista, posiciones en paths de cada fila).
+    Las imágenes que no se pueden leer se saltean (on_error(posición, excepción)).
+    """
+    import torch
+    rows, owners = [], []
+    with torch.inference_mode():
+        for idx, tensors, errors in iter_view_batches(paths, preprocess, batch_size, workers):
+            for i, e in errors:
+                if on_error is not None:
+                    on_error(i, e)
+            if not tensors:
+                continue
+            v = model.encode_image(torch.stack(tensors).to(device))
+            v = v / v.norm(dim=-1, keepdim=True)
+            rows.append(v.cpu().numpy().astype(np.float32))
+            owners.extend(idx)
+    if not rows:
+        return np.zeros((0, 0), dtype=np.float32), np.zeros(0, dtype=np.int64)
+    return np.vstack(rows), np.asarray(owners, dtype=np.int64)
+
+def file_sha256(path: Path, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class ViewCache:
+    """(modelo CLIP, sha256 del PNG) -> vector de la vista; firma por objeto para saber si su .pkl está al día."""
+    def __init__(self, emb_dir: Path, model_tag: str):
+        self.emb_dir = Path(emb_dir)
+        self.model_tag = model_tag
+        self.vectors: Dict[str,np.ndarray] = {}
+        self.files: Dict[str,Dict] = {}
+        self.objects: Dict[str,str] = {}
+        self.views: Dict[str,List[str]] = {}
+        self.failed = set()  # vistas que no se pudieron decodificar: no se reintentan hasta que cambie el PNG
+        self.fresh = True    # sin índice previo: los .pkl existentes más nuevos que sus vistas se adoptan
+        self.dirty = False
+
+    @classmethod
+    def open(cls, emb_dir: Path, model_tag: str) -> "ViewCache":
+        cache = cls(emb_dir, model_tag)
+        index_path, vectors_path = cache.emb_dir / VIEW_CACHE_INDEX, cache.emb_dir / VIEW_CACHE_VECTORS
+        if not index_path.exists():
+            return cache
+        try:
+            index = json.loads(index_path.read_text(encoding="utf-8"))
+            cache.fresh = False
+            if index.get("version") != VIEW_CACHE_VERSION:
+                raise ValueError(f"versión {index.get('version')}")
+            cache.files = index.get("files", {})
+            if index.get("model") != model_tag:
+                print(f"[INFO] view cache es de {index.get('model')} (ahora {model_tag}) -> se recalculan todos los embeddings")
+                return cache
+            cache.objects = index.get("objects", {})
+            cache.views = index.get("views", {})
+            cache.failed = set(index.get("failed", []))
+            if vectors_path.exists():
+                with np.load(vectors_path, allow_pickle=False) as z:
+                    cache.vectors = dict(zip(z["digests"].tolist(), z["vectors"]))
+        except Exception as e:
+            print(f"[WARN] no se pudo leer el view cache en {cache.emb_dir}: {e} -> se regenera")
+            cache.files, cache.objects, cache.views, cache.failed, cache.vectors = {}, {}, {}, set(), {}
+        return cache
+
+    def digest(self, path: Path) -> str:
+        """sha256 del archivo; si size+mtime no cambiaron desde la última vez se reutiliza sin leerlo."""
+        key = str(Path(path).resolve())
+        st = os.stat(path)
+        prev = self.files.get(key)
+        if prev is not None and prev.get("size") == st.st_size and prev.get("mtime") == st.st_mtime:
+            return prev["sha256"]
+        d = file_sha256(path)
+        self.files[key] = {"size": st.st_size, "mtime": st.st_mtime, "sha256": d}
+        self.dirty = True
+        return d
+
+    def object_signature(self, digests: Sequence[str]) -> str:
+        h = hashlib.sha256(self.model_tag.encode("utf-8"))
+        for d in digests:
+            h.update(b"\n" + d.encode("ascii"))
+        return h.hexdigest()
+
+    def set_object(self, object_id: str, signature: str):
+        if self.objects.get(object_id) != signature:
+            self.objects[object_id] = signature
+            self.dirty = True
+
+    def set_views(self, object_id: str, digests: Sequence[str]):
+        """Vistas actuales del objeto (lo que prune conserva), tenga o no un .pkl al día."""
+        digests = list(digests)
+        if self.views.get(object_id) != digests:
+            self.views[object_id] = digests
+            self.dirty = True
+
+    def add(self, digest: str, vector: np.ndarray):
+        self.vectors[digest] = np.asarray(vector, dtype=np.float32)
+        self.failed.discard(digest)
+        self.dirty = True
+
+    def mark_failed(self, digest: str):
+        self.failed.add(digest)
+        self.dirty = True
+
+    def prune(self) -> int:
+        """Descarta vectores y fallas de vistas que no están en las vistas de ningún objeto; devuelve cuántos."""
+        used = {d for digests in self.views.values() for d in digests}
+        stale = [d for d in self.vectors if d not in used]
+        for d in stale:
+            del self.vectors[d]
+        n_failed = len(self.failed)
+        self.failed &= used
+        removed = len(stale) + n_failed - len(self.failed)
+        if removed:
+            self.dirty = True
+        return removed
+
+    def object_vector(self, digests: Sequence[str]) -> Optional[np.ndarray]:
+        """Promedio de las vistas que tienen vector, renormalizado; None si ninguna."""
+        vecs = [self.vectors[d] for d in digests if d in self.vectors]
+        if not vecs:
+            return None
+        emb = np.mean(np.vstack(vecs), axis=0)
+        return emb / (np.linalg.norm(emb) + 1e-12)
+
+    def save(self):
+        removed = self.prune()
+        if removed:
+            print(f"[INFO] view cache: {removed} vistas sin objeto descartadas")
+        if not self.dirty:
+            return
+        self.emb_dir.mkdir(parents=True, exist_ok=True)
+        index_path, vectors_path = self.emb_dir / VIEW_CACHE_INDEX, self.emb_dir / VIEW_CACHE_VECTORS
+        digests = sorted(self.vectors)
+        tmp = vectors_path.with_name(vectors_path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, digests=np.array(digests, dtype=str),
+                     vectors=np.vstack([self.vectors[d] for d in digests]) if digests else np.zeros((0, 0), dtype=np.float32))
+        os.replace(tmp, vectors_path)
+        index = {"version": VIEW_CACHE_VERSION, "model": self.model_tag, "files": self.files, "objects": self.objects,
+                 "views": self.views, "failed": sorted(self.failed)}
+        tmp = index_path.with_name(index_path.name + ".tmp")
+        tmp.write_text(json.dumps(index, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, index_path)
+        self.dirty = False
@@ -0,0 +1,185 @@
+# embedding_store.py
+# Store consolidado de embeddings: una matriz float32 contigua (N, D) ya normalizada + lista de ids.
+#   embeddings/embeddings.npy        -> matriz (se abre con np.load(mmap_mode="r"): una sola llamada, sin I/O por objeto)
+#   embeddings/embeddings_ids.json   -> {"version", "dim", "ids": [...], "files": [...]}  (fila i = ids[i], de files[i])
+# Se genera a partir de los .pkl por objeto ({'object_id':..., 'vector': np.array}) que escribe modelo.py:
+#   python embedding_store.py convert embeddings/
+import argparse, hashlib, json, os, pickle
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+
+STORE_MATRIX = "embeddings.npy"
+STORE_IDS = "embeddings_ids.json"
+
+def pkl_name_for(object_id: str) -> str:
+    return str(object_id).replace("/", "_") + ".pkl"
+
+def vector_from_pickle_payload(data) -> Optional[np.ndarray]:
+    """dict con 'vector'/'emb'/'embedding' (el primero que no sea None) o directamente list/tuple/ndarray."""
+    vec = None
+    if isinstance(data, dict):
+        for key in ("vector", "emb", "embedding"):
+            if data.get(key) is not None:
+                vec = data[key]; break
+    elif isinstance(data, (list, tuple, np.ndarray)):
+        vec = data
+    if vec is None:
+        return None
+    return np.asarray(vec, dtype=np.float32).reshape(-1)
+
+def l2_normalize(v: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(v)
+    return v / norm if norm > 0 else v
+
+def read_pkl_entry(p: Path):
+    """(object_id, vector normalizado | None) de un .pkl. Sin 'object_id' se usa el nombre de archivo.
+    Propaga errores de I/O/unpickle."""
+    with open(p, "rb") as f:
+        data = pickle.load(f)
+    oid = str(data["object_id"]) if isinstance(data, dict) and data.get("object_id") else p.stem
+    v = vector_from_pickle_payload(data)
+    return oid, (None if v is None else l2_normalize(v))
+
+class EmbeddingStore:
+    def __init__(self, matrix: np.ndarray, ids: List[str], version: str, files: Optional[List[str]] = None):
+        self.matrix = matrix
+        self.ids = list(ids)
+        self.version = version
+        self.index: Dict[str,int] = {oid: i for i, oid in enumerate(self.ids)}
+        # alias por nombre de .pkl (object_id con "/" -> "_"), igual que la búsqueda por archivo de antes
+        for i, fname in enumerate(files or []):
+            self.index.setdefault(fname, i)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _lookup(self, object_id) -> Optional[int]:
+        i = self.index.get(object_id)
+        if i is None and isinstance(object_id, str):
+            i = self.index.get(pkl_name_for(object_id))
+        return i
+
+    def __contains__(self, object_id) -> bool:
+        return self._lookup(object_id) is not None
+
+    @property
+    def dim(self) -> int:
+        return int(self.matrix.shape[1]) if self.matrix.ndim == 2 else 0
+
+    def row(self, object_id) -> int:
+        i = self._lookup(object_id)
+        return -1 if i is None else i
+
+    def rows(self, object_ids: Iterable[str]) -> np.ndarray:
+        """Índices de fila (-1 si el objeto no está en el store)."""
+        return np.fromiter((self.row(o) for o in object_ids), dtype=np.int64)
+
+    def get(self, object_id) -> Optional[np.ndarray]:
+        i = self._lookup(object_id)
+        return None if i is None else self.matrix[i]
+
+    def as_emb_map(self, object_ids: Optional[Iterable[str]] = None) -> Dict[str,np.ndarray]:
+        """dict object_id -> vector (vistas sobre la matriz, sin copias) para el código que usa emb_map."""
+        if object_ids is None:
+            return {oid: self.matrix[i] for i, oid in enumerate(self.ids)}
+        out = {}
+        for oid in object_ids:
+            i = self._lookup(oid)
+            if i is not None:
+                out[oid] = self.matrix[i]
+        return out
+
+def store_paths(emb_dir: Path):
+    emb_dir = Path(emb_dir)
+    return emb_dir / STORE_MATRIX, emb_dir / STORE_IDS
+
+def has_store(emb_dir: Path) -> bool:
+    m, i = store_paths(emb_dir)
+    return m.exists() and i.exists()
+
+def store_is_stale(emb_dir: Path) -> bool:
+    """True si no hay store o si algún .pkl es más nuevo que él (embeddings regenerados/agregados)."""
+    m, i = store_paths(emb_dir)
+    if not (m.exists() and i.exists()):
+        return True
+    built = min(m.stat().st_mtime, i.stat().st_mtime)
+    pkls = list(Path(emb_dir).glob("*.pkl"))
+    if not pkls:
+        return False  # store suelto (sin los .pkl de origen)
+    try:
+        meta = json.loads(i.read_text(encoding="utf-8"))
+    except Exception:
+        return True
+    return meta.get("n_source_pkl", len(meta.get("ids", []))) != len(pkls) or any(p.stat().st_mtime > built for p in pkls)
+
+def load_embedding_store(emb_dir: Path, mmap: bool = True) -> EmbeddingStore:
+    m, i = store_paths(emb_dir)
+    meta = json.loads(i.read_text(encoding="utf-8"))
+    matrix = np.load(m, mmap_mode="r" if mmap else None)
+    if matrix.shape[0] != len(meta["ids"]):
+        raise ValueError(f"embedding store {m}: {matrix.shape[0]} rows but {len(meta['ids'])} ids")
+    return EmbeddingStore(matrix, meta["ids"], meta.get("version", ""), meta.get("files"))
+
+def save_embedding_store(emb_dir: Path, ids: List[str], matrix: np.ndarray, files: Optional[List[str]] = None,
+                         n_source_pkl: Optional[int] = None) -> EmbeddingStore:
+    emb_dir = Path(emb_dir)
+    emb_dir.mkdir(parents=True, exist_ok=True)
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    h = hashlib.sha1()
+    h.update(json.dumps(ids).encode("utf-8"))
+    h.update(matrix.tobytes())
+    version = h.hexdigest()[:16]
+    m, i = store_paths(emb_dir)
+    # escritura atómica: matriz e ids se reemplazan juntos (ids al final)
+    tmp_m = m.with_name(m.name + ".tmp.npy")
+    np.save(tmp_m, matrix)
+    os.replace(tmp_m, m)
+    tmp_i = i.with_name(i.name + ".tmp")
+    meta = {"version": version, "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+            "n_source_pkl": len(ids) if n_source_pkl is None else n_source_pkl, "ids": ids, "files": files or []}
+    tmp_i.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp_i, i)
+    return EmbeddingStore(matrix, ids, version, files)
+
+def convert_pkl_dir(emb_dir: Path, out_dir: Optional[Path] = None) -> EmbeddingStore:
+    """Junta todos los embeddings/*.pkl en un store (orden por nombre de archivo). Los .pkl corruptos se saltean."""
+    emb_dir = Path(emb_dir)
+    ids, vecs, files = [], [], []
+    for p in sorted(emb_dir.glob("*.pkl")):
+        try:
+            oid, v = read_pkl_entry(p)
+        except Exception as e:
+            print(f"[WARN] error cargando pickle {p}: {e}")
+            continue
+        if v is None:
+            print(f"[WARN] {p.name} no tiene vector -> se omite")
+            continue
+        if vecs and v.shape != vecs[0].shape:
+            print(f"[WARN] {p.name}: dimensión {v.shape[0]} != {vecs[0].shape[0]} -> se omite")
+            continue
+        ids.append(oid); vecs.append(v); files.append(p.name)
+    matrix = np.vstack(vecs) if vecs else np.zeros((0, 0), dtype=np.float32)
+    return save_embedding_store(out_dir or emb_dir, ids, matrix, files=files, n_source_pkl=len(list(emb_dir.glob("*.pkl"))))
+
+def open_or_build_store(emb_dir: Path) -> EmbeddingStore:
+    """Store de emb_dir, reconstruyéndolo desde los .pkl si falta o quedó viejo."""
+    if store_is_stale(emb_dir):
+        store = convert_pkl_dir(emb_dir)
+        print(f"[INFO] embedding store (re)generado: {len(store)} vectores en {Path(emb_dir) / STORE_MATRIX}")
+        return store
+    return load_embedding_store(emb_dir)
+
+def main():
+    ap = argparse.ArgumentParser(description="Consolidated embedding store (.npy + ids)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("convert", help="build embeddings.npy + embeddings_ids.json from a directory of .pkl")
+    c.add_argument("emb_dir")
+    c.add_argument("--out", default=None, help="output directory (default: emb_dir)")
+    args = ap.parse_args()
+    if args.cmd == "convert":
+        store = convert_pkl_dir(Path(args.emb_dir), Path(args.out) if args.out else None)
+        print(f"[INFO] store: {len(store)} vectores dim={store.dim} version={store.version}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+# image_index.py
+# Índice de los renders armado con un solo recorrido del árbol (os.walk), para modelo.py:
+# resolve_image_paths_from_entry y find_thumbnail_for_object resuelven contra él en lugar de hacer
+# base_dir.glob("**/...") por imagen / por objeto. No se indexan .meta ni las carpetas generadas (sets_viz, embeddings).
+#   embeddings/image_index.json -> {"version", "root", "exts", "dirs": {carpeta relativa: mtime_ns}, "files": [rutas]}
+# Se indexan solo los .png (lo que globbeaban las búsquedas de antes); las rutas de export.json con otra extensión se
+# resuelven directo contra el disco. Las rutas se guardan con "/" y las de export.json se normalizan igual, así
+# 'Assets/Renders\\x\\y.png' (escrito en Windows) también resuelve en Linux. El índice guardado se reutiliza mientras
+# ninguna carpeta cambie de mtime; si una cambió solo se lista esa carpeta, y si sus subcarpetas e imágenes siguen
+# siendo las mismas (p.ej. modelo.py escribió difficulty_sets_with_scores.json en BASE, o Unity creó un .meta) el
+# índice sigue valiendo y se guarda con el mtime nuevo.
+import fnmatch, json, os
+from pathlib import Path, PurePosixPath, PureWindowsPath
+from typing import Dict, List, Optional, Sequence
+
+IMAGE_INDEX_FILE = "image_index.json"
+IMAGE_INDEX_VERSION = 2
+IMAGE_EXTS = (".png",)
+SKIP_DIRS = {"sets_viz", "embeddings"}
+
+def _norm(p) -> str:
+    return str(p).replace("\\", "/")
+
+class ImageIndex:
+    def __init__(self, root: Path, files: List[str], dirs: Dict[str,int], exts: Sequence[str] = IMAGE_EXTS):
+        self.root = Path(root)
+        self.files = set(files)
+        self.dirs = dirs
+        self.exts = tuple(sorted(e.lower() for e in exts))
+        self.refreshed = False  # is_current actualizó mtimes de carpetas sin cambios de contenido (hay que re-guardar)
+        self.by_name: Dict[str,List[str]] = {}     # nombre de archivo -> rutas relativas
+        self.by_dir: Dict[str,List[str]] = {}      # carpeta relativa -> nombres de archivo
+        self.by_folder: Dict[str,List[str]] = {}   # nombre de carpeta -> carpetas relativas con ese nombre
+        for rel in sorted(files):
+            d, _, name = rel.rpartition("/")
+            self.by_name.setdefault(name, []).append(rel)
+            self.by_dir.setdefault(d, []).append(name)
+        for d in sorted(self.by_dir):
+            self.by_folder.setdefault(d.rpartition("/")[2], []).append(d)
+
+    def __len__(self):
+        return len(self.files)
+
+    @classmethod
+    def scan(cls, root: Path, exts: Sequence[str] = IMAGE_EXTS) -> "ImageIndex":
+        root = Path(root)
+        exts = tuple(e.lower() for e in exts)
+        files, dirs = [], {}
+        for cur, subdirs, names in os.walk(root):
+            subdirs[:] = sorted(d for d in subdirs if d not in SKIP_DIRS)
+            rel_dir = _norm(os.path.relpath(cur, root))
+            rel_dir = "" if rel_dir == "." else rel_dir
+            dirs[rel_dir] = os.stat(cur).st_mtime_ns
+            for name in names:
+                if os.path.splitext(name)[1].lower() in exts:
+                    files.append(f"{rel_dir}/{name}" if rel_dir else name)
+        return cls(root, files, dirs, exts)
+
+    def _listing(self, rel_dir: str):
+        """(subcarpetas que se indexan, imágenes) de rel_dir tal como están ahora en disco."""
+        subdirs, images = set(), set()
+        with os.scandir(self.root / rel_dir) as it:
+            for e in it:
+                if e.is_dir():
+                    if e.name not in SKIP_DIRS:
+                        subdirs.add(e.name)
+                elif os.path.splitext(e.name)[1].lower() in self.exts:
+                    images.add(e.name)
+        return subdirs, images
+
+    def is_current(self) -> bool:
+        children: Dict[str,set] = {}
+        for rel_dir in self.dirs:
+            if rel_dir:
+                parent, _, name = rel_dir.rpartition("/")
+                children.setdefault(parent, set()).add(name)
+        for rel_dir, mtime in self.dirs.items():
+            try:
+                now = os.stat(self.root / rel_dir).st_mtime_ns
+                if now == mtime:
+                    continue
+                subdirs, images = self._listing(rel_dir)
+            except OSError:
+                return False
+            if subdirs != children.get(rel_dir, set()) or images != set(self.by_dir.get(rel_dir, [])):
+                return False
+            self.dirs[rel_dir] = now
+            self.refreshed = True
+        return True
+
+    def save(self, path: Path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {"version": IMAGE_INDEX_VERSION, "root": str(self.root.resolve()), "exts": list(self.exts), "dirs": self.dirs,
+                "files": sorted(self.files)}
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, root: Path, path: Path, exts: Sequence[str] = IMAGE_EXTS) -> Optional["ImageIndex"]:
+        """Índice guardado en path si es de root (mismas extensiones) y ninguna carpeta cambió de contenido; None si hay
+        que re-escanear."""
+        try:
+            data = json.loads(Path(path).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if (data.get("version") != IMAGE_INDEX_VERSION or data.get("root") != str(Path(root).resolve())
+                or data.get("exts") != sorted(e.lower() for e in exts)):
+            return None
+        index = cls(root, data.get("files", []), data.get("dirs", {}), exts)
+        return index if index.is_current() else None
+
+    def resolve(self, p) -> Optional[Path]:
+        """Misma prioridad que la búsqueda de antes: ruta absoluta, relativa a root, root/<nombre>,
+        root/<carpeta>/<nombre> y por último cualquier archivo con ese nombre en el árbol."""
+        s = _norm(p)
+        if Path(s).is_absolute() or PureWindowsPath(str(p)).is_absolute():
+            if Path(p).exists():
+                return Path(p)
+        pp = PurePosixPath(s)
+        if not pp.name:
+            return None
+        candidates = [s.lstrip("/"), pp.name]
+        if len(pp.parts) >= 2:
+            candidates.append(f"{pp.parts[-2]}/{pp.name}")
+        if os.path.splitext(pp.name)[1].lower() not in self.exts:
+            # extensión que no se indexa: misma búsqueda contra el disco que antes del índice
+            for rel in candidates:
+                if (self.root / rel).exists():
+                    return self.root / rel
+            return next(self.root.glob("**/" + pp.name), None)
+        for rel in candidates:
+            if rel in self.files:
+                return self.root / rel
+        matches = self.by_name.get(pp.name)
+        return self.root / matches[0] if matches else None
+
+    def images_in(self, rel_dir: str) -> List[Path]:
+        return [self.root / rel_dir / name if rel_dir else self.root / name for name in self.by_dir.get(_norm(rel_dir), [])]
+
+    def folder_images(self, folder: str) -> List[Path]:
+        """Imágenes de todas las carpetas llamadas folder, en cualquier nivel (lo que daba glob("**/folder/*"))."""
+        out = []
+        for rel_dir in self.by_folder.get(folder, []):
+            out.extend(self.images_in(rel_dir))
+        return out
+
+def pick_thumbnail(imgs: List[Path], patterns=("*v0_l0*.png", "*v0*.png", "*.png")) -> Optional[Path]:
+    for pat in patterns:
+        for p in imgs:
+            if fnmatch.fnmatch(p.name, pat):
+                return p
+    return imgs[0] if imgs else None
+
+_OPEN: Dict[str,ImageIndex] = {}
+
+def open_image_index(root: Path, index_path: Optional[Path] = None, exts: Sequence[str] = IMAGE_EXTS) -> ImageIndex:
+    """Índice de root (uno por proceso). Con index_path se reutiliza / guarda el índice en disco."""
+    key = str(Path(root).resolve())
+    index = _OPEN.get(key)
+    if index is not None:
+        return index
+    index = ImageIndex.load(root, index_path, exts) if index_path else None
+    if index is None or index.refreshed:
+        if index is None:
+            index = ImageIndex.scan(root, exts)
+            print(f"[INFO] índice de imágenes: {len(index)} archivos en {len(index.dirs)} carpetas de {root}")
+        if index_path:
+            try:
+                index.save(index_path)
+            except OSError as e:
+                print(f"[WARN] no se pudo guardar el índice de imágenes en {index_path}: {e}")
+    _OPEN[key] = index
+    return index
@@ -2,6 +2,7 @@
 import json, os, math, argparse, itertools, numpy as np
 from collections import defaultdict
 from typing import List, Dict, Tuple
+from similarity_kernels import GreedySet, gram_matrix, sorted_pairs
 
 def load_export(export_path: str):
     with open(export_path, "r", encoding="utf-8") as f:
@@ -23,50 +24,25 @@ def normalize_vecs(d: Dict[str, np.ndarray]):
     return d
 
 def compute_pairwise_cosine_matrix(ids: List[str], emb_map: Dict[str,np.ndarray]) -> np.ndarray:
-    n = len(ids)
-    M = np.zeros((n,n), dtype=np.float32)
-    for i in range(n):
-        vi = emb_map.get(ids[i])
-        if vi is None: continue
-        for j in range(i+1,n):
-            vj = emb_map.get(ids[j])
-            if vj is None: continue
-            sim = float(np.dot(vi, vj))
-            M[i,j] = sim
-            M[j,i] = sim
-    np.fill_diagonal(M, 1.0)
-    return M
+    # ids sin embedding quedan con similitud 0 contra todos (y 1.0 en la diagonal)
+    dim = next((len(emb_map[i]) for i in ids if emb_map.get(i) is not None), 0)
+    V = np.zeros((len(ids), dim), dtype=np.float32)
+    for r, oid in enumerate(ids):
+        v = emb_map.get(oid)
+        if v is not None:
+            V[r] = v
+    return gram_matrix(V)
 
 # greedy hard: seed highest-pair, then add item that maximizes mean pairwise similarity to current set
 def greedy_hard_sets(ids: List[str], M: np.ndarray, k: int, num_sets:int) -> List[List[str]]:
     n = len(ids)
     if k > n: return []
     results = []
-    used_seeds = set()
     # candidate pairs sorted desc
-    pairs = [ (M[i,j], i, j) for i in range(n) for j in range(i+1,n) ]
-    pairs.sort(reverse=True, key=lambda x:x[0])
-    seed_idx = 0
-    while len(results) < num_sets and seed_idx < len(pairs):
-        _, i0, j0 = pairs[seed_idx]
-        seed_idx += 1
-        if (i0,j0) in used_seeds: continue
-        used_seeds.add((i0,j0))
-        cur = [i0, j0]
-        # add greedily
-        while len(cur) < k:
-            best_score = -1e9
-            best_idx = None
-            for cand in range(n):
-                if cand in cur: continue
-                # mean similarity if added
-                sims = [M[cand, other] for other in cur]
-                mean_sim = sum(sims)/len(sims)
-                if mean_sim > best_score:
-                    best_score = mean_sim
-                    best_idx = cand
-            if best_idx is None: break
-            cur.append(best_idx)
+    seeds_i, seeds_j = sorted_pairs(M, descending=True)
+    for i0, j0 in zip(seeds_i, seeds_j):
+        if len(results) >= num_sets: break
+        cur = GreedySet(M, [i0, j0]).grow(k, maximize=True)
         groups = [ids[x] for x in cur]
         # avoid duplicates (by set)
         if groups not in results:
@@ -78,28 +54,10 @@ def greedy_easy_sets(ids: List[str], M: np.ndarray, k: int, num_sets:int) -> Lis
     n = len(ids)
     if k > n: return []
     results = []
-    pairs = [ (M[i,j], i, j) for i in range(n) for j in range(i+1,n) ]
-    pairs.sort(key=lambda x:x[0])  # ascending
-    seed_idx = 0
-    used_seeds = set()
-    while len(results) < num_sets and seed_idx < len(pairs):
-        _, i0, j0 = pairs[seed_idx]
-        seed_idx += 1
-        if (i0,j0) in used_seeds: continue
-        used_seeds.add((i0,j0))
-        cur = [i0, j0]
-        while len(cur) < k:
-            best_score = 1e9
-            best_idx = None
-            for cand in range(n):
-                if cand in cur: continue
-                sims = [M[cand, other] for other in cur]
-                mean_sim = sum(sims)/len(sims)
-                if mean_sim < best_score:
-                    best_score = mean_sim
-                    best_idx = cand
-            if best_idx is None: break
-            cur.append(best_idx)
+    seeds_i, seeds_j = sorted_pairs(M)  # ascending
+    for i0, j0 in zip(seeds_i, seeds_j):
+        if len(results) >= num_sets: break
+        cur = GreedySet(M, [i0, j0]).grow(k, maximize=False)
         groups = [ids[x] for x in cur]
         if groups not in results:
             results.append(groups)
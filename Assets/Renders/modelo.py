@@ -4,6 +4,11 @@ from pathlib import Path
 import numpy as np
 from PIL import Image
 from sklearn.cluster import AgglomerativeClustering, KMeans
+from embedding_store import open_or_build_store
+from similarity_cache import SimilarityCache
+from similarity_kernels import GreedySet, gram_matrix, intra_means, row_map, sorted_pairs
+from clip_embed import ViewCache, encode_views
+from image_index import IMAGE_INDEX_FILE, open_image_index, pick_thumbnail
 
 # ---------- CONFIG ----------
 BASE = Path(r"C:\Users\Agustin\Tesis\Assets\Renders")  # AJUSTA si hace falta
@@ -21,6 +26,8 @@ RNG = random.Random(0)
 # CLIP config (puedes cambiar modelo si querés)
 CLIP_MODEL_NAME = "ViT-B-32"
 CLIP_PRETRAIN = "openai"
+CLIP_BATCH_SIZE = 32                            # vistas por forward de encode_image (CPU)
+CLIP_WORKERS = min(8, os.cpu_count() or 1)     # threads de decode + preprocess
 # ----------------------------
 
 # ---------- try to import open_clip/torch (optional) ----------
@@ -70,126 +77,120 @@ def _load_clip_model_and_preprocess():
         return None, None
 
 def resolve_image_paths_from_entry(entry, base_dir):
-    imgs = entry.get("images", []) or []
+    """Rutas de entry["images"] resueltas con el índice de imágenes de base_dir (ver image_index.py)."""
+    index = open_image_index(base_dir)
     resolved = []
-    for p in imgs:
-        p0 = Path(p)
-        if p0.is_absolute() and p0.exists():
-            resolved.append(p0); continue
-        # try relative to base_dir and some variants
-        candidates = [
-            base_dir / p,
-            base_dir / p0.name,
-            base_dir / p0.parts[-2] / p0.name if len(p0.parts) >= 2 else None
-        ]
-        found = None
-        for c in candidates:
-            if c and c.exists():
-                found = c; break
-        if found:
+    for p in entry.get("images", []) or []:
+        found = index.resolve(p)
+        if found is not None:
             resolved.append(found)
-        else:
-            matches = list(base_dir.glob("**/" + p0.name))
-            if matches:
-                resolved.append(matches[0])
     return resolved
 
 def compute_and_save_embeddings_for_export(export_data, base_renders_dir, emb_dir, model_name=CLIP_MODEL_NAME, pretrained=CLIP_PRETRAIN):
     """
-    Genera .pkl con {'object_id':..., 'vector': np.array} para objetos que no tienen embedding.
-    Si open_clip/torch no están disponibles, devuelve 0 y solo informa.
+    Genera .pkl con {'object_id':..., 'vector': np.array} para objetos sin embedding o cuyo .pkl quedó viejo
+    (renders re-generados o otro modelo/pretrain CLIP, ver ViewCache). Solo se codifican las vistas que no están
+    en el view cache (ni fallaron antes con el mismo contenido). Sin open_clip/torch solo se escriben los objetos
+    cuyas vistas ya están todas en el cache.
     """
     os.makedirs(emb_dir, exist_ok=True)
-    if not _have_clip:
-        print("[INFO] open_clip/torch no instalados -> no se generarán embeddings automáticamente.")
-        return 0
-
-    model, preprocess = _load_clip_model_and_preprocess()
-    if model is None or preprocess is None:
-        print("[WARN] no se pudo cargar modelo CLIP -> no se generarán embeddings.")
-        return 0
+    cache = ViewCache.open(emb_dir, f"{model_name}/{pretrained}")
 
-    created = 0
+    pending, adopted = [], 0   # pending: (oid, emb_fname, digests, firma)
     for obj in export_data:
         oid = obj["object_id"]
         emb_fname = emb_dir / (oid.replace("/", "_") + ".pkl")
-        if emb_fname.exists():
-            continue
         img_paths = resolve_image_paths_from_entry(obj, base_renders_dir)
         if not img_paths:
-            print(f"[WARN] no hay imágenes encontradas para {oid} -> no se crea embedding.")
+            if not emb_fname.exists():
+                print(f"[WARN] no hay imágenes encontradas para {oid} -> no se crea embedding.")
             continue
-        vectors = []
+        views = []
         for ip in img_paths:
             try:
-                im = Image.open(ip).convert("RGB")
-                tensor = preprocess(im).unsqueeze(0).to(DEVICE)
-                with torch.no_grad():
-                    v = model.encode_image(tensor)
-                    v = v / v.norm(dim=-1, keepdim=True)
-                    v = v.cpu().numpy().astype(np.float32).reshape(-1)
-                    vectors.append(v)
-            except Exception as e:
+                views.append((ip, cache.digest(ip)))
+            except OSError as e:
                 print(f"[WARN] error procesando imagen {ip} para {oid}: {e}")
-        if not vectors:
+        digests = [d for _, d in views]
+        signature = cache.object_signature(digests)
+        cache.set_views(oid, digests)
+        if emb_fname.exists():
+            if cache.objects.get(oid) == signature:
+                continue
+            if cache.fresh:
+                # primera corrida con view cache: el .pkl existente se toma como válido solo si es posterior a
+                # todas sus vistas (si algún render es más nuevo, el .pkl puede ser de los renders anteriores)
+                if all(os.path.getmtime(emb_fname) > os.path.getmtime(ip) for ip, _ in views):
+                    cache.set_object(oid, signature); adopted += 1
+                    continue
+                print(f"[INFO] hay renders más nuevos que {emb_fname.name} -> se recalcula su embedding")
+            else:
+                print(f"[INFO] renders o modelo CLIP cambiaron para {oid} -> se recalcula su embedding")
+        pending.append((oid, emb_fname, views, signature))
+    if adopted:
+        print(f"[INFO] view cache inicializado con {adopted} embeddings existentes")
+
+    # vistas sin vector en el cache (una vez por contenido), todas juntas a encode_views
+    todo = {}
+    for oid, _, views, _ in pending:
+        for ip, d in views:
+            if d not in cache.vectors and d not in cache.failed and d not in todo:
+                todo[d] = (ip, oid)
+    model, preprocess = (None, None)
+    if todo and _have_clip:
+        model, preprocess = _load_clip_model_and_preprocess()
+    if todo and (model is None or preprocess is None):
+        # sin modelo: igual se escriben los objetos que no necesitan ninguna vista nueva
+        pending = [p for p in pending if not any(d in todo for _, d in p[2])]
+        print(f"[INFO] open_clip/torch no disponibles -> no se codifican {len(todo)} vistas nuevas; "
+              f"{len(pending)} objetos se arman con vistas del cache.")
+    elif todo:
+        digests = list(todo)
+        paths = [todo[d][0] for d in digests]
+        print(f"[INFO] codificando {len(paths)} vistas nuevas de {len(pending)} objetos "
+              f"(lotes de {CLIP_BATCH_SIZE}, {CLIP_WORKERS} workers)")
+
+        def on_error(i, e):
+            print(f"[WARN] error procesando imagen {paths[i]} para {todo[digests[i]][1]}: {e}")
+            cache.mark_failed(digests[i])
+        vectors, rows = encode_views(model, preprocess, paths, device=DEVICE, batch_size=CLIP_BATCH_SIZE,
+                                     workers=CLIP_WORKERS, on_error=on_error)
+        for v, i in zip(vectors, rows):
+            cache.add(digests[i], v)
+
+    created = 0
+    for oid, emb_fname, views, signature in pending:
+        emb = cache.object_vector([d for _, d in views])
+        if emb is None:
             print(f"[WARN] no se pudo extraer vector de ninguna imagen de {oid}")
             continue
-        emb = np.mean(np.vstack(vectors), axis=0)
-        emb = emb / (np.linalg.norm(emb) + 1e-12)
         try:
             with open(emb_fname, "wb") as f:
                 pickle.dump({"object_id": oid, "vector": emb}, f)
+            cache.set_object(oid, signature)
             created += 1
             print(f"[OK] embedding creado: {emb_fname.name}")
         except Exception as e:
             print(f"[ERROR] no se pudo guardar embedding para {oid}: {e}")
+    cache.save()
     print(f"[INFO] embeddings creados: {created}")
     return created
 
 # ---------- existing embedding loader ----------
-def load_embedding_for_object(obj_id):
-    fname = str(obj_id).replace("/", "_") + ".pkl"
-    p = EMB_DIR / fname
-    if not p.exists(): return None
-    try:
-        with open(p, "rb") as f: data = pickle.load(f)
-        vec = data.get("vector") if isinstance(data, dict) else None
-        if vec is None: return None
-        v = np.array(vec, dtype=np.float32)
-        norm = np.linalg.norm(v)
-        if norm > 0: v = v / norm
-        return v
-    except Exception as e:
-        print(f"[WARN] error cargando pickle {p}: {e}")
-        return None
-
-def build_emb_map(export_data):
-    emb_map = {}
-    for obj in export_data:
-        oid = obj["object_id"]
-        vec = load_embedding_for_object(oid)
-        if vec is not None:
-            emb_map[oid] = vec
-    return emb_map
+def build_emb_map(export_data, store):
+    """object_id -> vector, leído del store consolidado (una sola matriz mmap, sin abrir un .pkl por objeto)."""
+    return store.as_emb_map(obj["object_id"] for obj in export_data)
 
 # ---------- rest of pipeline helpers (unchanged) ----------
-def pairwise_cosine(ids, emb_map):
-    n = len(ids)
-    M = np.eye(n, dtype=np.float32)
-    for i in range(n):
-        vi = emb_map[ids[i]]
-        for j in range(i+1, n):
-            vj = emb_map[ids[j]]
-            M[i,j] = M[j,i] = float(np.dot(vi, vj))
-    return M
-
-def intra_mean_for_group(group_ids, ids_list, M):
-    idxs = [ ids_list.index(g) for g in group_ids ]
-    if len(idxs) <= 1: return 0.0
-    sub = M[np.ix_(idxs, idxs)]
-    s = sub.sum() - np.trace(sub)
-    denom = (len(idxs)*(len(idxs)-1))
-    return float(s/denom) if denom>0 else 0.0
+def pairwise_cosine(ids, emb_map, sim_cache=None):
+    # con sim_cache (pares del embedding store ya calculados en corridas previas) no se recalcula ningún np.dot
+    if sim_cache is not None and all(i in sim_cache.store for i in ids):
+        return sim_cache.matrix([sim_cache.store.row(i) for i in ids])
+    return gram_matrix(np.vstack([ emb_map[i] for i in ids ]))
+
+def group_intra_means(groups, rows, M):
+    """intra-mean (sin diagonal) de cada grupo de object_ids, todos juntos; rows = row_map(ids) de M."""
+    return [ float(v) for v in intra_means(M, [[ rows[g] for g in group ] for group in groups]) ]
 
 def max_sets_allowed(n, k, requested): return max(1, min(requested, n // k))
 def medoid_of_indices(idxs, ids, M):
@@ -225,25 +226,12 @@ def generate_easy_hard_sets_with_embmap(ids, emb_map, M, k, num_sets, disjoint=T
         rng.shuffle(pairs)
         for score, ia, jb in pairs:
             if len(hard_candidates) >= max_sets * 4: break
-            cur = [ idxs[ia], idxs[jb] ]
-            while len(cur) < k:
-                best_idx = None; best_mean = -1e9
-                for cand in idxs:
-                    if cand in cur: continue
-                    sims = [ M[cand, other] for other in cur ]
-                    mean_sim = sum(sims)/len(sims)
-                    if mean_sim > best_mean:
-                        best_mean = mean_sim; best_idx = cand
-                if best_idx is None: break
-                cur.append(best_idx)
+            # greedy dentro del cluster (subM, índices locales en el orden de idxs)
+            cur = GreedySet(subM, [ia, jb]).grow(k, maximize=True)
             if len(cur) == k:
-                hard_candidates.append([ ids[x] for x in cur ])
-    def intra_mean_group(group):
-        idxs = [ ids.index(g) for g in group ]
-        sub = M[np.ix_(idxs, idxs)]
-        s = sub.sum() - np.trace(sub)
-        denom = (len(group)*(len(group)-1)); return float(s/denom) if denom>0 else 0.0
-    hard_sorted = sorted(hard_candidates, key=lambda g: intra_mean_group(g), reverse=True)
+                hard_candidates.append([ ids[idxs[x]] for x in cur ])
+    hard_scores = group_intra_means(hard_candidates, row_map(ids), M)
+    hard_sorted = [ hard_candidates[i] for i in sorted(range(len(hard_candidates)), key=lambda i: hard_scores[i], reverse=True) ]
     hard_selected = []; used = set()
     for g in hard_sorted:
         if len(hard_selected) >= max_sets: break
@@ -285,21 +273,11 @@ def generate_easy_hard_sets_with_embmap(ids, emb_map, M, k, num_sets, disjoint=T
             if disjoint: used.update(group)
     # fallback if none
     if not easy_selected:
-        pairs = sorted([ (M[i,j], i, j) for i in range(n) for j in range(i+1,n) ], key=lambda x: x[0])
-        seed_idx = 0
-        while len(easy_selected) < max_sets and seed_idx < len(pairs):
-            _, i0, j0 = pairs[seed_idx]; seed_idx += 1
-            cur = [i0,j0]
-            while len(cur) < k:
-                best_score = 1e9; best_idx = None
-                for cand in range(n):
-                    if cand in cur or (disjoint and ids[cand] in used): continue
-                    sims = [ M[cand, other] for other in cur ]
-                    mean_sim = sum(sims)/len(sims)
-                    if mean_sim < best_score:
-                        best_score = mean_sim; best_idx = cand
-                if best_idx is None: break
-                cur.append(best_idx)
+        seeds_i, seeds_j = sorted_pairs(M)
+        for i0, j0 in zip(seeds_i, seeds_j):
+            if len(easy_selected) >= max_sets: break
+            blocked = np.fromiter((ids[c] in used for c in range(n)), dtype=bool, count=n) if disjoint else None
+            cur = GreedySet(M, [i0, j0], blocked=blocked).grow(k, maximize=False)
             if len(cur) == k:
                 easy_selected.append([ ids[x] for x in cur ])
                 if disjoint: used.update([ ids[x] for x in cur ])
@@ -308,24 +286,12 @@ def generate_easy_hard_sets_with_embmap(ids, emb_map, M, k, num_sets, disjoint=T
 # image helpers (same logic as antes)
 def find_thumbnail_for_object(oid, base_dir):
     folder = oid.split("/")[-1]
-    candidates = [
-        base_dir / folder,
-        base_dir / "Assets" / "Renders" / folder,
-        base_dir
-    ]
-    for fp in candidates[:2]:
-        if fp.exists() and fp.is_dir():
-            imgs = sorted([p for p in fp.glob("*.png")])
-            if imgs:
-                for pat in ["*v0_l0*.png","*v0*.png","*.png"]:
-                    matched = [p for p in imgs if p.match(pat)]
-                    if matched: return matched[0]
-                return imgs[0]
-    deep = list(base_dir.glob(f"**/{folder}/*v0*png"))
-    if deep: return deep[0]
-    deep_any = list(base_dir.glob(f"**/{folder}/*.png"))
-    if deep_any: return deep_any[0]
-    return None
+    index = open_image_index(base_dir)
+    for rel_dir in (folder, f"Assets/Renders/{folder}"):
+        imgs = index.images_in(rel_dir)
+        if imgs:
+            return pick_thumbnail(imgs)
+    return pick_thumbnail(index.folder_images(folder), patterns=("*v0*png",))
 
 def create_and_save_group_image(group_ids, base_dir, save_path, title=""):
     from PIL import Image, ImageDraw, ImageFont
@@ -367,6 +333,8 @@ def create_and_save_group_image(group_ids, base_dir, save_path, title=""):
 
 # ---------- pipeline ----------
 export_data = load_export(EXPORT_JSON)
+# un solo recorrido de BASE (o el índice guardado si nada cambió) para resolver renders y thumbnails
+open_image_index(BASE, EMB_DIR / IMAGE_INDEX_FILE)
 
 # --- generate embeddings for missing objects before building emb_map ---
 print("[INFO] buscando objetos sin embedding (.pkl) y generándolos si es posible...")
@@ -383,7 +351,10 @@ for obj in export_data:
 # load existing results to reuse
 existing = load_existing_out(OUT_JSON)
 
-emb_map = build_emb_map(export_data)
+# store consolidado embeddings.npy (+ ids); se regenera si hay .pkl nuevos
+emb_store = open_or_build_store(EMB_DIR)
+emb_map = build_emb_map(export_data, emb_store)
+sim_cache = SimilarityCache.open(emb_store, EMB_DIR)
 print(f"[INFO] embeddings disponibles tras intento de creación: {len(emb_map)} objects")
 
 final = {"categories": []}
@@ -407,7 +378,7 @@ for cat, subs in category_map.items():
             print(f"[INFO] saltando subpool {sp} en categoria {cat}: n_embeddings_validos={len(ids)} (<2)")
             continue
         print(f"[INFO] Processing category={cat} subpool={sp} (n={len(ids)})")
-        M = pairwise_cosine(ids, emb_map)
+        M = pairwise_cosine(ids, emb_map, sim_cache)
         sp_entry = {"subpoolId": sp, "sets": []}
         for k in SIZES:
             if k > len(ids): continue
@@ -423,12 +394,12 @@ for cat, subs in category_map.items():
                 continue
 
             easy_sets, hard_sets = generate_easy_hard_sets_with_embmap(ids, emb_map, M, k, NUM_SETS, disjoint=DISJOINT, rng=RNG)
-            all_groups = [("easy", g) for g in easy_sets] + [("hard", g) for g in hard_sets]
-            intra_vals = [ intra_mean_for_group(g, ids, M) for _, g in all_groups ]
+            rows = row_map(ids)
+            intra_easy, intra_hard = group_intra_means(easy_sets, rows, M), group_intra_means(hard_sets, rows, M)
+            intra_vals = intra_easy + intra_hard
             minv, maxv = (min(intra_vals), max(intra_vals)) if intra_vals else (0.0, 1.0)
-            for diff, groups in [("hard", hard_sets), ("easy", easy_sets)]:
-                for idx, g in enumerate(groups, start=1):
-                    im = intra_mean_for_group(g, ids, M)
+            for diff, groups, intra in [("hard", hard_sets, intra_hard), ("easy", easy_sets, intra_easy)]:
+                for idx, (g, im) in enumerate(zip(groups, intra), start=1):
                     norm = (im - minv) / (maxv - minv) if (maxv - minv) > 1e-6 else 0.0
                     hardness_pct = float(norm * 100.0)
                     easiness_pct = float((1.0 - norm) * 100.0)
@@ -456,5 +427,6 @@ if existing:
             final["categories"].append(c)
 
 save_json(final, OUT_JSON)
+sim_cache.save()
 print(f"[INFO] Saved difficulty sets JSON: {OUT_JSON}")
 print(f"[INFO] Visuals in: {VIZ_DIR}")
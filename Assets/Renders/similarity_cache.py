@@ -0,0 +1,113 @@
+# similarity_cache.py
+# Cache persistente de similitudes coseno entre pares de objetos del embedding store.
+#   embeddings/similarity_cache.npz -> {"version": versión del store, "n": filas del store,
+#                                       "keys": fila_a * n + fila_b (a <= b, ordenadas), "values": float32}
+# Los valores son exactamente float32(np.dot(v_a, v_b)), lo mismo que calculaban pairwise_cosine (modelo.py) y
+# compute_similarity_aggs_for_trial (processTrialAndTrain.py), así que usar el cache no cambia ningún resultado.
+# Si el store cambia (otra versión) el cache se descarta y se vuelve a llenar.
+import os
+from pathlib import Path
+from typing import Optional, Sequence
+import numpy as np
+from embedding_store import EmbeddingStore
+
+CACHE_FILE = "similarity_cache.npz"
+
+def pair_dots(V: np.ndarray, a: np.ndarray, b: np.ndarray, chunk: int = 8192) -> np.ndarray:
+    """np.dot(V[a[i]], V[b[i]]) como float32. Se calcula una vez por par distinto; el matmul apilado
+    (k,1,D)@(k,D,1) usa el mismo producto punto que np.dot (un V @ V.T redondea distinto)."""
+    if len(a) == 0:
+        return np.zeros(0, dtype=np.float32)
+    keys, inv = np.unique(np.asarray(a, dtype=np.int64) * len(V) + b, return_inverse=True)
+    ua, ub = keys // len(V), keys % len(V)
+    dots = np.empty(len(keys), dtype=np.float32)
+    for s in range(0, len(keys), chunk):
+        e = min(s + chunk, len(keys))
+        dots[s:e] = np.matmul(V[ua[s:e]][:, None, :], V[ub[s:e]][:, :, None]).reshape(-1)
+    return dots[inv.reshape(-1)]
+
+class SimilarityCache:
+    """Pares (fila_a, fila_b) del store -> similitud. Los pares que faltan se calculan y se agregan (save() los persiste)."""
+    def __init__(self, store: EmbeddingStore, path: Optional[Path] = None):
+        self.store = store
+        self.path = Path(path) if path else None
+        self.n = len(store)
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.values = np.zeros(0, dtype=np.float32)
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def open(cls, store: EmbeddingStore, emb_dir: Path) -> "SimilarityCache":
+        """Cache de emb_dir/similarity_cache.npz; vacío si no existe o es de otra versión del store."""
+        cache = cls(store, Path(emb_dir) / CACHE_FILE)
+        if cache.path.exists():
+            try:
+                with np.load(cache.path, allow_pickle=False) as z:
+                    version, n = str(z["version"]), int(z["n"])
+                    if version == store.version and n == cache.n:
+                        cache.keys, cache.values = z["keys"], z["values"]
+                    else:
+                        print(f"[INFO] similarity cache {cache.path.name} es de otra versión del store -> se regenera")
+            except Exception as e:
+                print(f"[WARN] no se pudo leer {cache.path}: {e} -> se regenera")
+        return cache
+
+    def __len__(self):
+        return len(self.keys)
+
+    def dots(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Similitud de cada par (a[i], b[i]) de filas del store (float32)."""
+        a = np.asarray(a, dtype=np.int64); b = np.asarray(b, dtype=np.int64)
+        keys = np.minimum(a, b) * self.n + np.maximum(a, b)
+        out = np.empty(len(keys), dtype=np.float32)
+        pos = np.searchsorted(self.keys, keys)
+        found = pos < len(self.keys)
+        found[found] = self.keys[pos[found]] == keys[found]
+        out[found] = self.values[pos[found]]
+        miss = ~found
+        self.hits += int(found.sum())
+        if miss.any():
+            new_keys = np.unique(keys[miss])
+            new_vals = pair_dots(self.store.matrix, new_keys // self.n, new_keys % self.n)
+            self.misses += len(new_keys)
+            out[miss] = new_vals[np.searchsorted(new_keys, keys[miss])]
+            self._insert(new_keys, new_vals)
+        return out
+
+    def _insert(self, new_keys: np.ndarray, new_vals: np.ndarray):
+        merged = np.concatenate([self.keys, new_keys])
+        order = np.argsort(merged, kind="stable")
+        self.keys = merged[order]
+        self.values = np.concatenate([self.values, new_vals])[order]
+        self.dirty = True
+
+    def update(self, keys: np.ndarray, values: np.ndarray):
+        """Agrega pares calculados por otro proceso (p.ej. los workers de --workers) con la misma versión del store."""
+        keys = np.asarray(keys, dtype=np.int64)
+        new = ~np.isin(keys, self.keys)
+        if new.any():
+            self._insert(keys[new], np.asarray(values, dtype=np.float32)[new])
+
+    def matrix(self, rows: Sequence[int]) -> np.ndarray:
+        """Matriz de similitud (n, n) entre las filas dadas, con 1.0 en la diagonal (como pairwise_cosine)."""
+        rows = np.asarray(rows, dtype=np.int64)
+        n = len(rows)
+        M = np.eye(n, dtype=np.float32)
+        if n > 1:
+            i, j = np.triu_indices(n, k=1)
+            M[i, j] = M[j, i] = self.dots(rows[i], rows[j])
+        return M
+
+    def save(self):
+        if not self.dirty or self.path is None:
+            return
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        try:
+            with open(tmp, "wb") as f:
+                np.savez(f, version=np.array(self.store.version), n=np.array(self.n), keys=self.keys, values=self.values)
+            os.replace(tmp, self.path)
+            self.dirty = False
+        except OSError as e:
+            print(f"[WARN] no se pudo guardar el similarity cache en {self.path}: {e}")
@@ -0,0 +1,110 @@
+# similarity_kernels.py
+# Kernels de similitud compartidos por modelo.py, make_difficulty_sets.py y resultado.py:
+#   - gram_matrix: matriz coseno (n, n) con V @ V.T por bloques (memoria acotada para n grande), simétrica exacta,
+#     guardada en float32 o float16
+#   - row_map: object_id -> fila en O(1) (en lugar de ids.index(g) por miembro)
+#   - intra_means: similitud media intra-grupo (sin diagonal) de muchos grupos candidatos de una vez
+#   - sorted_pairs / GreedySet: semillas (pares ordenados por similitud) y armado greedy de grupos con un vector de
+#     sumas por candidato que se actualiza con una fila por miembro agregado (+ máscara booleana de miembros)
+# V @ V.T redondea distinto que np.dot por par (ver similarity_cache.pair_dots) en el último bit de float32; donde hace
+# falta reproducir exactamente los valores de np.dot modelo.py sigue usando el SimilarityCache.
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+GRAM_BLOCK = 2048
+
+def row_map(ids: Sequence[str]) -> Dict[str,int]:
+    """object_id -> fila (la primera, como ids.index)."""
+    rows = {}
+    for i, oid in enumerate(ids):
+        rows.setdefault(oid, i)
+    return rows
+
+def gram_matrix(V: np.ndarray, block: int = GRAM_BLOCK, dtype=np.float32, unit_diagonal: bool = True) -> np.ndarray:
+    """V @ V.T (V con filas normalizadas -> cosenos). Se calcula en float32 por bloques de block filas (solo el
+    triángulo superior de bloques, el inferior se espeja) y se guarda en dtype (float16 para n muy grande)."""
+    V = np.ascontiguousarray(V, dtype=np.float32)
+    n = len(V)
+    M = np.empty((n, n), dtype=dtype)
+    for s in range(0, n, block):
+        e = min(s + block, n)
+        for t in range(s, n, block):
+            u = min(t + block, n)
+            B = V[s:e] @ V[t:u].T
+            if t == s:
+                B = np.triu(B) + np.triu(B, 1).T
+            M[s:e, t:u] = B
+            if t != s:
+                M[t:u, s:e] = B.T
+    if unit_diagonal:
+        np.fill_diagonal(M, 1.0)
+    return M
+
+def intra_means(M: np.ndarray, groups: Sequence[Sequence[int]]) -> np.ndarray:
+    """Media de M[a, b] (a != b) dentro de cada grupo de filas; 0.0 para grupos de menos de 2.
+    Los grupos del mismo tamaño se evalúan juntos con un solo fancy-index (G, k, k); el resultado es el mismo que
+    sub.sum() - np.trace(sub) grupo por grupo."""
+    out = np.zeros(len(groups), dtype=M.dtype)
+    by_size: Dict[int,List[int]] = {}
+    for gi, g in enumerate(groups):
+        by_size.setdefault(len(g), []).append(gi)
+    for k, pos in by_size.items():
+        if k <= 1:
+            continue
+        idx = np.asarray([groups[gi] for gi in pos], dtype=np.int64)
+        sub = M[idx[:, :, None], idx[:, None, :]]
+        s = sub.reshape(len(pos), k * k).sum(axis=1) - np.diagonal(sub, axis1=1, axis2=2).sum(axis=1)
+        out[pos] = s / (k * (k - 1))
+    return out
+
+def sorted_pairs(M: np.ndarray, descending: bool = False) -> Tuple[np.ndarray,np.ndarray]:
+    """Pares (i, j), i < j, ordenados por M[i, j]; los empates quedan en orden (i, j) como con list.sort(key=...)."""
+    i, j = np.triu_indices(len(M), k=1)
+    vals = M[i, j]
+    order = np.argsort(-vals if descending else vals, kind="stable")
+    return i[order], j[order]
+
+class GreedySet:
+    """
+    Grupo que se arma de a un miembro. score[c] es la suma de M[c, miembro] en orden de inserción (mismo dtype que M,
+    así score / len da exactamente lo mismo que sum([M[c, o] for o in cur]) / len(cur)); mask marca miembros y filas
+    bloqueadas (p.ej. objetos ya usados en otro grupo disjunto).
+    """
+    def __init__(self, M: np.ndarray, members: Sequence[int] = (), blocked: Optional[np.ndarray] = None):
+        self.M = M
+        self.members: List[int] = []
+        self.score = np.zeros(len(M), dtype=M.dtype)
+        self.mask = np.zeros(len(M), dtype=bool) if blocked is None else np.array(blocked, dtype=bool)
+        for r in members:
+            self.add(r)
+
+    def __len__(self):
+        return len(self.members)
+
+    def add(self, r: int):
+        self.members.append(int(r))
+        self.score += self.M[:, r]
+        self.mask[r] = True
+
+    def best(self, maximize: bool = True, bound: float = None) -> Optional[int]:
+        """Candidato (fuera de mask) con la mayor / menor similitud media a los miembros, el primero en caso de
+        empate; solo si supera estrictamente a bound (default ±1e9). None si no hay."""
+        if bound is None:
+            bound = -1e9 if maximize else 1e9
+        mean = self.score / len(self.members)
+        if maximize:
+            vals = np.where(~self.mask & (mean > bound), mean, -np.inf)
+            c = int(np.argmax(vals))
+            return c if vals[c] > -np.inf else None
+        vals = np.where(~self.mask & (mean < bound), mean, np.inf)
+        c = int(np.argmin(vals))
+        return c if vals[c] < np.inf else None
+
+    def grow(self, k: int, maximize: bool = True, bound: float = None) -> List[int]:
+        """Agrega el mejor candidato hasta tener k miembros (o hasta que no quede ninguno)."""
+        while len(self.members) < k:
+            c = self.best(maximize, bound)
+            if c is None:
+                break
+            self.add(c)
+        return self.members
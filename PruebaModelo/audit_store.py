@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+audit_store.py - sinks para los registros de auditoría por trial de processTrialAndTrain.py
+
+Un registro = descripción parseada del trial + sim_* + set_* + _session_id/_trial_index.
+Sinks (--audit-sink):
+ - files : un {session}_trial_{idx}.json por trial en trial_jsons/ (formato original)
+ - jsonl : un único trial_audit.jsonl append-only (jsonl.gz: comprimido); el último registro de una key gana
+ - sqlite: tabla trial_audit en trial_audit.sqlite con PRIMARY KEY (session_id, trial_index)
+Todos escriben en lotes (batch_size registros por write/transacción). En --incremental el sink se abre con drop_keys
+(trials de logs modificados + los que se vuelven a escribir): sqlite los borra con DELETE, files borra sus JSON y
+jsonl compacta el archivo (una línea por key, la última, sin las de drop_keys) antes de agregar los nuevos, así el
+store no acumula trials que ya no existen ni duplicados.
+
+Lookup de un trial:
+  python audit_store.py out_logs/trial_audit.sqlite sess_001 12
+"""
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+AUDIT_SINKS = ["files", "jsonl", "jsonl.gz", "sqlite"]
+
+def _json_default(o):
+    # numpy scalars que se cuelan desde el DataFrame
+    if isinstance(o, np.generic):
+        return o.item()
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    return str(o)
+
+def audit_key(record: Dict[str,Any]):
+    return record.get("_session_id"), record.get("_trial_index")
+
+def _store_key(session_id, trial_index) -> Tuple[Optional[str],Optional[int]]:
+    """(session_id, trial_index) normalizada como la guardan los stores (id como str, índice entero)."""
+    return (None if session_id is None else str(session_id), None if trial_index is None else int(trial_index))
+
+def _open_text(path: Path, mode: str, gz: Optional[bool] = None):
+    gz = path.suffix == ".gz" if gz is None else gz
+    return gzip.open(path, mode, encoding="utf8") if gz else open(path, mode, encoding="utf8")
+
+def compact_jsonl(path: Path, drop_keys: Iterable[Tuple[Any,Any]] = ()) -> int:
+    """
+    Reescribe un trial_audit.jsonl[.gz] con una línea por key (la última, la que ve lookup) y sin las de drop_keys.
+    Dos pasadas por el archivo (en memoria solo key -> número de línea). Devuelve cuántas líneas se descartaron.
+    """
+    path = Path(path)
+    drop = {_store_key(*k) for k in drop_keys}
+    last: Dict[Tuple,int] = {}
+    with _open_text(path, "rt") as f:
+        for i, line in enumerate(f):
+            last[_store_key(*audit_key(json.loads(line)))] = i
+    keep = {i for k, i in last.items() if k not in drop}
+    tmp = path.with_name(path.name + ".tmp")
+    n = 0
+    with _open_text(path, "rt") as src, _open_text(tmp, "wt", gz=path.suffix == ".gz") as dst:
+        for i, line in enumerate(src):
+            n += 1
+            if i in keep:
+                dst.write(line)
+    os.replace(tmp, path)
+    return n - len(keep)
+
+class AuditSink:
+    """Base: acumula registros y los escribe de a batch_size. Usar como context manager."""
+    def __init__(self, batch_size: int = 5000):
+        self.batch_size = batch_size
+        self.pending: List[Dict[str,Any]] = []
+        self.written = 0
+
+    def write(self, record: Dict[str,Any]):
+        self.pending.append(record)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def write_many(self, records: Iterable[Dict[str,Any]]):
+        for r in records:
+            self.write(r)
+
+    def flush(self):
+        if self.pending:
+            self._write_batch(self.pending)
+            self.written += len(self.pending)
+            self.pending = []
+
+    def _write_batch(self, records: List[Dict[str,Any]]):
+        raise NotImplementedError
+
+    def delete(self, keys: Set[Tuple[Any,Any]]):
+        """Borra los registros de esas (session_id, trial_index) (trials que ya no existen o que se reescriben)."""
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class FilesAuditSink(AuditSink):
+    """Un JSON por trial (layout original de trial_jsons/)."""
+    def __init__(self, directory: Path, batch_size: int = 5000):
+        super().__init__(batch_size)
+        self.path = Path(directory)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _write_batch(self, records):
+        for audit in records:
+            fname = f"{audit.get('_session_id','unknown')}_trial_{audit.get('_trial_index','idx')}.json"
+            (self.path / fname).write_text(json.dumps(audit, ensure_ascii=False, indent=2, default=_json_default), encoding="utf8")
+
+    def delete(self, keys):
+        for sid, idx in (_store_key(*k) for k in keys):
+            (self.path / f"{sid}_trial_{idx}.json").unlink(missing_ok=True)
+
+class JsonlAuditSink(AuditSink):
+    """Un registro por línea; reset=False agrega al final (gzip soporta append como miembros concatenados)."""
+    def __init__(self, path: Path, reset: bool = False, batch_size: int = 5000):
+        super().__init__(batch_size)
+        self.path = Path(path)
+        self.f = _open_text(self.path, "wt" if reset else "at")
+
+    def delete(self, keys):
+        # el archivo es append-only: se compacta sin esas keys (y sin duplicados) y se sigue agregando al final
+        self.flush()
+        self.f.close()
+        if self.path.exists():
+            compact_jsonl(self.path, keys)
+        self.f = _open_text(self.path, "at")
+
+    def _write_batch(self, records):
+        self.f.write("".join(json.dumps(r, ensure_ascii=False, default=_json_default) + "\n" for r in records))
+
+    def close(self):
+        super().close()
+        self.f.close()
+
+class SqliteAuditSink(AuditSink):
+    """Tabla trial_audit(session_id, trial_index, record); INSERT OR REPLACE por lote en una transacción."""
+    def __init__(self, path: Path, reset: bool = False, batch_size: int = 5000):
+        super().__init__(batch_size)
+        self.path = Path(path)
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        if reset:
+            self.conn.execute("DROP TABLE IF EXISTS trial_audit")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS trial_audit ("
+                          "session_id TEXT, trial_index INTEGER, record TEXT NOT NULL, "
+                          "PRIMARY KEY (session_id, trial_index))")
+        self.conn.commit()
+
+    def _write_batch(self, records):
+        rows = []
+        for r in records:
+            sid, idx = audit_key(r)
+            rows.append((None if sid is None else str(sid), idx, json.dumps(r, ensure_ascii=False, default=_json_default)))
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO trial_audit (session_id, trial_index, record) VALUES (?, ?, ?)", rows)
+
+    def delete(self, keys):
+        with self.conn:
+            self.conn.executemany("DELETE FROM trial_audit WHERE session_id IS ? AND trial_index IS ?",
+                                  [_store_key(sid, idx) for sid, idx in keys])
+
+    def close(self):
+        super().close()
+        self.conn.close()
+
+def audit_store_path(outdir: Path, sink: str) -> Path:
+    return {
+        "files": outdir / "trial_jsons",
+        "jsonl": outdir / "trial_audit.jsonl",
+        "jsonl.gz": outdir / "trial_audit.jsonl.gz",
+        "sqlite": outdir / "trial_audit.sqlite",
+    }[sink]
+
+def open_audit_sink(outdir: Path, sink: str, reset: bool = False, batch_size: int = 5000,
+                    drop_keys: Optional[Set[Tuple[Any,Any]]] = None) -> AuditSink:
+    """
+    reset=True vacía el store (corrida completa; el sink files nunca borra JSONs existentes). drop_keys: registros a
+    borrar antes de escribir (--incremental: trials de logs modificados y los que se vuelven a escribir).
+    """
+    path = audit_store_path(outdir, sink)
+    if sink == "files":
+        out = FilesAuditSink(path, batch_size=batch_size)
+    elif sink in ("jsonl", "jsonl.gz"):
+        out = JsonlAuditSink(path, reset=reset, batch_size=batch_size)
+    elif sink == "sqlite":
+        out = SqliteAuditSink(path, reset=reset, batch_size=batch_size)
+    else:
+        raise ValueError(f"unknown audit sink: {sink}")
+    if drop_keys and not reset:
+        out.delete(drop_keys)
+    return out
+
+# ---------------------------
+# Lookup
+# ---------------------------
+def lookup_audit(store: Path, session_id: str, trial_index: int) -> Optional[Dict[str,Any]]:
+    """Registro de auditoría de un trial; el tipo de store se deduce de la ruta (directorio, .jsonl[.gz], .sqlite)."""
+    store = Path(store)
+    if store.is_dir():
+        p = store / f"{session_id}_trial_{trial_index}.json"
+        return json.loads(p.read_text(encoding="utf8")) if p.exists() else None
+    if store.suffix in (".sqlite", ".db"):
+        conn = sqlite3.connect(f"file:{store}?mode=ro", uri=True)
+        try:
+            row = conn.execute("SELECT record FROM trial_audit WHERE session_id = ? AND trial_index = ?",
+                               (str(session_id), int(trial_index))).fetchone()
+        finally:
+            conn.close()
+        return json.loads(row[0]) if row else None
+    opener = gzip.open if store.suffix == ".gz" else open
+    found = None
+    # filtro barato por substring antes de decodificar la línea entera: el id tal como lo escribe json.dumps
+    # (mismo ensure_ascii=False que JsonlAuditSink), así comillas, "\\" o caracteres de control escapados también coinciden
+    needle = json.dumps(str(session_id), ensure_ascii=False)[1:-1]
+    with opener(store, "rt", encoding="utf8") as f:
+        for line in f:
+            if needle not in line:
+                continue
+            rec = json.loads(line)
+            if str(rec.get("_session_id")) == str(session_id) and rec.get("_trial_index") == int(trial_index):
+                found = rec  # append-only: el último gana
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch one trial's audit record")
+    parser.add_argument("store", help="trial_jsons/ directory, trial_audit.jsonl[.gz] or trial_audit.sqlite")
+    parser.add_argument("session_id")
+    parser.add_argument("trial_index", type=int)
+    args = parser.parse_args()
+    rec = lookup_audit(Path(args.store), args.session_id, args.trial_index)
+    if rec is None:
+        print(f"[WARN] no audit record for session={args.session_id} trial={args.trial_index}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(rec, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
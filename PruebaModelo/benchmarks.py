@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+benchmarks.py - micro-benchmarks del pipeline de processTrialAndTrain.py
+
+Cada benchmark compara la implementación anterior (copiada acá como referencia, *_legacy)
+con la actual sobre datos sintéticos y verifica que den el mismo resultado.
+
+Uso:
+  python benchmarks.py normalization --n 1000000
+  python benchmarks.py similarity --n 200000
+  python benchmarks.py set-lookup --n 200000
+  python benchmarks.py sessions --n 1000000
+  python benchmarks.py workers --n 1000000 --workers 4
+  python benchmarks.py accumulators --n 200000 --shards 4
+  python benchmarks.py rf-features --n 1000000
+"""
+import argparse
+import json
+import os
+import random
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+import processTrialAndTrain as ptt
+
+# ---------------------------
+# Datos sintéticos
+# ---------------------------
+def synthetic_trial_events(n: int, seed: int = 0, n_objects: int = 86, noise_every: int = 50) -> List[Dict[str,Any]]:
+    """Eventos con el mismo formato que LogManager.EnqueueTrial (description = JsonUtility.ToJson(trial))."""
+    rng = random.Random(seed)
+    objects = [f"Estatuas/obj_{i:03d}" for i in range(n_objects)]
+    events = []
+    for i in range(n):
+        group = rng.sample(objects, rng.choice([2, 4, 6, 8, 10, 12]))
+        trial = {
+            "session_id": f"sess_{i // 120:05d}", "participant_id": f"p_{i // 480:04d}", "timestamp": "2025-01-01T00:00:00Z",
+            "trial_index": i % 120, "phase": rng.choice(["Test", " test"]), "object_id": group[0],
+            "object_category": "Estatuas", "object_subpool": "Estatuas_1",
+            "object_similarity_label": rng.choice(["High", "low ", "target"]),
+            "object_actual_moved": rng.random() < 0.5, "participant_said_moved": rng.random() < 0.5,
+            "response": rng.choice(["Different", "same "]), "reaction_time_ms": rng.randrange(200, 4000),
+            "memorization_time_ms": 3000, "swap_event": rng.random() < 0.3,
+            "swap_history": {"from": 0, "to": 1}, "render_seed": rng.randrange(1 << 30), "render_group": group,
+        }
+        events.append({"username": "u", "event_type": "trial", "description": json.dumps(trial),
+                       "timestamp": "2025-01-01T00:00:00Z", "x": 0.0, "y": 0.0, "z": 0.0})
+        if noise_every and i % noise_every == 0:
+            events.append({"username": "u", "event_type": "marker", "description": "scene_loaded",
+                           "timestamp": "2025-01-01T00:00:00Z", "x": 0.0, "y": 0.0, "z": 0.0})
+    return events
+
+# ---------------------------
+# normalization: extract_trials_from_logs
+# ---------------------------
+def extract_trials_from_logs_legacy(logs_list: List[Dict[str,Any]]) -> pd.DataFrame:
+    trials = []
+    for log in logs_list:
+        et = log.get("event_type") or log.get("event")
+        desc = log.get("description")
+        if et is None or desc is None: continue
+        if str(et).lower() == "trial":
+            parsed = ptt.try_parse_description_as_json(desc)
+            if parsed is None:
+                try:
+                    parsed = json.loads(desc.replace("'", "\""))
+                except Exception:
+                    parsed = {"raw_description": desc}
+            trials.append((log, parsed))
+    return normalize_trials_legacy(trials)
+
+def normalize_trials_legacy(decoded) -> pd.DataFrame:
+    """Etapa de normalización anterior: loop por dict + .apply por fila. decoded = [(log, parsed), ...]"""
+    trials = []
+    for log, parsed in decoded:
+        t = {}
+        for k,v in parsed.items():
+            t[k] = v
+        if "response" in t and isinstance(t["response"], str):
+            t["response"] = t["response"].strip().lower()
+        if "phase" in t and isinstance(t["phase"], str):
+            t["phase"] = t["phase"].strip().lower()
+        if "object_similarity_label" in t and isinstance(t["object_similarity_label"], str):
+            t["object_similarity_label"] = t["object_similarity_label"].strip().lower()
+        trials.append({**t, "_raw_event": log, "_parsed_description": parsed})
+    df = pd.DataFrame(trials)
+    expected_cols = ["session_id","participant_id","timestamp","trial_index","phase","object_id","object_category",
+                     "object_subpool","object_similarity_label","object_actual_moved","participant_said_moved","response",
+                     "reaction_time_ms","memorization_time_ms","swap_event","swap_history","render_seed","render_group"]
+    for c in expected_cols:
+        if c not in df.columns:
+            df[c] = pd.NA
+    df["render_group"] = df["render_group"].apply(ptt.ensure_list)
+    df["object_actual_moved"] = df["object_actual_moved"].apply(lambda x: bool(x) if pd.notna(x) else False)
+    df["swap_event"] = df["swap_event"].apply(lambda x: bool(x) if pd.notna(x) else False)
+    df["reaction_time_ms"] = pd.to_numeric(df["reaction_time_ms"], errors="coerce").fillna(-1).astype(int)
+    df["memorization_time_ms"] = pd.to_numeric(df["memorization_time_ms"], errors="coerce").fillna(-1).astype(int)
+    df["trial_index"] = pd.to_numeric(df["trial_index"], errors="coerce").fillna(-1).astype(int)
+    return df
+
+def _timed(fn, *a, repeat: int = 1, **kw):
+    best = float("inf"); out = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn(*a, **kw)
+        best = min(best, time.perf_counter() - t0)
+    return out, best
+
+def bench_normalization(args):
+    print(f"[BENCH] generating {args.n} synthetic trial events...")
+    events = synthetic_trial_events(args.n, seed=args.seed)
+    # igualdad sobre un prefijo (tener las dos salidas de 1M filas en memoria a la vez no entra en 8 GB)
+    check = events[:args.check_rows]
+    pd.testing.assert_frame_equal(extract_trials_from_logs_legacy(check), ptt.extract_trials_from_logs(check))
+    print(f"[BENCH] outputs identical on the first {len(check)} events")
+
+    _, t_old = _timed(lambda: len(extract_trials_from_logs_legacy(events)), repeat=args.repeat)
+    _, t_new = _timed(lambda: len(ptt.extract_trials_from_logs(events)), repeat=args.repeat)
+
+    # etapas por separado: decode de description y normalización (con las descripciones ya decodificadas)
+    trial_events = [log for log in events if ptt.is_trial_event(log)]
+    descs = [log["description"] for log in trial_events]
+    _, t_dec_old = _timed(lambda: len([ptt.decode_description(d) for d in descs]), repeat=args.repeat)
+    parsed, t_dec_new = _timed(ptt.decode_descriptions, descs, repeat=args.repeat)
+    del descs
+    _, t_norm_old = _timed(lambda: len(normalize_trials_legacy(zip(trial_events, parsed))), repeat=args.repeat)
+    def normalize_new():
+        df = pd.DataFrame(parsed)
+        df["_raw_event"] = ptt._object_column(trial_events)
+        df["_parsed_description"] = ptt._object_column(parsed)
+        return len(ptt.normalize_trials_df(df))
+    _, t_norm_new = _timed(normalize_new, repeat=args.repeat)
+
+    print(f"[BENCH] rows={len(trial_events)}")
+    print(f"[BENCH] {'stage':<28}{'legacy':>10}{'new':>10}{'speedup':>10}")
+    for name, a, b in [("description decode", t_dec_old, t_dec_new),
+                       ("normalization", t_norm_old, t_norm_new),
+                       ("extract_trials_from_logs", t_old, t_new)]:
+        print(f"[BENCH] {name:<28}{a:>9.2f}s{b:>9.2f}s{a / b:>9.2f}x")
+
+# ---------------------------
+# similarity: annotate_trial_similarity
+# ---------------------------
+def synthetic_emb_map(n_objects: int = 86, dim: int = 512, seed: int = 0) -> Dict[str,np.ndarray]:
+    rng = np.random.default_rng(seed)
+    m = rng.standard_normal((n_objects, dim)).astype(np.float32)
+    m /= np.linalg.norm(m, axis=1, keepdims=True)
+    return {f"Estatuas/obj_{i:03d}": m[i] for i in range(n_objects)}
+
+def annotate_trial_similarity_legacy(trials_df: pd.DataFrame, emb_map: Dict[str,np.ndarray], sim_thresh: float = 0.8):
+    for i, r in trials_df.iterrows():
+        ag = ptt.compute_similarity_aggs_for_trial(r.to_dict(), emb_map, topk=3, thresh=sim_thresh)
+        for k,v in ag.items():
+            trials_df.at[i, k] = v
+
+def bench_similarity(args):
+    print(f"[BENCH] generating {args.n} synthetic trials...")
+    trials = ptt.extract_trials_from_logs(synthetic_trial_events(args.n, seed=args.seed, noise_every=0), keep_raw_event=False)
+    # un par de objetos sin embedding, como en los datos reales
+    emb_map = synthetic_emb_map(seed=args.seed)
+    for oid in list(emb_map)[:2]:
+        del emb_map[oid]
+    def run(annotate):
+        df = trials.copy()
+        annotate(df, emb_map)
+        return df
+    old, t_old = _timed(run, annotate_trial_similarity_legacy, repeat=args.repeat)
+    new, t_new = _timed(run, ptt.annotate_trial_similarity, repeat=args.repeat)
+    pd.testing.assert_frame_equal(old[ptt.SIM_AGG_COLUMNS], new[ptt.SIM_AGG_COLUMNS], check_exact=True)
+    print(f"[BENCH] outputs identical on {len(trials)} trials")
+    print(f"[BENCH] annotate_trial_similarity legacy={t_old:.2f}s new={t_new:.2f}s speedup={t_old / t_new:.1f}x")
+
+# ---------------------------
+# set-lookup: find_set_for_group
+# ---------------------------
+def find_set_for_group_legacy(diff_root, chosen_group, difficulty_hint=None, category_hint=None):
+    """Búsqueda lineal original (hasta 4 pasadas sobre todas las sets)."""
+    if not diff_root or not chosen_group:
+        return None
+    chosen_set = set(chosen_group)
+    def iter_sets():
+        for cat in diff_root.get("categories", []):
+            cat_name = cat.get("category")
+            for sp in cat.get("subpools", []):
+                spid = sp.get("subpoolId")
+                for s in sp.get("sets", []):
+                    yield cat_name, spid, s
+    if category_hint:
+        for cat_name, spid, s in iter_sets():
+            if cat_name != category_hint: continue
+            if difficulty_hint and s.get("difficulty") != difficulty_hint: continue
+            if set(s.get("group", [])) == chosen_set:
+                return {"set": s, "subpoolId": spid, "category": cat_name}
+    for cat_name, spid, s in iter_sets():
+        if difficulty_hint and s.get("difficulty") != difficulty_hint: continue
+        if set(s.get("group", [])) == chosen_set:
+            return {"set": s, "subpoolId": spid, "category": cat_name}
+    if category_hint:
+        for cat_name, spid, s in iter_sets():
+            if cat_name != category_hint: continue
+            if difficulty_hint and s.get("difficulty") != difficulty_hint: continue
+            if chosen_set.issubset(set(s.get("group", []))):
+                return {"set": s, "subpoolId": spid, "category": cat_name}
+    for cat_name, spid, s in iter_sets():
+        if difficulty_hint and s.get("difficulty") != difficulty_hint: continue
+        if chosen_set.issubset(set(s.get("group", []))):
+            return {"set": s, "subpoolId": spid, "category": cat_name}
+    return None
+
+def synthetic_difficulty_sets(n_categories: int, subpools: int, objects_per_subpool: int, seed: int = 0) -> Dict[str,Any]:
+    """Mismo layout que difficulty_sets_with_scores.json (modelo.py): sizes 2..12, easy/hard, NUM_SETS=2."""
+    rng = random.Random(seed)
+    cats = []
+    for c in range(n_categories):
+        sps = []
+        for s in range(subpools):
+            # objetos compartidos entre subpools de la misma categoría -> grupos repetidos y superconjuntos
+            objs = [f"cat{c}/obj_{rng.randrange(subpools * objects_per_subpool // 2)}" for _ in range(objects_per_subpool)]
+            objs = list(dict.fromkeys(objs))
+            sets = []
+            for k in [2, 4, 6, 8, 10, 12]:
+                if k > len(objs): continue
+                for diff in ["hard", "easy"]:
+                    for _ in range(2):
+                        sets.append({"size": k, "difficulty": diff, "group": rng.sample(objs, k),
+                                     "intra_mean": rng.random(), "hardness_pct": 50.0, "easiness_pct": 50.0})
+            sps.append({"subpoolId": f"cat{c}_{s}", "sets": sets})
+        cats.append({"category": f"cat{c}", "subpools": sps})
+    return {"categories": cats}
+
+def synthetic_lookup_queries(diff_root: Dict[str,Any], n: int, seed: int = 0):
+    """(group, difficulty_hint, category_hint): grupos exactos desordenados, subconjuntos y grupos sin match."""
+    rng = random.Random(seed)
+    flat = [(c["category"], s) for c in diff_root["categories"] for sp in c["subpools"] for s in sp["sets"]]
+    cats = [c["category"] for c in diff_root["categories"]]
+    out = []
+    for _ in range(n):
+        cat, s = rng.choice(flat)
+        g = list(s["group"]); rng.shuffle(g)
+        kind = rng.random()
+        if kind < 0.3:
+            g = g[:max(1, len(g) // 2)]
+        elif kind < 0.4:
+            g = g + [rng.choice(flat)[1]["group"][0]]
+        out.append((g, rng.choice([None, None, "hard", "easy"]), rng.choice([cat, cat, rng.choice(cats), None])))
+    return out
+
+def bench_set_lookup(args):
+    diff_root = synthetic_difficulty_sets(args.categories, args.subpools, args.objects, seed=args.seed)
+    queries = synthetic_lookup_queries(diff_root, args.n, seed=args.seed)
+    n_sets = sum(len(sp["sets"]) for c in diff_root["categories"] for sp in c["subpools"])
+    print(f"[BENCH] {n_sets} sets, {len(queries)} lookups")
+    old, t_old = _timed(lambda: [find_set_for_group_legacy(diff_root, g, d, c) for g, d, c in queries], repeat=args.repeat)
+    def indexed():
+        index = ptt.DifficultySetIndex(diff_root)
+        return [ptt.find_set_for_group(index, g, d, c) for g, d, c in queries]
+    new, t_new = _timed(indexed, repeat=args.repeat)
+    for a, b in zip(old, new):
+        assert (a is None and b is None) or (a["set"] is b["set"] and a == b), (a, b)
+    print(f"[BENCH] results identical ({sum(r is not None for r in new)} matched)")
+    print(f"[BENCH] find_set_for_group legacy={t_old:.2f}s indexed={t_new:.2f}s (build included) speedup={t_old / t_new:.1f}x")
+
+# ---------------------------
+# sessions: compute_sessions_df
+# ---------------------------
+def compute_sessions_df_legacy(trials_df: pd.DataFrame, sim_thresh: float = 0.8) -> pd.DataFrame:
+    """groupby("session_id") + compute_session_features por sesión."""
+    sessions = []
+    for sid, group in trials_df.groupby("session_id"):
+        session_meta = {"session_id": sid, "participant_id": group["participant_id"].iloc[0] if len(group)>0 else None,
+                        "n_trials": len(group)}
+        session_meta.update(ptt.compute_session_features(group, sim_thresh=sim_thresh))
+        sessions.append(session_meta)
+    return pd.DataFrame(sessions)
+
+def bench_sessions(args):
+    print(f"[BENCH] generating {args.n} synthetic trials...")
+    trials = ptt.extract_trials_from_logs(synthetic_trial_events(args.n, seed=args.seed, noise_every=0), keep_raw_event=False)
+    ptt.annotate_trial_similarity(trials, synthetic_emb_map(seed=args.seed))
+    old, t_old = _timed(compute_sessions_df_legacy, trials, repeat=args.repeat)
+    new, t_new = _timed(ptt.compute_sessions_df, trials, repeat=args.repeat)
+    pd.testing.assert_frame_equal(old, new, check_exact=True)
+    print(f"[BENCH] outputs identical on {len(new)} sessions")
+    print(f"[BENCH] compute_sessions_df legacy={t_old:.2f}s new={t_new:.2f}s speedup={t_old / t_new:.1f}x")
+
+# ---------------------------
+# workers: run_sharded_features (--workers N)
+# ---------------------------
+# Medido en una máquina de 1 core (--workers 3): antes el pool corría a 0.70x de un solo proceso (50k y 300k trials);
+# ahora shard_workers lo baja a 1 proceso y queda en 1.06-1.09x (ruido: mismo camino). Forzando 3 procesos en ese
+# core (--min-trials 0 no alcanza, también se limita a os.cpu_count()) el pool da 0.53x con 50k y 0.78x con 300k:
+# el speedup real solo aparece con varios cores libres y shards de SHARD_MIN_TRIALS o más trials.
+def bench_workers(args):
+    print(f"[BENCH] generating {args.n} synthetic trials...")
+    trials = ptt.extract_trials_from_logs(synthetic_trial_events(args.n, seed=args.seed, noise_every=0), keep_raw_event=False)
+    emb_map = synthetic_emb_map(seed=args.seed)
+    diff_root = synthetic_difficulty_sets(1, 6, 14, seed=args.seed)
+    def single():
+        df = trials.copy()
+        ptt.annotate_trial_similarity(df, emb_map)
+        ptt.annotate_trial_sets(df, diff_root)
+        return df, ptt.session_features_table(df)
+    def sharded():
+        df = trials.copy()
+        return df, ptt.run_sharded_features(df, args.workers, emb_map, diff_root=diff_root, min_trials=args.min_trials)
+    (df1, s1), t_one = _timed(single, repeat=args.repeat)
+    (dfn, sn), t_many = _timed(sharded, repeat=args.repeat)
+    pd.testing.assert_frame_equal(df1, dfn, check_exact=True)
+    pd.testing.assert_frame_equal(s1, sn, check_exact=True)
+    print(f"[BENCH] outputs identical ({len(sn)} sessions)")
+    used = ptt.shard_workers(len(trials), args.workers, args.min_trials)
+    print(f"[BENCH] trial+session features 1 process={t_one:.2f}s --workers {args.workers} ({used} used, {os.cpu_count()} cores)="
+          f"{t_many:.2f}s speedup={t_one / t_many:.2f}x")
+
+# ---------------------------
+# accumulators: SessionAccumulators (streaming / shards)
+# ---------------------------
+def bench_accumulators(args):
+    from session_accumulators import SessionAccumulators, TRIAL_FIELDS
+    print(f"[BENCH] generating {args.n} synthetic trials...")
+    trials = ptt.extract_trials_from_logs(synthetic_trial_events(args.n, seed=args.seed, noise_every=0), keep_raw_event=False)
+    ptt.annotate_trial_similarity(trials, synthetic_emb_map(seed=args.seed))
+    records = trials[[c for c in TRIAL_FIELDS if c in trials.columns]].to_dict("records")
+    ref, t_batch = _timed(ptt.session_features_table, trials, sdt=True, repeat=args.repeat)
+    def fold():
+        shards = [SessionAccumulators() for _ in range(args.shards)]
+        for i, rec in enumerate(records):  # trials intercalados entre shards: cada sesión queda partida
+            shards[i % args.shards].add(rec)
+        return shards
+    shards, t_fold = _timed(fold, repeat=args.repeat)
+    def merge():
+        acc = SessionAccumulators()
+        for sh in shards:
+            acc.merge(sh)
+        return acc.table(sdt=True)
+    got, t_merge = _timed(merge, repeat=args.repeat)
+    # Welford / sumas en streaming vs sumas agrupadas: diferencias de redondeo
+    pd.testing.assert_frame_equal(ref, got, check_exact=False, rtol=1e-9, check_dtype=False)
+    print(f"[BENCH] outputs match on {len(got)} sessions ({args.shards} shards per session)")
+    print(f"[BENCH] batch table={t_batch:.2f}s fold={t_fold:.2f}s ({len(records) / t_fold:,.0f} trials/s) merge+table={t_merge:.2f}s")
+
+# ---------------------------
+# rf-features: matriz X del --rf-train
+# ---------------------------
+def rf_feature_matrix_legacy(merged: pd.DataFrame) -> pd.DataFrame:
+    """flatten_row sobre merged.iterrows()."""
+    def flatten_row(row):
+        flat = {}
+        for k,v in row.items():
+            if isinstance(v, (int,float,np.floating,np.integer)):
+                flat[k]=v
+            elif isinstance(v, dict):
+                for kk,vv in v.items():
+                    flat[f"{k}__{kk}"] = vv
+        return flat
+    feature_rows = []
+    for _, r in merged.iterrows():
+        flat = flatten_row(r.to_dict())
+        flat.pop("session_id", None); flat.pop("participant_id", None); flat.pop("label", None)
+        feature_rows.append(flat)
+    return pd.DataFrame(feature_rows).fillna(0.0)
+
+def bench_rf_features(args):
+    print(f"[BENCH] generating {args.n} synthetic trials...")
+    trials = ptt.extract_trials_from_logs(synthetic_trial_events(args.n, seed=args.seed, noise_every=0), keep_raw_event=False)
+    ptt.annotate_trial_similarity(trials, synthetic_emb_map(seed=args.seed))
+    sessions = ptt.compute_sessions_df(trials, sdt=True)
+    labels = pd.DataFrame({"participant_id": sessions["participant_id"].unique()})
+    labels["label"] = np.arange(len(labels)) % 2
+    merged = ptt.merge_session_labels(sessions, labels)
+    old, t_old = _timed(rf_feature_matrix_legacy, merged, repeat=args.repeat)
+    new, t_new = _timed(ptt.flatten_feature_columns, merged, repeat=args.repeat)
+    pd.testing.assert_frame_equal(old, new, check_exact=True)
+    print(f"[BENCH] feature matrices identical {new.shape}")
+    print(f"[BENCH] X build legacy={t_old:.2f}s new={t_new:.3f}s speedup={t_old / t_new:.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="bench", required=True)
+    p = sub.add_parser("normalization", help="extract_trials_from_logs: per-row loop vs columnar normalization")
+    p.add_argument("--n", type=int, default=1_000_000, help="Synthetic trial events")
+    p.add_argument("--check-rows", type=int, default=50_000, help="Events compared legacy vs new for equality")
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_normalization)
+    p = sub.add_parser("similarity", help="annotate_trial_similarity: iterrows per trial vs batched aggregation")
+    p.add_argument("--n", type=int, default=200_000, help="Synthetic trials")
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_similarity)
+    p = sub.add_parser("set-lookup", help="find_set_for_group: linear scans vs DifficultySetIndex")
+    p.add_argument("--n", type=int, default=200_000, help="Lookups (trials)")
+    p.add_argument("--categories", type=int, default=4)
+    p.add_argument("--subpools", type=int, default=6, help="Subpools per category")
+    p.add_argument("--objects", type=int, default=14, help="Objects per subpool")
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_set_lookup)
+    p = sub.add_parser("sessions", help="compute_sessions_df: per-session loop vs one grouped aggregation")
+    p.add_argument("--n", type=int, default=1_000_000, help="Synthetic trials (120 per session)")
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_sessions)
+    p = sub.add_parser("workers", help="similarity/set/session features: one process vs sharded pool")
+    p.add_argument("--n", type=int, default=1_000_000, help="Synthetic trials (120 per session)")
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--min-trials", type=int, default=ptt.SHARD_MIN_TRIALS, help="Trials per worker below which it runs in one process")
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_workers)
+    p = sub.add_parser("accumulators", help="session features: batch table vs streaming fold + shard merge")
+    p.add_argument("--n", type=int, default=200_000, help="Synthetic trials (120 per session)")
+    p.add_argument("--shards", type=int, default=4)
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_accumulators)
+    p = sub.add_parser("rf-features", help="--rf-train feature matrix: iterrows flatten vs column-wise flatten")
+    p.add_argument("--n", type=int, default=1_000_000, help="Synthetic trials (120 per session)")
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_rf_features)
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+difficulty_index.py - índice sobre difficulty_sets_with_scores.json para find_set_for_group
+
+Se arma una sola vez por corrida (O(sets)) y cada consulta deja de recorrer todas las categorías/subpools/sets:
+ - exact    : frozenset(group) particionado por (category, difficulty) -> primera set en orden del JSON
+ - by_object: índice invertido object_id -> posiciones de las sets que lo contienen (para el match por subconjunto,
+              los candidatos son la intersección de las listas de los objetos del grupo)
+Prioridad de match idéntica a la búsqueda lineal original (la primera set en orden del JSON gana en cada paso):
+ 1) exacta en category_hint (+difficulty_hint)  2) exacta en cualquier categoría
+ 3) subconjunto en category_hint                4) subconjunto en cualquier categoría
+"""
+from typing import Any, Dict, List, Optional
+
+_ANY = object()  # comodín de categoría/dificultad en las keys de exact (None puede ser un valor real)
+
+class DifficultySetIndex:
+    def __init__(self, diff_root: Optional[Dict[str,Any]]):
+        self.entries: List[Dict[str,Any]] = []   # {"set", "subpoolId", "category"} en orden del JSON
+        self.categories: List[Any] = []
+        self.difficulties: List[Any] = []
+        self.exact: Dict[tuple,int] = {}
+        self.by_object: Dict[Any,List[int]] = {}
+        for cat in (diff_root or {}).get("categories", []):
+            cat_name = cat.get("category")
+            for sp in cat.get("subpools", []):
+                spid = sp.get("subpoolId")
+                for s in sp.get("sets", []):
+                    self._add(cat_name, spid, s)
+
+    def _add(self, cat_name, spid, s):
+        p = len(self.entries)
+        diff = s.get("difficulty")
+        group = frozenset(s.get("group", []))
+        self.entries.append({"set": s, "subpoolId": spid, "category": cat_name})
+        self.categories.append(cat_name)
+        self.difficulties.append(diff)
+        for key in ((group, cat_name, diff), (group, cat_name, _ANY), (group, _ANY, diff), (group, _ANY, _ANY)):
+            self.exact.setdefault(key, p)
+        for oid in group:
+            self.by_object.setdefault(oid, []).append(p)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _subset_candidates(self, chosen: frozenset) -> List[int]:
+        """Posiciones (ascendentes) de las sets que contienen todo chosen."""
+        lists = []
+        for oid in chosen:
+            ps = self.by_object.get(oid)
+            if not ps:
+                return []
+            lists.append(ps)
+        lists.sort(key=len)
+        common = set(lists[0])
+        for ps in lists[1:]:
+            common.intersection_update(ps)
+            if not common:
+                return []
+        return sorted(common)
+
+    def find(self, chosen_group, difficulty_hint: Optional[str] = None, category_hint: Optional[str] = None):
+        """Mismo resultado que find_set_for_group: {"set", "subpoolId", "category"} o None."""
+        if not self.entries or not chosen_group:
+            return None
+        chosen = frozenset(chosen_group)
+        diff_key = difficulty_hint if difficulty_hint else _ANY
+        if category_hint:
+            p = self.exact.get((chosen, category_hint, diff_key))
+            if p is not None:
+                return dict(self.entries[p])
+        p = self.exact.get((chosen, _ANY, diff_key))
+        if p is not None:
+            return dict(self.entries[p])
+        candidates = [p for p in self._subset_candidates(chosen)
+                      if not difficulty_hint or self.difficulties[p] == difficulty_hint]
+        if category_hint:
+            for p in candidates:
+                if self.categories[p] == category_hint:
+                    return dict(self.entries[p])
+        return dict(self.entries[candidates[0]]) if candidates else None
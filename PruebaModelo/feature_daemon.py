@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+feature_daemon.py - modo watch/serve de processTrialAndTrain.py (--serve)
+
+Mantiene en memoria embeddings, índice de difficulty sets y features por sesión; cada --poll-interval segundos revisa
+la carpeta de offline_logs de LogManager y parsea solo los archivos nuevos o modificados (misma lógica que
+--incremental, pero sin estado en disco). Las features salen de acumuladores por sesión (session_accumulators.py) y
+no se guarda el DataFrame de trials: por cada archivo de log se guardan sus aportes por trial (solo las columnas que
+leen los acumuladores, TRIAL_FIELDS) y su parcial por sesión; el total de una sesión es el merge de sus parciales.
+Cada (session_id, trial_index) cuenta una sola vez, el último que llegó gana (también entre archivos de la misma
+pasada): si un archivo se modifica sus aportes se reemplazan enteros, y si un trial se re-envía en otro archivo se
+retira del anterior rearmando su parcial con los aportes que le quedan (sin releer el archivo, que LogManager suele
+haber borrado). Para acotar la memoria solo se siguen los últimos --track-trials trials: los archivos más viejos se
+sellan (su parcial pasa a una base por sesión y se olvidan sus keys), así que un re-envío o una modificación de un
+archivo sellado ya no se puede retirar y se cuenta como trials nuevos.
+Las features actuales se sirven por HTTP (host:puerto) o por un socket Unix (unix:/ruta.sock):
+  GET /status                -> archivos, trials, sesiones, versión y hora de la última actualización
+  GET /sessions              -> todas las sesiones (lista de objetos)
+  GET /sessions/<session_id> -> una sesión (404 si no existe)
+
+  python processTrialAndTrain.py --logs "%USERPROFILE%/AppData/LocalLow/<company>/<game>/offline_logs" \
+      --emb-dir ../Assets/Renders/embeddings --difficulty-sets ../Assets/Renders/difficulty_sets_with_scores.json \
+      --serve 127.0.0.1:8765
+  curl http://127.0.0.1:8765/sessions/sess_001
+"""
+import json
+import math
+import os
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import unquote
+
+import numpy as np
+import pandas as pd
+
+import processTrialAndTrain as ptt
+from session_accumulators import TRIAL_FIELDS, SessionAccumulator, SessionAccumulators
+
+def _jsonable(v):
+    """Valor de una fila de sessions_df -> JSON válido (NaN -> null, numpy -> python)."""
+    if isinstance(v, dict):
+        return {str(k): _jsonable(x) for k, x in v.items()}
+    if isinstance(v, (list, tuple, np.ndarray)):
+        return [_jsonable(x) for x in v]
+    if isinstance(v, np.generic):
+        v = v.item()
+    if isinstance(v, float) and math.isnan(v):
+        return None
+    if v is pd.NA:
+        return None
+    return v
+
+class FeatureDaemon:
+    """Estado incremental en memoria: aportes y parciales por archivo seguido, base sellada, totales por sesión y manifest."""
+    def __init__(self, log_specs: List[str], emb_dir: Optional[str] = None, difficulty_sets: Optional[str] = None,
+                 sim_thresh: float = 0.8, sdt: bool = False, keep_raw_event: bool = False, settle: float = 1.0,
+                 track_trials: int = 500_000):
+        self.log_specs = log_specs
+        self.sim_thresh = sim_thresh
+        self.sdt = sdt
+        self.keep_raw_event = keep_raw_event
+        self.settle = settle  # archivos modificados hace menos de esto (seg) pueden estar a medio escribir
+        self.track_trials = track_trials
+        self.manifest = ptt._empty_manifest({})
+        self.sessions: Optional[pd.DataFrame] = None
+        self.records: Dict[str,Dict[str,Any]] = {}
+        self.contribs: Dict[str,Dict[Tuple,Dict[str,Any]]] = {}  # archivo seguido -> key -> aporte (en orden de ingesta)
+        self.partials: Dict[str,SessionAccumulators] = {}         # archivo seguido -> acumuladores de sus aportes
+        self.key_owner: Dict[Tuple[Any,Any],str] = {}             # key -> archivo seguido que la aporta
+        self.n_tracked = 0
+        self.base = SessionAccumulators()                          # archivos sellados (ya no se pueden retirar)
+        self.accumulators = SessionAccumulators()                  # total por sesión = base + parciales
+        self.n_trials = 0
+        self.version = 0
+        self.updated_at = None
+        self.lock = threading.Lock()
+
+        self.emb_dir = Path(emb_dir) if emb_dir else None
+        self.store, self.sim_cache = None, None
+        self.emb_map: Dict[str,np.ndarray] = {}
+        if self.emb_dir:
+            self.store = ptt.open_embedding_store(self.emb_dir)
+            if self.store is not None:
+                self.sim_cache = ptt.SimilarityCache.open(self.store, self.emb_dir)
+                print(f"[INFO] Using embedding store ({len(self.store)} vectors, version {self.store.version})")
+        self.diff_index = None
+        if difficulty_sets:
+            diff_root = ptt.load_difficulty_sets(Path(difficulty_sets))
+            if diff_root:
+                self.diff_index = ptt.DifficultySetIndex(diff_root)
+                print(f"[INFO] Difficulty index: {len(self.diff_index)} sets")
+
+    def _ready_paths(self) -> List[Path]:
+        now = time.time()
+        out = []
+        for p in ptt.resolve_log_paths(self.log_specs):
+            try:
+                if now - p.stat().st_mtime >= self.settle:
+                    out.append(p)
+            except OSError:
+                pass  # borrado entre el listado y el stat (LogManager ya lo reenvió)
+        return out
+
+    def _annotate(self, trials_df: pd.DataFrame):
+        if self.emb_dir and len(trials_df):
+            ptt.load_emb_map_for_trials(trials_df, self.emb_dir, emb_map=self.emb_map, store=self.store)
+        if self.emb_map:
+            ptt.annotate_trial_similarity(trials_df, self.emb_map, sim_thresh=self.sim_thresh, sim_cache=self.sim_cache)
+        if self.diff_index is not None:
+            ptt.annotate_trial_sets(trials_df, self.diff_index)
+
+    @staticmethod
+    def _partial(contribs: Dict[Tuple,Dict[str,Any]]) -> SessionAccumulators:
+        partial = SessionAccumulators()
+        partial.add_trials(contribs.values())
+        return partial
+
+    def _contributions(self, trials_df: pd.DataFrame, row_source: np.ndarray) -> Dict[str,Dict[Tuple,Dict[str,Any]]]:
+        """
+        Aportes por archivo de la pasada. Una key repetida queda solo en su última aparición (orden de archivos y de
+        filas); los trials sin trial_index no se pueden identificar y van con una key propia por fila.
+        """
+        cols = [c for c in TRIAL_FIELDS if c in trials_df.columns]
+        rows = trials_df[cols].to_dict("records")
+        out: Dict[str,Dict[Tuple,Dict[str,Any]]] = {src: {} for src in dict.fromkeys(row_source)}
+        winner: Dict[Tuple,str] = {}
+        for i, (key, src, rec) in enumerate(zip(ptt.trial_keys(trials_df), row_source, rows)):
+            if key[0] is None:
+                continue  # sin session_id no aporta a ninguna sesión
+            if key[1] is None:
+                key = (key[0], None, i)
+            prev = winner.get(key)
+            if prev is not None:
+                del out[prev][key]  # (dict: reinsertar la deja al final, en el orden de llegada)
+            winner[key] = src
+            out[src][key] = rec
+        return out
+
+    def _seal(self, keep: Set[str]):
+        """Sella los archivos más viejos (salvo keep) hasta seguir como mucho track_trials trials."""
+        for src in list(self.contribs):
+            if self.n_tracked <= self.track_trials:
+                break
+            if src in keep:
+                continue
+            contribs = self.contribs.pop(src)
+            self.base.merge(self.partials.pop(src))
+            for key in contribs:
+                if self.key_owner.get(key) == src:
+                    del self.key_owner[key]
+            self.n_tracked -= len(contribs)
+
+    def poll_once(self) -> int:
+        """Procesa los archivos nuevos/modificados; devuelve cuántos se parsearon."""
+        paths = self._ready_paths()
+        parsed, frames = [], []
+        for p in paths:
+            try:
+                to_parse, _ = ptt.plan_incremental_files([p], self.manifest)
+                if not to_parse:
+                    continue
+                df = ptt.extract_trials_from_logs(ptt.load_logs_file(p), keep_raw_event=self.keep_raw_event)
+            except Exception as e:
+                # JSON incompleto (LogManager escribiendo) o archivo borrado: se reintenta en la próxima pasada
+                print(f"[WARN] skipping {p.name} for now: {e}")
+                continue
+            parsed.append(p); frames.append(df)
+        if not parsed:
+            return 0
+        sealed_changed = [p.name for p in parsed if str(p.resolve()) in self.manifest["files"]
+                          and str(p.resolve()) not in self.contribs]
+        ptt.record_parsed_files(self.manifest, parsed, frames)
+        for p in parsed:
+            self.manifest["files"][str(p.resolve())].pop("trial_keys", None)  # el daemon no las usa (y crecerían sin límite)
+        if sealed_changed:
+            print(f"[WARN] {len(sealed_changed)} sealed log file(s) changed ({', '.join(sealed_changed[:3])}...): "
+                  f"their previous trials can no longer be retracted")
+        sources = [str(p.resolve()) for p in parsed]
+        row_source = np.repeat(np.array(sources, dtype=object), [len(f) for f in frames])
+        new_trials = ptt.concat_trial_frames(frames)
+        del frames
+        self._annotate(new_trials)
+        if self.sim_cache is not None:
+            self.sim_cache.save()
+        batch = self._contributions(new_trials, row_source)
+        n_new = len(new_trials)
+        del new_trials
+
+        touched: Set[Any] = set()
+        # archivos modificados: sus aportes anteriores salen enteros
+        for src in batch:
+            old = self.contribs.pop(src, None)
+            if old is None:
+                continue
+            self.partials.pop(src, None)
+            self.n_tracked -= len(old)
+            for key in old:
+                touched.add(key[0])
+                if self.key_owner.get(key) == src:
+                    del self.key_owner[key]
+        # trials re-enviados: se retiran del archivo que los aportaba (el último que llegó gana)
+        shrunk: Set[str] = set()
+        for src, contribs in batch.items():
+            for key in contribs:
+                touched.add(key[0])
+                if len(key) != 2:
+                    continue
+                prev = self.key_owner.get(key)
+                if prev is not None and prev != src:
+                    del self.contribs[prev][key]
+                    self.n_tracked -= 1
+                    shrunk.add(prev)
+                self.key_owner[key] = src
+            self.contribs[src] = contribs
+            self.partials[src] = self._partial(contribs)
+            self.n_tracked += len(contribs)
+        for src in shrunk:
+            self.partials[src] = self._partial(self.contribs[src])
+
+        # totales de las sesiones tocadas = base + parciales (las que quedan sin trials se descartan)
+        self.accumulators.discard(touched)
+        totals = {sid: SessionAccumulator(sid) for sid in touched}
+        for partial in [self.base, *self.partials.values()]:
+            for sid in touched & partial.sessions.keys():
+                totals[sid].merge(partial.sessions[sid])
+        self.accumulators.sessions.update((sid, acc) for sid, acc in totals.items() if acc.n_trials)
+        self._seal(keep=set(batch))
+
+        sessions = self.accumulators.sessions_df(sdt=self.sdt)
+        records = {str(r["session_id"]): {k: _jsonable(v) for k, v in r.items()} for r in sessions.to_dict("records")}
+        n_trials = sum(acc.n_trials for acc in self.accumulators.sessions.values())
+        with self.lock:
+            self.sessions = sessions
+            self.records = records
+            self.n_trials = n_trials
+            self.version += 1
+            self.updated_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+        print(f"[INFO] {len(parsed)} log file(s) ingested: {n_new} trials, {len(touched)} session(s) updated "
+              f"({n_trials} trials / {len(sessions)} sessions in memory, {self.n_tracked} retractable)")
+        return len(parsed)
+
+    def status(self) -> Dict[str,Any]:
+        with self.lock:
+            return {"files": len(self.manifest["files"]), "trials": self.n_trials,
+                    "sessions": len(self.records), "version": self.version, "updated_at": self.updated_at}
+
+    def session(self, session_id: str) -> Optional[Dict[str,Any]]:
+        with self.lock:
+            return self.records.get(session_id)
+
+    def all_sessions(self) -> List[Dict[str,Any]]:
+        with self.lock:
+            return list(self.records.values())
+
+def _make_handler(daemon: FeatureDaemon):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, code: int, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = self.path.split("?", 1)[0].rstrip("/")
+            if path == "/status":
+                return self._send(200, daemon.status())
+            if path == "/sessions":
+                return self._send(200, daemon.all_sessions())
+            if path.startswith("/sessions/"):
+                rec = daemon.session(unquote(path[len("/sessions/"):]))
+                return self._send(200, rec) if rec is not None else self._send(404, {"error": "unknown session"})
+            self._send(404, {"error": "not found"})
+
+        def log_message(self, fmt, *a):
+            pass  # sin una línea por request en la consola
+    return Handler
+
+class UnixHTTPServer(ThreadingHTTPServer):
+    address_family = getattr(socket, "AF_UNIX", None)
+
+    def server_bind(self):
+        socket.socket.bind(self.socket, self.server_address)
+        self.server_name, self.server_port = "localhost", 0
+
+    def get_request(self):
+        conn, _ = self.socket.accept()
+        return conn, ("local", 0)  # BaseHTTPRequestHandler espera (host, port)
+
+def make_server(address: str, daemon: FeatureDaemon):
+    """'host:port' -> HTTP en TCP; 'unix:/ruta.sock' -> HTTP sobre socket Unix."""
+    handler = _make_handler(daemon)
+    if address.startswith("unix:"):
+        if UnixHTTPServer.address_family is None:
+            raise ValueError("Unix sockets are not available on this platform; use host:port")
+        path = address[len("unix:"):]
+        if os.path.exists(path):
+            os.unlink(path)
+        return UnixHTTPServer(path, handler)
+    host, _, port = address.rpartition(":")
+    return ThreadingHTTPServer((host or "127.0.0.1", int(port)), handler)
+
+def serve(args):
+    """Punto de entrada de processTrialAndTrain.py --serve."""
+    daemon = FeatureDaemon(args.logs, emb_dir=args.emb_dir, difficulty_sets=args.difficulty_sets, sim_thresh=args.sim_thresh,
+                           sdt=args.sdt_metrics, keep_raw_event=not args.drop_raw_event, track_trials=args.track_trials)
+    daemon.poll_once()
+    server = make_server(args.serve, daemon)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"[INFO] Serving session features on {args.serve} (polling every {args.poll_interval}s, Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(args.poll_interval)
+            try:
+                daemon.poll_once()
+            except Exception as e:
+                print(f"[WARN] ingest failed: {e}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        if args.serve.startswith("unix:") and os.path.exists(args.serve[len("unix:"):]):
+            os.unlink(args.serve[len("unix:"):])
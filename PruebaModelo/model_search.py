@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+model_search.py - búsqueda de hiperparámetros del clasificador de sesiones (processTrialAndTrain.py --search)
+
+Successive halving (HalvingGridSearchCV de sklearn): todas las configuraciones arrancan con pocos árboles /
+iteraciones y en cada ronda solo el 1/factor mejor sigue con factor veces más presupuesto. El recurso es
+n_estimators para RandomForest y max_iter para HistGradientBoosting (--search-hgb), así las configuraciones malas
+se descartan con modelos baratos. Folds y candidatos se evalúan en paralelo (n_jobs).
+
+Las configuraciones que llegan a la última ronda se re-evalúan con accuracy y ROC AUC (si y es binaria).
+El leaderboard tiene una fila por (configuración, ronda) con tiempos medios de fit / predict por fold;
+la recomendación es la configuración más rápida de entrenar cuyo score queda dentro de 1 std de la mejor.
+"""
+import json
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401 (habilita HalvingGridSearchCV)
+from sklearn.model_selection import HalvingGridSearchCV, cross_validate
+
+# (estimador base, recurso, presupuesto máximo, grilla)
+SEARCH_SPACES = {
+    "rf": (lambda seed: RandomForestClassifier(oob_score=False, random_state=seed), "n_estimators", 400, {
+        "max_depth": [None, 8, 16],
+        "min_samples_leaf": [1, 2, 4],
+        "max_features": ["sqrt", 0.5, None],
+        "class_weight": [None, "balanced"],
+    }),
+    "hgb": (lambda seed: HistGradientBoostingClassifier(early_stopping=False, random_state=seed), "max_iter", 300, {
+        "learning_rate": [0.03, 0.1, 0.3],
+        "max_leaf_nodes": [7, 15, 31],
+        "min_samples_leaf": [5, 20],
+        "l2_regularization": [0.0, 1.0],
+    }),
+}
+
+def search_metric(y: np.ndarray) -> str:
+    return "roc_auc" if len(pd.unique(y)) == 2 else "accuracy"
+
+def _halving(model: str, X: pd.DataFrame, y: np.ndarray, cv, metric: str, factor: int, n_jobs: int,
+             seed: int) -> HalvingGridSearchCV:
+    make, resource, max_resources, grid = SEARCH_SPACES[model]
+    search = HalvingGridSearchCV(make(seed), grid, factor=factor, resource=resource, max_resources=max_resources,
+                                 min_resources="exhaust", scoring=metric, cv=cv, refit=False, n_jobs=n_jobs,
+                                 random_state=seed, error_score=np.nan)
+    return search.fit(X, y)
+
+def run_search(X: pd.DataFrame, y: np.ndarray, cv, models: List[str], factor: int = 3, n_jobs: int = -1,
+               seed: int = 0) -> pd.DataFrame:
+    """Leaderboard (una fila por configuración y ronda), ordenado: última ronda primero, mejor score, fit más rápido."""
+    metric = search_metric(y)
+    scoring = {"accuracy": "accuracy"}
+    if metric == "roc_auc":
+        scoring["roc_auc"] = "roc_auc"
+    rows = []
+    for model in models:
+        search = _halving(model, X, y, cv, metric, factor, n_jobs, seed)
+        res = search.cv_results_
+        resource = SEARCH_SPACES[model][1]
+        last = max(res["iter"])
+        print(f"[SEARCH] {model}: {search.n_candidates_[0]} configs, rounds {search.n_iterations_}, "
+              f"{resource} {search.n_resources_}")
+        for i, params in enumerate(res["params"]):
+            row = {"model": model, "round": int(res["iter"][i]), "resource": resource, "budget": int(res["n_resources"][i]),
+                   "params": json.dumps(params, default=str), f"{metric}_mean": res["mean_test_score"][i],
+                   f"{metric}_std": res["std_test_score"][i], "fit_time_s": res["mean_fit_time"][i],
+                   "predict_time_s": res["mean_score_time"][i], "final": bool(res["iter"][i] == last)}
+            if row["final"]:
+                # survivors: accuracy + AUC con el presupuesto completo de la última ronda
+                # (params ya incluye el recurso de la ronda)
+                est = SEARCH_SPACES[model][0](seed).set_params(**params)
+                cvr = cross_validate(est, X, y, cv=cv, scoring=scoring, n_jobs=n_jobs, error_score=np.nan)
+                for name in scoring:
+                    row[f"final_{name}_mean"] = float(np.mean(cvr[f"test_{name}"]))
+                row["fit_time_s"] = float(np.mean(cvr["fit_time"]))
+                row["predict_time_s"] = float(np.mean(cvr["score_time"]))
+            rows.append(row)
+    board = pd.DataFrame(rows)
+    return board.sort_values(["final", "round", f"{metric}_mean", "fit_time_s"], ascending=[False, False, False, True],
+                             kind="stable").reset_index(drop=True)
+
+def recommend(board: pd.DataFrame, metric: str) -> Optional[Dict[str,Any]]:
+    """La configuración final más rápida de entrenar dentro de 1 std del mejor score."""
+    final = board[board["final"]]
+    if not len(final) or final[f"{metric}_mean"].isna().all():
+        return None
+    best = final.loc[final[f"{metric}_mean"].idxmax()]
+    ok = final[final[f"{metric}_mean"] >= best[f"{metric}_mean"] - np.nan_to_num(best[f"{metric}_std"])]
+    return ok.sort_values("fit_time_s", kind="stable").iloc[0].to_dict()
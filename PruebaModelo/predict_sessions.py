@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+predict_sessions.py - scoring de sesiones con el rf_model.joblib de processTrialAndTrain.py --rf-train
+
+El bundle {"model", "feature_columns"} se carga una sola vez. Las features de cada sesión se aplanan igual que en
+el entrenamiento (flatten_feature_columns: dicts -> <col>__<label>) y se alinean a feature_columns: las columnas
+que faltan y los NaN valen 0.0 (el fillna(0.0) del entrenamiento), las que el modelo no conoce se ignoran.
+
+Batch: sessions.csv / sessions.parquet (archivo o dataset) leído por chunks -> CSV con prediction y proba_<clase>.
+  python predict_sessions.py --model out_logs/rf_model.joblib --input new_logs/sessions.csv --out predictions.csv
+
+Persistente (baja latencia): una sesión JSON por línea en stdin (p.ej. GET /sessions/<id> de --serve) ->
+una predicción JSON por línea en stdout; las estadísticas van a stderr al cerrar stdin.
+  python predict_sessions.py --model out_logs/rf_model.joblib --stdin
+
+En los dos modos se reporta throughput (sesiones/s) y latencia p50/p99 (por chunk en batch, por sesión en --stdin).
+"""
+import argparse
+import ast
+import json
+import sys
+import time
+import warnings
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from processTrialAndTrain import RF_DROP_COLUMNS, flatten_feature_columns, parquet_json_columns, pq
+
+class SessionScorer:
+    def __init__(self, model_path: Path, n_jobs: Optional[int] = None):
+        bundle = joblib.load(model_path)
+        self.model = bundle["model"]
+        self.feature_columns: List[str] = list(bundle["feature_columns"])
+        self.col_index = {c: j for j, c in enumerate(self.feature_columns)}
+        self.classes = [c.item() if isinstance(c, np.generic) else c for c in self.model.classes_]
+        # RandomForest: para una sola fila se suman los árboles directamente (mismo orden y resultado que
+        # predict_proba con n_jobs=1, sin el overhead de joblib por llamada)
+        trees = getattr(self.model, "estimators_", None)
+        self._trees = trees if trees is not None and len(trees) and hasattr(trees[0], "tree_") else None
+        if n_jobs is not None and "n_jobs" in self.model.get_params():
+            self.model.set_params(n_jobs=n_jobs)
+        # la alineación por nombre se hace acá; al modelo le llega un array en el orden de feature_columns
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        self._warned_missing = False
+
+    def align(self, sessions: pd.DataFrame) -> np.ndarray:
+        X = flatten_feature_columns(sessions)
+        missing = [c for c in self.feature_columns if c not in X.columns]
+        if missing and not self._warned_missing:
+            print(f"[WARN] {len(missing)} feature column(s) not in the input, filled with 0.0 (e.g. {missing[:3]})", file=sys.stderr)
+            self._warned_missing = True
+        return X.reindex(columns=self.feature_columns, fill_value=0.0).to_numpy(dtype=float)
+
+    def row_vector(self, session: Dict[str,Any]) -> np.ndarray:
+        """Una sesión (dict como los de sessions_df / GET /sessions/<id>) -> fila alineada, sin pasar por pandas."""
+        x = np.zeros(len(self.feature_columns))
+        for k, v in session.items():
+            if k in RF_DROP_COLUMNS:
+                continue
+            if isinstance(v, dict):
+                for kk, vv in v.items():
+                    j = self.col_index.get(f"{k}__{kk}")
+                    if j is not None and isinstance(vv, (int, float, np.floating, np.integer)):
+                        x[j] = vv
+            elif isinstance(v, (int, float, np.floating, np.integer)):
+                j = self.col_index.get(k)
+                if j is not None:
+                    x[j] = v
+        x[np.isnan(x)] = 0.0
+        return x
+
+    def score_matrix(self, X: np.ndarray):
+        proba = self.model.predict_proba(X)
+        return np.asarray(self.classes, dtype=object)[proba.argmax(axis=1)], proba
+
+    def score_frame(self, sessions: pd.DataFrame) -> pd.DataFrame:
+        pred, proba = self.score_matrix(self.align(sessions))
+        out = {c: sessions[c].to_numpy() for c in ("session_id", "participant_id") if c in sessions.columns}
+        out["prediction"] = pred
+        for j, cls in enumerate(self.classes):
+            out[f"proba_{cls}"] = proba[:, j]
+        return pd.DataFrame(out)
+
+    def _forest_proba(self, x: np.ndarray) -> np.ndarray:
+        x32 = x.astype(np.float32)
+        proba = np.zeros((len(x), len(self.classes)))
+        for tree in self._trees:
+            proba += tree.predict_proba(x32, check_input=False)
+        return proba / len(self._trees)
+
+    def score_one(self, session: Dict[str,Any]) -> Dict[str,Any]:
+        x = self.row_vector(session)[None, :]
+        proba = self._forest_proba(x) if self._trees is not None else self.model.predict_proba(x)
+        return {"session_id": session.get("session_id"), "prediction": self.classes[int(proba[0].argmax())],
+                "proba": {str(c): float(v) for c, v in zip(self.classes, proba[0])}}
+
+def _parse_dict_cell(v):
+    if isinstance(v, str) and v.startswith("{"):
+        try:
+            return ast.literal_eval(v)
+        except (ValueError, SyntaxError):
+            return v
+    return v
+
+def iter_session_chunks(path: Path, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """sessions.csv (dicts escritos como repr) o Parquet (structs nativos o columnas JSON) en chunks de chunk_size filas."""
+    if path.suffix == ".csv":
+        for chunk in pd.read_csv(path, chunksize=chunk_size):
+            for c in chunk.columns:
+                if chunk[c].dtype == object or pd.api.types.is_string_dtype(chunk[c]):
+                    chunk[c] = chunk[c].map(_parse_dict_cell).astype(object)
+            yield chunk
+        return
+    if pq is None:
+        raise SystemExit("[ERROR] Parquet input requires pyarrow (pip install pyarrow)")
+    import pyarrow.dataset as ds
+    dataset = ds.dataset(str(path), format="parquet")
+    json_cols = parquet_json_columns(dataset)
+    for batch in dataset.to_batches(batch_size=chunk_size):
+        chunk = batch.to_pandas()
+        for c in json_cols:
+            if c in chunk.columns:
+                chunk[c] = chunk[c].map(lambda v: json.loads(v) if isinstance(v, str) else v)
+        yield chunk
+
+def _latency_summary(latencies_s: List[float]) -> str:
+    ms = np.asarray(latencies_s) * 1000.0
+    return f"p50={np.percentile(ms, 50):.2f}ms p99={np.percentile(ms, 99):.2f}ms"
+
+def run_batch(scorer: SessionScorer, input_path: Path, out_path: Path, chunk_size: int):
+    n, latencies = 0, []
+    t0 = time.perf_counter()
+    with open(out_path, "w", newline="", encoding="utf8") as f:
+        for i, chunk in enumerate(iter_session_chunks(input_path, chunk_size)):
+            t = time.perf_counter()
+            scored = scorer.score_frame(chunk)
+            latencies.append(time.perf_counter() - t)
+            scored.to_csv(f, index=False, header=(i == 0))
+            n += len(scored)
+    elapsed = time.perf_counter() - t0
+    print(f"[INFO] Wrote {n} predictions: {out_path}")
+    if latencies:
+        print(f"[INFO] {n / elapsed:,.0f} sessions/s end to end ({elapsed:.2f}s, {len(latencies)} chunk(s) of <= {chunk_size}); "
+              f"scoring latency per chunk {_latency_summary(latencies)}")
+
+def run_stdin(scorer: SessionScorer):
+    latencies = []
+    t0 = time.perf_counter()
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        t = time.perf_counter()
+        try:
+            result = scorer.score_one(json.loads(line))
+        except Exception as e:
+            result = {"error": str(e)}
+        latencies.append(time.perf_counter() - t)
+        sys.stdout.write(json.dumps(result, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+    if latencies:
+        elapsed = time.perf_counter() - t0
+        print(f"[INFO] {len(latencies)} session(s) scored, {len(latencies) / elapsed:,.0f} sessions/s; "
+              f"latency {_latency_summary(latencies)}", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", required=True, help="rf_model.joblib written by processTrialAndTrain.py --rf-train")
+    parser.add_argument("--input", default=None, help="sessions.csv or sessions.parquet (file or dataset directory)")
+    parser.add_argument("--out", default="predictions.csv", help="Output CSV for --input")
+    parser.add_argument("--chunk-size", type=int, default=100_000, help="Sessions per scoring chunk")
+    parser.add_argument("--stdin", action="store_true", help="Persistent mode: one session JSON per stdin line -> one prediction JSON per stdout line")
+    parser.add_argument("--jobs", type=int, default=None, help="Trees scored in parallel in batch mode (default: as saved; --stdin uses 1)")
+    args = parser.parse_args()
+    if not args.stdin and not args.input:
+        parser.error("pass --input FILE or --stdin")
+
+    t = time.perf_counter()
+    scorer = SessionScorer(Path(args.model), n_jobs=1 if args.stdin else args.jobs)
+    print(f"[INFO] Loaded {type(scorer.model).__name__} ({len(scorer.feature_columns)} features, classes {scorer.classes}) "
+          f"in {time.perf_counter() - t:.2f}s", file=sys.stderr if args.stdin else sys.stdout)
+    if args.stdin:
+        run_stdin(scorer)
+    else:
+        run_batch(scorer, Path(args.input), Path(args.out), args.chunk_size)
+
+if __name__ == "__main__":
+    main()
@@ -1,55 +1,259 @@
 #!/usr/bin/env python3
 """
-process_logs_and_features.py - versin extendida
+process_logs_and_features.py - versión extendida
 
-Cambios respecto a la versin previa:
+Cambios respecto a la versión previa:
  - si se pasa --difficulty-sets, por cada trial intenta encontrar la "set" que contiene render_group y
    anota set_intra_mean, set_hardness_pct, set_easiness_pct, set_size, set_difficulty, set_subpoolId, set_category
- - guarda un JSON por trial en outdir/trial_jsons/ que incluye sim_* y set_* (auditora)
- - swap_history ahora puede ser un dict (nico swap) o una lista; avg_swaps_per_trial lo cuenta correctamente
- - mantiene la descripcin parseada original en columna "_parsed_description" (para escribir el JSON de auditora)
+ - guarda un registro de auditoría por trial que incluye sim_* y set_* (--audit-sink: trial_audit.jsonl por defecto,
+   sqlite, o un JSON por trial en outdir/trial_jsons/; lookup con audit_store.py)
+ - swap_history ahora puede ser un dict (único swap) o una lista; avg_swaps_per_trial lo cuenta correctamente
+ - mantiene la descripción parseada original en columna "_parsed_description" (para escribir el JSON de auditoría)
 """
 import argparse
+import gc
+import glob
+import hashlib
 import json
 import os
+import shutil
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterator, List, Optional, Set, Tuple
 import numpy as np
 import pandas as pd
-import math
 import pickle
 import sys
 import joblib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+from audit_store import AUDIT_SINKS, AuditSink, open_audit_sink, audit_store_path
+from difficulty_index import DifficultySetIndex
+from signal_detection import norm_ppf, sdt_metrics, grouped_counts
+
+# módulos compartidos con los scripts de Assets/Renders (embedding store, ...)
+RENDERS_DIR = Path(__file__).resolve().parent.parent / "Assets" / "Renders"
+if str(RENDERS_DIR) not in sys.path:
+    sys.path.append(str(RENDERS_DIR))
+from embedding_store import EmbeddingStore, has_store, store_is_stale, load_embedding_store, \
+    vector_from_pickle_payload, l2_normalize
+from similarity_cache import SimilarityCache, pair_dots
 
 # ML
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import cross_val_score, StratifiedKFold
-from sklearn.metrics import roc_auc_score, accuracy_score
+from sklearn.model_selection import cross_validate, StratifiedKFold
+
+# streaming JSON (optional): ijson es más rápido; si falta se usa el parser incremental propio
+try:
+    import ijson
+except Exception:
+    ijson = None
 
-# stats: ppf for d' (try scipy first)
+# Parquet/Arrow output (optional, --format parquet)
 try:
-    from scipy.stats import norm
-    norm_ppf = norm.ppf
+    import pyarrow as pa
+    import pyarrow.parquet as pq
 except Exception:
-    def norm_ppf(p):
-        if p <= 0: p = 1e-10
-        if p >= 1: p = 1 - 1e-10
-        # Acklam approximation simplified (acceptable)
-        from math import sqrt, log
-        # use built-in approximation via inverse error function? Keep simple fallback:
-        # For our uses this fallback is OK; if precision critical, install scipy.
-        import mpmath as mp
-        return float(mp.sqrt(2) * mp.erfinv(2*p - 1))
+    pa = None
+    pq = None
 
 # ---------------------------
 # IO helpers
 # ---------------------------
 def load_logs_file(path: Path) -> List[Dict[str,Any]]:
-    text = path.read_text(encoding="utf8")
+    # utf-8-sig: LogManager escribe con Encoding.UTF8 (BOM incluido)
+    text = path.read_text(encoding="utf-8-sig")
     obj = json.loads(text)
     logs = obj.get("logs", obj) if isinstance(obj, dict) else obj
     return logs
 
+def resolve_log_paths(specs: List[str]) -> List[Path]:
+    """
+    Expande los argumentos de --logs a una lista de archivos.
+    Acepta archivos, directorios (toma los *.json de primer nivel) y globs ("logs/**/offline_logs_*.json").
+    Orden estable (alfabético = cronológico para offline_logs_yyyyMMdd_HHmmss.json) y sin duplicados.
+    """
+    out = []
+    seen = set()
+    for spec in specs:
+        p = Path(spec)
+        if p.is_dir():
+            matches = sorted(p.glob("*.json"))
+        elif p.is_file():
+            matches = [p]
+        else:
+            matches = sorted(Path(m) for m in glob.glob(spec, recursive=True) if Path(m).is_file())
+            if not matches:
+                print(f"[WARN] --logs: no files matched {spec}")
+        for m in matches:
+            key = m.resolve()
+            if key in seen: continue
+            seen.add(key)
+            out.append(m)
+    return out
+
+# ---------------------------
+# Streaming parser (dumps de varios GB: no se carga el documento entero)
+# ---------------------------
+_JSON_DECODER = json.JSONDecoder()
+
+class _JsonStreamReader:
+    """Lectura incremental de un documento JSON: buffer de texto que se rellena bajo demanda."""
+    def __init__(self, f, read_chars: int):
+        self.f = f
+        self.read_chars = read_chars
+        self.buf = ""
+        self.pos = 0
+
+    def _fill(self) -> bool:
+        data = self.f.read(self.read_chars)
+        if not data:
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Siguiente carácter no blanco (sin consumirlo); '' al final del archivo."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, ch: str):
+        if self.peek() != ch:
+            raise ValueError(f"expected {ch!r} at offset {self.pos}, found {self.peek()!r}")
+        self.pos += 1
+
+    def value(self):
+        """Decodifica el siguiente valor JSON completo, leyendo más texto si quedó cortado."""
+        self.peek()
+        while True:
+            try:
+                val, end = _JSON_DECODER.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # un número al final del buffer puede estar truncado ("12" de "1234")
+            if end == len(self.buf) and not isinstance(val, (dict, list, str)) and self._fill():
+                continue
+            self.pos = end
+            return val
+
+def _iter_json_array(reader: _JsonStreamReader) -> Iterator[Any]:
+    reader.expect("[")
+    if reader.peek() == "]":
+        reader.pos += 1
+        return
+    while True:
+        yield reader.value()
+        ch = reader.peek()
+        reader.pos += 1
+        if ch == "]":
+            return
+        if ch != ",":
+            raise ValueError(f"malformed logs array near offset {reader.pos}")
+
+def iter_log_events(path: Path, read_chars: int = 1 << 20) -> Iterator[Dict[str,Any]]:
+    """
+    Recorre evento por evento el array "logs" de un documento {"logs": [...]} (o un array top-level)
+    sin materializarlo. Usa ijson si está instalado.
+    """
+    with open(path, "r", encoding="utf-8-sig") as f:
+        reader = _JsonStreamReader(f, read_chars)
+        first = reader.peek()
+        if ijson is None:
+            if first == "[":
+                yield from _iter_json_array(reader)
+                return
+            reader.expect("{")
+            while reader.peek() not in ("}", ""):
+                key = reader.value()
+                reader.expect(":")
+                if key == "logs" and reader.peek() == "[":
+                    yield from _iter_json_array(reader)
+                    return
+                reader.value()  # otra key top-level: se descarta
+                if reader.peek() == ",":
+                    reader.pos += 1
+            return
+    with open(path, "rb") as fb:
+        if fb.read(3) != b"\xef\xbb\xbf":
+            fb.seek(0)
+        yield from ijson.items(fb, "item" if first == "[" else "logs.item", use_float=True)
+
+def iter_trial_chunks(path: Path, chunk_size: int = 50000, keep_raw_event: bool = True) -> Iterator[pd.DataFrame]:
+    """
+    Versión streaming de load_logs_file + extract_trials_from_logs: filtra event_type == "trial"
+    antes de parsear la descripción y emite DataFrames de a lo sumo chunk_size trials.
+    """
+    events = []
+    for log in iter_log_events(path):
+        if not is_trial_event(log): continue
+        events.append(log)
+        if len(events) >= chunk_size:
+            yield trials_df_from_events(events, keep_raw_event=keep_raw_event)
+            events = []
+    if events:
+        yield trials_df_from_events(events, keep_raw_event=keep_raw_event)
+
+def parse_log_file(path: Path, stream: bool = False, chunk_size: int = 50000, keep_raw_event: bool = True) -> pd.DataFrame:
+    """Carga un archivo de logs y devuelve sus trials (DataFrame vacío si el archivo no se puede leer)."""
+    if stream:
+        frames = []
+        try:
+            for chunk in iter_trial_chunks(path, chunk_size=chunk_size, keep_raw_event=keep_raw_event):
+                frames.append(chunk)
+        except Exception as e:
+            print(f"[WARN] could not parse logs file {path} (kept {sum(len(c) for c in frames)} trials read before the error): {e}")
+        if not frames:
+            return extract_trials_from_logs([])
+        return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True, sort=False)
+    try:
+        logs = load_logs_file(path)
+    except Exception as e:
+        print(f"[WARN] could not parse logs file {path}: {e}")
+        logs = []
+    return extract_trials_from_logs(logs, keep_raw_event=keep_raw_event)
+
+def load_trial_frames(paths: List[Path], workers: int = 0, stream: bool = False,
+                      chunk_size: int = 50000, keep_raw_event: bool = True) -> List[pd.DataFrame]:
+    """
+    Parsea varios archivos de logs (en paralelo con un pool de procesos si hay más de uno).
+    Devuelve un DataFrame por archivo, en el orden de `paths`. workers <= 0 -> os.cpu_count().
+    """
+    if not paths:
+        return []
+    parse = partial(parse_log_file, stream=stream, chunk_size=chunk_size, keep_raw_event=keep_raw_event)
+    workers = workers if workers and workers > 0 else (os.cpu_count() or 1)
+    workers = min(workers, len(paths))
+    if workers <= 1:
+        frames = [parse(p) for p in paths]
+    else:
+        # chunksize > 1: con miles de archivos chicos el overhead de IPC por archivo domina
+        chunksize = max(1, len(paths) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            frames = list(ex.map(parse, paths, chunksize=chunksize))
+    return frames
+
+def concat_trial_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    frames = [f for f in frames if len(f) > 0]
+    if not frames:
+        return extract_trials_from_logs([])
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames, ignore_index=True, sort=False)
+
+def load_trials_from_paths(paths: List[Path], workers: int = 0, stream: bool = False,
+                           chunk_size: int = 50000, keep_raw_event: bool = True) -> pd.DataFrame:
+    """Parsea `paths` (ver load_trial_frames) y concatena los trials en un único DataFrame, respetando el orden."""
+    return concat_trial_frames(load_trial_frames(paths, workers=workers, stream=stream,
+                                                 chunk_size=chunk_size, keep_raw_event=keep_raw_event))
+
 def try_parse_description_as_json(desc: str):
     try:
         return json.loads(desc)
@@ -67,75 +271,55 @@ def load_difficulty_sets(path: Path):
         print("[WARN] could not load difficulty sets:", e)
         return None
 
-def find_set_for_group(diff_root: Dict[str,Any], chosen_group: List[str], difficulty_hint: Optional[str]=None, category_hint: Optional[str]=None):
+def find_set_for_group(diff_root, chosen_group: List[str], difficulty_hint: Optional[str]=None, category_hint: Optional[str]=None):
     """
-    Busca la set (retorna dict con keys: set_obj, subpoolId, category) que mejor contiene chosen_group.
+    Busca la set (retorna dict con keys: set, subpoolId, category) que mejor contiene chosen_group.
     Strategy: exact match (order-agnostic) prioritized by category_hint+difficulty_hint,
               then subset match.
+    diff_root puede ser el JSON cargado o un DifficultySetIndex ya construido (para muchos trials armar el índice
+    una vez: el JSON se indexa en cada llamada).
     """
     if not diff_root or not chosen_group:
         return None
-    chosen_set = set(chosen_group)
-
-    # helpers
-    def iter_sets():
-        for cat in diff_root.get("categories", []):
-            cat_name = cat.get("category")
-            for sp in cat.get("subpools", []):
-                spid = sp.get("subpoolId")
-                for s in sp.get("sets", []):
-                    yield cat_name, spid, s
-
-    # 1) exact match prefer category+difficulty
-    if category_hint:
-        for cat_name, spid, s in iter_sets():
-            if cat_name != category_hint: continue
-            if difficulty_hint and s.get("difficulty") != difficulty_hint: continue
-            if set(s.get("group", [])) == chosen_set:
-                return {"set": s, "subpoolId": spid, "category": cat_name}
-    # 2) exact match anywhere (prefer difficulty hint)
-    for cat_name, spid, s in iter_sets():
-        if difficulty_hint and s.get("difficulty") != difficulty_hint: continue
-        if set(s.get("group", [])) == chosen_set:
-            return {"set": s, "subpoolId": spid, "category": cat_name}
-    # 3) subset match (chosen is subset of candidate)
-    if category_hint:
-        for cat_name, spid, s in iter_sets():
-            if cat_name != category_hint: continue
-            if difficulty_hint and s.get("difficulty") != difficulty_hint: continue
-            if chosen_set.issubset(set(s.get("group", []))):
-                return {"set": s, "subpoolId": spid, "category": cat_name}
-    for cat_name, spid, s in iter_sets():
-        if difficulty_hint and s.get("difficulty") != difficulty_hint: continue
-        if chosen_set.issubset(set(s.get("group", []))):
-            return {"set": s, "subpoolId": spid, "category": cat_name}
-    return None
+    index = diff_root if isinstance(diff_root, DifficultySetIndex) else DifficultySetIndex(diff_root)
+    return index.find(chosen_group, difficulty_hint=difficulty_hint, category_hint=category_hint)
 
 # ---------------------------
 # Embedding helpers (unchanged)
 # ---------------------------
-def load_embedding_pkl(emb_dir: Path, object_id: str):
+def _load_embedding_pkl_status(emb_dir: Path, object_id: str):
+    """(vector | None, "found" | "missing" | "corrupt")"""
     fname = object_id.replace("/", "_") + ".pkl"
     p = emb_dir / fname
     if not p.exists():
-        return None
+        return None, "missing"
     try:
         with open(p, "rb") as f:
             data = pickle.load(f)
-        vec = None
-        if isinstance(data, dict):
-            vec = data.get("vector") or data.get("emb") or data.get("embedding")
-        elif isinstance(data, (list, tuple, np.ndarray)):
-            vec = np.array(data, dtype=np.float32)
-        if vec is None:
-            return None
-        v = np.array(vec, dtype=np.float32)
-        norm = np.linalg.norm(v)
-        if norm > 0:
-            v = v / norm
-        return v
+        # ojo: data.get("vector") or ... falla con np.ndarray (valor de verdad ambiguo)
+        v = vector_from_pickle_payload(data)
+        if v is None:
+            return None, "corrupt"
+        return l2_normalize(v), "found"
     except Exception as e:
         print(f"[WARN] error loading embedding {p}: {e}")
+        return None, "corrupt"
+
+def load_embedding_pkl(emb_dir: Path, object_id: str):
+    return _load_embedding_pkl_status(emb_dir, object_id)[0]
+
+def open_embedding_store(emb_dir: Path) -> Optional[EmbeddingStore]:
+    """Store consolidado (embeddings.npy + ids) de emb_dir si existe y está al día con los .pkl; si no, None."""
+    if not has_store(emb_dir):
+        return None
+    if store_is_stale(emb_dir):
+        print(f"[WARN] embedding store in {emb_dir} is older than the .pkl files -> loading .pkl one by one "
+              f"(rebuild with: python embedding_store.py convert {emb_dir})")
+        return None
+    try:
+        return load_embedding_store(emb_dir)
+    except Exception as e:
+        print(f"[WARN] could not open embedding store in {emb_dir}: {e}")
         return None
 
 def compute_similarity_aggs_for_trial(trial_row, emb_map: Dict[str,np.ndarray], topk=3, thresh=0.8):
@@ -169,6 +353,61 @@ def compute_similarity_aggs_for_trial(trial_row, emb_map: Dict[str,np.ndarray],
         out["sim_entropy"] = float(ent)
     return out
 
+SIM_AGG_COLUMNS = ["sim_max","sim_mean_top3","sim_count_above_0_8","sim_entropy"]
+
+def emb_matrix_from_map(emb_map: Dict[str,np.ndarray]) -> Tuple[Dict[str,int], np.ndarray]:
+    """(object_id -> fila, matriz (N, D)) con los vectores de emb_map."""
+    ids = list(emb_map)
+    if not ids:
+        return {}, np.zeros((0, 0), dtype=np.float32)
+    return {oid: i for i, oid in enumerate(ids)}, np.vstack([np.asarray(emb_map[oid]).reshape(-1) for oid in ids])
+
+def similarity_aggs_batch(object_ids, render_groups, emb_map: Dict[str,np.ndarray], topk=3, thresh=0.8,
+                          sim_cache: Optional[SimilarityCache] = None) -> Dict[str,np.ndarray]:
+    """
+    compute_similarity_aggs_for_trial para todos los trials a la vez (mismos valores, bit a bit).
+    object_id y render_group se traducen a filas de la matriz de embeddings; los pares (trial, otro objeto) quedan
+    en arrays planos y los agregados se calculan por bloques de trials con la misma cantidad de similitudes
+    (así cada fila reduce exactamente los mismos elementos, en el mismo orden, que la versión por trial).
+    Con sim_cache las filas son las del embedding store y los productos punto salen del cache persistente.
+    """
+    n = len(object_ids)
+    out = {"sim_max": np.full(n, np.nan), "sim_mean_top3": np.full(n, np.nan),
+           "sim_count_above_0_8": np.zeros(n), "sim_entropy": np.full(n, np.nan)}
+    if sim_cache is not None:
+        index = {oid: r for oid, r in ((oid, sim_cache.store.row(oid)) for oid in emb_map) if r >= 0}
+    else:
+        index, V = emb_matrix_from_map(emb_map)
+    if n == 0 or not index:
+        return out
+    obj = pd.Series(list(object_ids), dtype=object)
+    tgt = obj.map(index).where(obj.astype(bool))
+    members = pd.Series(list(render_groups), dtype=object).explode()
+    pos = members.index.to_numpy()
+    other = members.map(index).to_numpy(dtype=float)
+    tgt_of_pair = tgt.to_numpy(dtype=float)[pos]
+    valid = ~np.isnan(tgt_of_pair) & ~np.isnan(other) & (members.to_numpy() != obj.to_numpy()[pos])
+    pos = pos[valid]
+    a, b = tgt_of_pair[valid].astype(np.int64), other[valid].astype(np.int64)
+    sims = sim_cache.dots(a, b) if sim_cache is not None else pair_dots(V, a, b)
+
+    counts = np.bincount(pos, minlength=n)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for L in np.unique(counts[counts > 0]):
+            rows = np.flatnonzero(counts == L)
+            S = sims[starts[rows][:, None] + np.arange(L)]
+            out["sim_max"][rows] = S.max(axis=1)
+            k = min(topk, L)
+            out["sim_mean_top3"][rows] = np.mean(np.sort(S, axis=1)[:, L - k:], axis=1)
+            out["sim_count_above_0_8"][rows] = np.sum(S > thresh, axis=1)
+            s = S - S.min(axis=1, keepdims=True)
+            ssum = s.sum(axis=1)
+            p = s / ssum[:, None]
+            ent = -np.sum(p * np.log(p + 1e-12), axis=1)
+            out["sim_entropy"][rows] = np.where(ssum <= 0, 0.0, ent)
+    return out
+
 # ---------------------------
 # Feature computations (swap_history handling MODIFICADO)
 # ---------------------------
@@ -176,7 +415,7 @@ def safe_proportion(count, total):
     return float(count) / float(total) if total and total > 0 else 0.0
 
 def len_sw(x):
-    """Cuenta cuntos swaps hubo en 'swap_history'. Acepta dict (1), list (len), str(json), NaN -> 0"""
+    """Cuenta cuántos swaps hubo en 'swap_history'. Acepta dict (1), list (len), str(json), NaN -> 0"""
     if x is None: return 0
     if isinstance(x, (list, tuple)): return len(x)
     if isinstance(x, dict): return 1
@@ -260,93 +499,941 @@ def compute_session_features(trials_df: pd.DataFrame, sim_thresh=0.8):
 
     return s
 
+# columnas por etiqueta de la tabla ancha: f"{prefijo}__{label}" (mismos nombres que el flatten del RF)
+LABEL_FEATURE_PREFIXES = ["accuracy_by_similarity", "p_diff_by_label"]
+
+def _per_label_rates(codes: np.ndarray, n_sessions: int, labels: pd.Series, flag: np.ndarray) -> Dict[str,np.ndarray]:
+    """label -> proporción de flag por sesión (NaN si la sesión no tiene trials con esa etiqueta). Labels ordenados como groupby."""
+    lab_codes, labs = pd.factorize(labels, sort=True)
+    ok = lab_codes >= 0
+    cell = codes[ok] * len(labs) + lab_codes[ok]
+    counts = np.bincount(cell, minlength=n_sessions * len(labs)).reshape(n_sessions, len(labs))
+    hits = np.bincount(cell, weights=flag[ok], minlength=n_sessions * len(labs)).reshape(n_sessions, len(labs))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rates = np.where(counts > 0, hits / counts, np.nan)
+    return {lab: rates[:, j] for j, lab in enumerate(labs)}
+
+def _group_float_stat(values: np.ndarray, codes: np.ndarray, n_sessions: int, how: str) -> np.ndarray:
+    """max/median por sesión salteando NaN (NaN si la sesión no tiene valores)."""
+    return pd.Series(values).groupby(codes).agg(how).reindex(range(n_sessions)).to_numpy(dtype=float)
+
+# Las medias / std por sesión se reducen igual que Series.mean() / Series.std(ddof=0) sobre el grupo de la sesión
+# (suma de numpy sobre el slice contiguo, en el orden original de las filas): una suma agrupada (groupby.mean,
+# bincount) redondea distinto en el último bit y sessions.csv dejaría de ser idéntico al de compute_session_features.
+def _session_slices(values: np.ndarray, codes: np.ndarray, n_sessions: int):
+    """(values ordenados por sesión conservando el orden de las filas, límites [b[i], b[i+1]) de cada sesión)."""
+    order = np.argsort(codes, kind="stable")
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=n_sessions))])
+    return values[order], bounds
+
+def _group_nanmean(values: np.ndarray, codes: np.ndarray, n_sessions: int) -> np.ndarray:
+    """Series.mean(skipna=True) por sesión: suma con NaN -> 0 / cantidad de valores (NaN si no hay)."""
+    nan = np.isnan(values)
+    cnt = np.bincount(codes[~nan], minlength=n_sessions)
+    v, bounds = _session_slices(np.where(nan, 0.0, values), codes, n_sessions)
+    out = np.full(n_sessions, np.nan)
+    for i in np.flatnonzero(cnt):
+        out[i] = v[bounds[i]:bounds[i + 1]].sum() / cnt[i]
+    return out
+
+def _group_mean_std(values: np.ndarray, codes: np.ndarray, n_sessions: int):
+    """(mean, std ddof=0) por sesión de values sin NaN; std 0.0 con menos de 2 valores, como compute_session_features."""
+    cnt = np.bincount(codes, minlength=n_sessions)
+    v, bounds = _session_slices(values, codes, n_sessions)
+    mean, std = np.full(n_sessions, np.nan), np.zeros(n_sessions)
+    for i in np.flatnonzero(cnt):
+        x = v[bounds[i]:bounds[i + 1]]
+        mean[i] = x.sum() / cnt[i]
+        if cnt[i] > 1:
+            std[i] = np.sqrt(((mean[i] - x) ** 2).sum() / cnt[i])
+    return mean, std
+
+SDT_COLUMNS = ["hit_rate", "fa_rate", "criterion_c", "a_prime", "beta"]
+
+def session_features_table(trials_df: pd.DataFrame, sim_thresh=0.8, sdt: bool = False) -> pd.DataFrame:
+    """
+    Features de todas las sesiones en una sola pasada (equivalente a compute_session_features por grupo de session_id).
+    Tabla ancha, una fila por sesión ordenada por session_id: las features por etiqueta de similitud quedan en columnas
+    accuracy_by_similarity__<label> / p_diff_by_label__<label> (NaN si la sesión no tuvo esa etiqueta).
+    sdt=True agrega hit_rate, fa_rate, criterion_c, a_prime, beta y dprime_by_label__<label>.
+    """
+    codes, sids = pd.factorize(trials_df["session_id"], sort=True)
+    df = trials_df[codes >= 0] if (codes < 0).any() else trials_df
+    codes = codes[codes >= 0]
+    n = len(sids)
+    size = np.bincount(codes, minlength=n)
+    _, first = np.unique(codes, return_index=True)  # primera fila de cada sesión
+    out = {"session_id": sids, "participant_id": df["participant_id"].to_numpy()[first] if n else [], "n_trials": size}
+    cols = df.columns
+    has_resp = "object_actual_moved" in cols and "response" in cols
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if has_resp:
+            moved = df["object_actual_moved"]
+            said_diff = (df["response"] == "different").fillna(False).to_numpy(dtype=bool)
+            said_same = (df["response"] == "same").fillna(False).to_numpy(dtype=bool)
+            is_target = (moved == True).fillna(False).to_numpy(dtype=bool)
+            is_foil = (moved == False).fillna(False).to_numpy(dtype=bool)
+            correct = (is_target & said_diff) | (is_foil & said_same)
+            out["accuracy_overall"] = np.bincount(codes, weights=correct, minlength=n) / size
+        else:
+            out["accuracy_overall"] = np.full(n, np.nan)
+
+        by_label = {}
+        if "object_similarity_label" in cols:
+            labels = df["object_similarity_label"]
+            by_label["accuracy_by_similarity"] = _per_label_rates(codes, n, labels, correct)
+            by_label["p_diff_by_label"] = _per_label_rates(codes, n, labels, said_diff)
+        for lab, v in by_label.get("accuracy_by_similarity", {}).items():
+            out[f"accuracy_by_similarity__{lab}"] = v
+
+        if "reaction_time_ms" in cols:
+            rt = pd.to_numeric(df["reaction_time_ms"], errors="coerce").to_numpy(dtype=float)
+            ok = ~np.isnan(rt) & (rt >= 0)
+            rt, rt_codes = rt[ok], codes[ok]
+            rt_mean, rt_std = _group_mean_std(rt, rt_codes, n)
+            out["reaction_time_mean"] = rt_mean
+            out["reaction_time_median"] = _group_float_stat(rt, rt_codes, n, "median")
+            out["reaction_time_std"] = rt_std
+        else:
+            out.update({"reaction_time_mean": np.full(n, np.nan), "reaction_time_median": np.full(n, np.nan),
+                        "reaction_time_std": np.full(n, np.nan)})
+
+        if "swap_event" in cols:
+            swap_count = np.bincount(codes, weights=df["swap_event"].fillna(False).to_numpy(dtype=bool), minlength=n)
+            out["swap_count"] = swap_count.astype(np.int64)
+            out["swap_rate"] = swap_count / size
+            if "swap_history" in cols:
+                n_swaps = np.fromiter((len_sw(x) for x in df["swap_history"].tolist()), dtype=float, count=len(df))
+                out["avg_swaps_per_trial"] = np.bincount(codes, weights=n_swaps, minlength=n) / size
+            else:
+                out["avg_swaps_per_trial"] = np.full(n, np.nan)
+        else:
+            out.update({"swap_count": np.zeros(n, dtype=np.int64), "swap_rate": np.zeros(n), "avg_swaps_per_trial": np.full(n, np.nan)})
+
+        if "sim_max" in cols:
+            out["max_similarity_to_any"] = _group_float_stat(df["sim_max"].to_numpy(dtype=float), codes, n, "max")
+            out["mean_top3_similarity"] = _group_nanmean(df["sim_mean_top3"].to_numpy(dtype=float), codes, n)
+            above = (df["sim_count_above_0_8"] > 0).fillna(False).to_numpy(dtype=bool)
+            out["count_sim_above_0_8"] = np.bincount(codes, weights=above, minlength=n).astype(np.int64)
+            out["similarity_entropy_mean"] = _group_nanmean(df["sim_entropy"].to_numpy(dtype=float), codes, n)
+        else:
+            out.update({"max_similarity_to_any": np.full(n, np.nan), "mean_top3_similarity": np.full(n, np.nan),
+                        "count_sim_above_0_8": np.zeros(n, dtype=np.int64), "similarity_entropy_mean": np.full(n, np.nan)})
+
+        p_diff = by_label.get("p_diff_by_label", {})
+        for lab, v in p_diff.items():
+            out[f"p_diff_by_label__{lab}"] = v
+        missing = np.full(n, np.nan)
+        ldi_high = p_diff.get("high", missing) - p_diff.get("target", missing)
+        ldi_low = p_diff.get("low", missing) - p_diff.get("target", missing)
+        out["MDTS_LDI_high"] = ldi_high
+        out["MDTS_LDI_low"] = ldi_low
+        out["MDTS_LDI_mean"] = np.where(np.isnan(ldi_high), ldi_low, np.where(np.isnan(ldi_low), ldi_high, (ldi_high + ldi_low) / 2))
+
+        if has_resp:
+            metrics = sdt_metrics(*grouped_counts(codes, n, is_target, is_foil, said_diff))
+            out["dprime"] = metrics["dprime"]
+        else:
+            metrics = {k: np.full(n, np.nan) for k in SDT_COLUMNS}
+            out["dprime"] = np.full(n, np.nan)
+        if sdt:
+            for k in SDT_COLUMNS:
+                out[k] = metrics[k]
+            if has_resp and "object_similarity_label" in cols:
+                lab_codes, labs = pd.factorize(df["object_similarity_label"], sort=True)
+                by_lab = sdt_metrics(*grouped_counts(codes, n, is_target, is_foil, said_diff, lab_codes, len(labs)))["dprime"]
+                for j, lab in enumerate(labs):
+                    out[f"dprime_by_label__{lab}"] = by_lab[:, j]
+    return pd.DataFrame(out)
+
+def fold_label_columns(wide: pd.DataFrame) -> pd.DataFrame:
+    """Tabla ancha -> formato de sessions.csv: las columnas <prefijo>__<label> vuelven a un dict por sesión
+    (solo las etiquetas presentes en la sesión), en la misma posición que devolvía compute_session_features."""
+    folded = {}
+    for prefix in LABEL_FEATURE_PREFIXES:
+        lab_cols = [c for c in wide.columns if c.startswith(prefix + "__")]
+        labels = [c[len(prefix) + 2:] for c in lab_cols]
+        values = wide[lab_cols].to_numpy(dtype=float)
+        folded[prefix] = [{lab: float(v) for lab, v in zip(labels, row) if not np.isnan(v)} for row in values]
+    anchors = {"accuracy_overall": "accuracy_by_similarity", "similarity_entropy_mean": "p_diff_by_label"}
+    cols = {}
+    for c in wide.columns:
+        if c.split("__", 1)[0] in LABEL_FEATURE_PREFIXES and "__" in c:
+            continue
+        cols[c] = wide[c]
+        if c in anchors:
+            cols[anchors[c]] = folded[anchors[c]]
+    return pd.DataFrame(cols)
+
 # ---------------------------
 # Parsing logs -> DataFrame (MODIFIED: keep parsed description in _parsed_description; don't wrap swap_history into list)
 # ---------------------------
-def extract_trials_from_logs(logs_list: List[Dict[str,Any]]) -> pd.DataFrame:
-    trials = []
-    for log in logs_list:
-        et = log.get("event_type") or log.get("event")
-        desc = log.get("description")
-        if et is None or desc is None: continue
-        if str(et).lower() == "trial":
-            parsed = try_parse_description_as_json(desc)
-            if parsed is None:
-                try:
-                    parsed = json.loads(desc.replace("'", "\""))
-                except Exception:
-                    parsed = {"raw_description": desc}
-            t = {}
-            for k,v in parsed.items():
-                t[k] = v
-            if "response" in t and isinstance(t["response"], str):
-                t["response"] = t["response"].strip().lower()
-            if "phase" in t and isinstance(t["phase"], str):
-                t["phase"] = t["phase"].strip().lower()
-            if "object_similarity_label" in t and isinstance(t["object_similarity_label"], str):
-                t["object_similarity_label"] = t["object_similarity_label"].strip().lower()
-            # KEEP swap_history as-is: may be dict (single swap) or list
-            # store original parsed description for audit (used later to write per-trial json)
-            trials.append({**t, "_raw_event": log, "_parsed_description": parsed})
-    df = pd.DataFrame(trials)
+def is_trial_event(log: Dict[str,Any]) -> bool:
+    et = log.get("event_type") or log.get("event")
+    if et is None or log.get("description") is None: return False
+    return str(et).lower() == "trial"
+
+def decode_description(desc) -> Dict[str,Any]:
+    parsed = try_parse_description_as_json(desc)
+    if parsed is None:
+        try:
+            parsed = json.loads(desc.replace("'", "\""))
+        except Exception:
+            parsed = None
+    if not isinstance(parsed, dict):
+        parsed = {"raw_description": desc}
+    return parsed
+
+def decode_descriptions(descs: List[str]) -> List[Dict[str,Any]]:
+    """
+    Decodifica todas las descripciones con un único json.loads sobre "[d1,d2,...]".
+    Si alguna no es un objeto JSON válido (o el lote no se alinea 1:1) se decodifica una por una.
+    """
+    if not descs:
+        return []
+    # el GC cíclico no tiene nada que recolectar acá pero se dispara por cada ~700 dicts creados
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        try:
+            if all(d[:1] == "{" and d[-1:] == "}" for d in descs):
+                batch = json.loads("[" + ",".join(descs) + "]")
+                if len(batch) == len(descs) and all(isinstance(b, dict) for b in batch):
+                    return batch
+        except Exception:
+            pass
+        return [decode_description(d) for d in descs]
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+def _object_column(values: List[Any]) -> np.ndarray:
+    arr = np.empty(len(values), dtype=object)
+    arr[:] = values
+    return arr
+
+def trials_df_from_events(events: List[Dict[str,Any]], keep_raw_event: bool = True) -> pd.DataFrame:
+    """DataFrame de trials a partir de eventos ya filtrados con is_trial_event."""
+    parsed_list = decode_descriptions([log.get("description") for log in events])
+    # el DataFrame no muta los dicts: parsed_list sirve a la vez de filas y de descripción original (auditoría)
+    # KEEP swap_history as-is: may be dict (single swap) or list
+    df = pd.DataFrame(parsed_list)
+    if keep_raw_event:
+        df["_raw_event"] = _object_column(events)
+    df["_parsed_description"] = _object_column(parsed_list)
+    return normalize_trials_df(df)
+
+def extract_trials_from_logs(logs_list: List[Dict[str,Any]], keep_raw_event: bool = True) -> pd.DataFrame:
+    events = [log for log in logs_list if is_trial_event(log)]
+    return trials_df_from_events(events, keep_raw_event=keep_raw_event)
+
+def ensure_list(x):
+    if x is None or (isinstance(x, float) and np.isnan(x)): return []
+    if isinstance(x, list): return x
+    if isinstance(x, str):
+        try:
+            v = json.loads(x)
+            if isinstance(v, list): return v
+        except:
+            pass
+        return [x]
+    return x
+
+def _normalize_str_column(col: pd.Series) -> pd.Series:
+    """strip().lower() de los valores string; los no-string (NaN, números, dicts) quedan tal cual."""
+    try:
+        norm = col.str.strip().str.lower()
+    except AttributeError:
+        return col  # columna sin ningún string
+    return norm.where(norm.notna(), col)
+
+def _to_bool_column(col: pd.Series) -> pd.Series:
+    """Equivalente a col.apply(lambda x: bool(x) if pd.notna(x) else False)."""
+    if col.dtype == bool:
+        return col
+    if pd.api.types.infer_dtype(col, skipna=True) in ("boolean", "empty"):
+        return col.astype("boolean").fillna(False).astype(bool)
+    # valores no booleanos (strings, números): misma semántica que bool(x)
+    return col.apply(lambda x: bool(x) if pd.notna(x) else False)
+
+def _to_list_column(col: pd.Series) -> pd.Series:
+    """ensure_list por columna: solo se tocan las celdas que no son ya listas."""
+    arr = col.to_numpy(dtype=object, copy=True)
+    not_list = np.flatnonzero(col.map(type).to_numpy() != list)
+    for i in not_list:
+        arr[i] = ensure_list(arr[i])
+    return pd.Series(arr, index=col.index, name=col.name, dtype=object)
+
+def normalize_trials_df(df: pd.DataFrame) -> pd.DataFrame:
     expected_cols = ["session_id","participant_id","timestamp","trial_index","phase","object_id","object_category",
                      "object_subpool","object_similarity_label","object_actual_moved","participant_said_moved","response",
                      "reaction_time_ms","memorization_time_ms","swap_event","swap_history","render_seed","render_group"]
     for c in expected_cols:
         if c not in df.columns:
             df[c] = pd.NA
-    def ensure_list(x):
-        if x is None or (isinstance(x, float) and np.isnan(x)): return []
-        if isinstance(x, list): return x
-        if isinstance(x, str):
-            try:
-                v = json.loads(x)
-                if isinstance(v, list): return v
-            except:
-                pass
-            return [x]
-        return x
-    df["render_group"] = df["render_group"].apply(ensure_list)
-    df["object_actual_moved"] = df["object_actual_moved"].apply(lambda x: bool(x) if pd.notna(x) else False)
-    df["swap_event"] = df["swap_event"].apply(lambda x: bool(x) if pd.notna(x) else False)
+    # normalización columnar (antes: un loop por dict + .apply por fila)
+    for c in ["response", "phase", "object_similarity_label"]:
+        df[c] = _normalize_str_column(df[c])
+    df["render_group"] = _to_list_column(df["render_group"])
+    df["object_actual_moved"] = _to_bool_column(df["object_actual_moved"])
+    df["swap_event"] = _to_bool_column(df["swap_event"])
     df["reaction_time_ms"] = pd.to_numeric(df["reaction_time_ms"], errors="coerce").fillna(-1).astype(int)
     df["memorization_time_ms"] = pd.to_numeric(df["memorization_time_ms"], errors="coerce").fillna(-1).astype(int)
     df["trial_index"] = pd.to_numeric(df["trial_index"], errors="coerce").fillna(-1).astype(int)
     return df
 
 # ---------------------------
-# Main flow (integracin con difficulty sets y guardado per-trial JSON)
+# Etapas del pipeline por trial / por sesión
 # ---------------------------
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--logs", required=True, help="Path to offline logs JSON")
-    parser.add_argument("--emb-dir", default=None, help="Optional: directory with embeddings .pkl")
-    parser.add_argument("--difficulty-sets", default=None, help="Optional: difficulty_sets_with_scores.json")
-    parser.add_argument("--labels", default=None, help="Optional CSV with columns ['participant_id' or 'session_id','label']")
-    parser.add_argument("--outdir", default="out_logs", help="Output folder")
-    parser.add_argument("--sim-thresh", type=float, default=0.8)
-    parser.add_argument("--rf-train", action="store_true", help="Train RandomForest if labels provided")
-    parser.add_argument("--random-seed", type=int, default=0)
-    args = parser.parse_args()
+AUDIT_FEATURE_COLUMNS = ["sim_max","sim_mean_top3","sim_count_above_0_8","sim_entropy",
+                         "set_intra_mean","set_hardness_pct","set_easiness_pct","set_size","set_difficulty","set_subpoolId","set_category"]
 
-    outdir = Path(args.outdir)
-    outdir.mkdir(parents=True, exist_ok=True)
-    trial_json_dir = outdir / "trial_jsons"
-    trial_json_dir.mkdir(parents=True, exist_ok=True)
+def unique_trial_object_ids(trials_df: pd.DataFrame) -> List[str]:
+    """IDs distintos de render_group + object_id (explode/unique vectorizado en lugar de recorrer cada trial)."""
+    if len(trials_df) == 0:
+        return []
+    ids = pd.concat([trials_df["render_group"].explode(), trials_df["object_id"]], ignore_index=True)
+    ids = ids[ids.notna() & (ids != "")]
+    return list(pd.unique(ids.to_numpy(dtype=object)))
+
+def load_emb_map_for_trials(trials_df: pd.DataFrame, emb_dir: Path, emb_map: Optional[Dict[str,np.ndarray]] = None,
+                            store: Optional[EmbeddingStore] = None, workers: int = 8) -> Dict[str,np.ndarray]:
+    """
+    Vectores de los objetos que aparecen en los trials y aún no están en emb_map: del store (filas de la matriz mmap)
+    o de los .pkl, en paralelo con un pool de threads (carga de archivos = I/O).
+    """
+    emb_map = {} if emb_map is None else emb_map
+    wanted = [oid for oid in unique_trial_object_ids(trials_df) if oid not in emb_map]
+    counts = {"found": 0, "missing": 0, "corrupt": 0}
+    if store is not None:
+        found = store.as_emb_map(wanted)
+        emb_map.update(found)
+        counts["found"] = len(found)
+        counts["missing"] = len(wanted) - len(found)
+    elif wanted:
+        load = partial(_load_embedding_pkl_status, emb_dir)
+        if workers and workers > 1 and len(wanted) > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, len(wanted))) as ex:
+                results = list(ex.map(load, wanted))
+        else:
+            results = [load(oid) for oid in wanted]
+        for oid, (v, status) in zip(wanted, results):
+            counts[status] += 1
+            if v is not None: emb_map[oid] = v
+    print(f"[INFO] Embeddings for {len(wanted)} unique object ids: found {counts['found']}, "
+          f"missing {counts['missing']}, corrupt {counts['corrupt']}")
+    return emb_map
+
+def annotate_trial_similarity(trials_df: pd.DataFrame, emb_map: Dict[str,np.ndarray], sim_thresh: float = 0.8,
+                              sim_cache: Optional[SimilarityCache] = None):
+    aggs = similarity_aggs_batch(trials_df["object_id"].to_numpy(dtype=object), trials_df["render_group"].to_numpy(dtype=object),
+                                 emb_map, topk=3, thresh=sim_thresh, sim_cache=sim_cache)
+    for k in SIM_AGG_COLUMNS:
+        trials_df[k] = aggs[k]
+
+SET_NUMERIC_COLUMNS = {"set_intra_mean": "intra_mean", "set_hardness_pct": "hardness_pct",
+                       "set_easiness_pct": "easiness_pct", "set_size": "size"}
+SET_COLUMNS = list(SET_NUMERIC_COLUMNS) + ["set_difficulty","set_subpoolId","set_category"]
+
+def annotate_trial_sets(trials_df: pd.DataFrame, diff_root: Dict[str,Any]):
+    """
+    set_* de cada trial. La búsqueda se hace una vez por key distinta (frozenset(render_group), object_category,
+    difficulty_hint) y las columnas se arman indexando los resultados por el código de key de cada fila.
+    Sin match: NaN en las numéricas y None en set_difficulty/set_subpoolId/set_category.
+    """
+    index = diff_root if isinstance(diff_root, DifficultySetIndex) else DifficultySetIndex(diff_root)
+    difficulty_hint = None
+    # optional: infer difficulty hint from chosenGroup? If your system stores it, use it
+    cats = trials_df["object_category"].tolist() if "object_category" in trials_df.columns else [None] * len(trials_df)
+    keys = [(frozenset(rg) if rg else None, c, difficulty_hint) for rg, c in zip(trials_df["render_group"].tolist(), cats)]
+    codes, uniq = pd.factorize(pd.Series(keys, dtype=object), use_na_sentinel=False)
+    results = [find_set_for_group(index, list(g) if g else [], difficulty_hint=h, category_hint=c) for g, c, h in uniq]
+    for col, k in SET_NUMERIC_COLUMNS.items():
+        vals = np.array([np.nan if r is None or r["set"].get(k) is None else r["set"].get(k) for r in results], dtype=float)
+        trials_df[col] = vals[codes]
+    for col, get in [("set_difficulty", lambda r: r["set"].get("difficulty")),
+                     ("set_subpoolId", lambda r: r.get("subpoolId")),
+                     ("set_category", lambda r: r.get("category"))]:
+        vals = np.array([None if r is None else get(r) for r in results], dtype=object)
+        trials_df[col] = vals[codes]
+
+def iter_trial_audits(trials_df: pd.DataFrame) -> Iterator[Dict[str,Any]]:
+    """Registro de auditoría por trial: descripción parseada original + sim_* + set_* + _session_id/_trial_index."""
+    feature_cols = [k for k in AUDIT_FEATURE_COLUMNS if k in trials_df.columns]
+    cols = [c for c in ["_parsed_description", "session_id", "trial_index"] if c in trials_df.columns] + feature_cols
+    for r in trials_df[cols].to_dict("records"):
+        parsed = r.get("_parsed_description") or {}
+        audit = dict(parsed)  # start from parsed description
+        # add computed sim fields if present
+        for k in feature_cols:
+            audit[k] = (None if pd.isna(r.get(k)) else r.get(k))
+        # ensure minimal metadata
+        audit["_session_id"] = r.get("session_id")
+        audit["_trial_index"] = int(r.get("trial_index")) if pd.notna(r.get("trial_index")) else None
+        yield audit
+
+def write_trial_audits(trials_df: pd.DataFrame, sink: AuditSink):
+    sink.write_many(iter_trial_audits(trials_df))
+    sink.flush()
+
+def compute_sessions_df(trials_df: pd.DataFrame, sim_thresh: float = 0.8, sdt: bool = False) -> pd.DataFrame:
+    """Una fila por sesión (orden por session_id) con accuracy_by_similarity / p_diff_by_label como dicts."""
+    return fold_label_columns(session_features_table(trials_df, sim_thresh=sim_thresh, sdt=sdt))
+
+# ---------------------------
+# Pipeline por shards de sesiones (--workers N)
+# ---------------------------
+# Cada worker recibe las filas de un bloque de sesiones contiguas (en orden de session_id) y calcula sim_*, set_* y
+# la tabla ancha de sus sesiones. La matriz de embeddings no se copia: los workers abren el store con mmap o, sin
+# store, se adjuntan a un bloque de shared memory con la matriz de emb_map. El padre reubica las columnas por
+# posición y concatena las sesiones en orden de shard, así la salida es idéntica byte a byte a la de un solo proceso.
+# Las filas de cada shard viajan con su tarea (cada worker recibe solo las suyas, también con spawn en Windows) y de
+# vuelta solo vienen las columnas calculadas y los pares de similitud nuevos. Con menos de SHARD_MIN_TRIALS trials por
+# worker (o un solo core) el pool cuesta más de lo que reparte y se usa el camino de un solo proceso.
+SHARD_MIN_TRIALS = 50_000
+SHARD_COLUMNS = ["session_id","participant_id","object_id","render_group","object_category","object_actual_moved",
+                 "response","object_similarity_label","reaction_time_ms","swap_event","swap_history"]
 
-    logs_path = Path(args.logs)
-    logs = load_logs_file(logs_path)
-    trials_df = extract_trials_from_logs(logs)
+_SHARD: Dict[str,Any] = {}  # estado del proceso worker (lo arma _init_shard_worker)
+
+def session_shards(trials_df: pd.DataFrame, n_shards: int) -> List[np.ndarray]:
+    """
+    Posiciones de fila (ascendentes) de cada shard: sesiones contiguas en orden de session_id, sin partir ninguna
+    sesión, balanceadas por cantidad de trials. Los trials sin session_id van en un último shard aparte.
+    """
+    codes, sids = pd.factorize(trials_df["session_id"], sort=True)
+    counts = np.bincount(codes[codes >= 0], minlength=len(sids))
+    n_shards = max(1, min(n_shards, len(sids)))
+    before = np.cumsum(counts) - counts
+    shard_of_session = np.minimum(before * n_shards // max(1, counts.sum()), n_shards - 1)
+    row_shard = np.where(codes >= 0, shard_of_session[np.maximum(codes, 0)] if len(sids) else 0, n_shards)
+    shards = [np.flatnonzero(row_shard == k) for k in range(n_shards + 1)]
+    return [s for s in shards if len(s)]
+
+def merge_session_tables(tables: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatena tablas anchas de shards (ya en orden de session_id) con las columnas por etiqueta que tendría la tabla
+    de una sola corrida: un shard sin alguna etiqueta no tiene esa columna, así que cada grupo <prefijo>__<label>
+    se rearma con la unión de etiquetas ordenada (como pd.factorize(sort=True)) en la posición del grupo.
+    """
+    tables = [t for t in tables if t is not None]
+    if not tables:
+        return pd.DataFrame()
+    def skeleton(t):
+        out = []
+        for c in t.columns:
+            key = c.split("__", 1)[0] + "__*" if "__" in c else c
+            if key not in out: out.append(key)
+        return out
+    labels: Dict[str,Set[str]] = {}
+    for t in tables:
+        for c in t.columns:
+            if "__" in c:
+                prefix, lab = c.split("__", 1)
+                labels.setdefault(prefix, set()).add(lab)
+    columns = []
+    for key in max((skeleton(t) for t in tables), key=len):
+        if key.endswith("__*"):
+            prefix = key[:-3]
+            columns += [f"{prefix}__{lab}" for lab in sorted(labels[prefix])]
+        else:
+            columns.append(key)
+    merged = pd.concat(tables, ignore_index=True, sort=False)
+    return merged[columns]
+
+def _share_matrix(matrix: np.ndarray):
+    """Copia la matriz a un bloque de shared memory; devuelve (bloque, spec para adjuntarse desde otro proceso)."""
+    from multiprocessing import shared_memory
+    matrix = np.ascontiguousarray(matrix)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, matrix.nbytes))
+    np.ndarray(matrix.shape, dtype=matrix.dtype, buffer=shm.buf)[...] = matrix
+    return shm, {"name": shm.name, "shape": matrix.shape, "dtype": matrix.dtype.str}
+
+def _init_shard_worker(emb_spec: Optional[Dict[str,Any]], diff_index: Optional[DifficultySetIndex], options: Dict[str,Any]):
+    _SHARD.clear()
+    _SHARD.update(diff_index=diff_index, emb_map={}, sim_cache=None, **options)
+    if not emb_spec:
+        return
+    ids = emb_spec["ids"]
+    if emb_spec["kind"] == "store":
+        store = load_embedding_store(Path(emb_spec["emb_dir"]), mmap=True)
+        _SHARD["emb_map"] = store.as_emb_map(ids)
+        if emb_spec.get("sim_cache"):
+            _SHARD["sim_cache"] = SimilarityCache.open(store, Path(emb_spec["emb_dir"]))
+    else:
+        from multiprocessing import shared_memory
+        shm = shared_memory.SharedMemory(name=emb_spec["name"])
+        matrix = np.ndarray(emb_spec["shape"], dtype=np.dtype(emb_spec["dtype"]), buffer=shm.buf)
+        _SHARD["shm"] = shm  # mantener el bloque abierto mientras viva el worker
+        _SHARD["emb_map"] = {oid: matrix[i] for i, oid in enumerate(ids)}
+
+def _shard_features(task: Tuple[np.ndarray,pd.DataFrame]) -> Dict[str,Any]:
+    positions, df = task
+    cache = _SHARD["sim_cache"]
+    hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    known = cache.keys if cache is not None else None
+    out = {"positions": positions, "columns": {}, "sessions": None, "sim_pairs": None, "sim_counts": (0, 0)}
+    if _SHARD["emb_map"]:
+        annotate_trial_similarity(df, _SHARD["emb_map"], sim_thresh=_SHARD["sim_thresh"], sim_cache=_SHARD["sim_cache"])
+        out["columns"].update({c: df[c].to_numpy() for c in SIM_AGG_COLUMNS})
+    if _SHARD["diff_index"] is not None:
+        annotate_trial_sets(df, _SHARD["diff_index"])
+        out["columns"].update({c: df[c].to_numpy() for c in SET_COLUMNS})
+    if _SHARD["with_sessions"]:
+        out["sessions"] = session_features_table(df, sim_thresh=_SHARD["sim_thresh"], sdt=_SHARD["sdt"])
+    if cache is not None:
+        out["sim_counts"] = (cache.hits - hits, cache.misses - misses)
+        if cache.misses > misses:
+            new = ~np.isin(cache.keys, known)  # solo los pares calculados en este shard, no el cache entero
+            out["sim_pairs"] = (cache.keys[new], cache.values[new])
+    return out
+
+def shard_workers(n_trials: int, workers: int, min_trials: int = SHARD_MIN_TRIALS) -> int:
+    """Procesos que usa run_sharded_features: como mucho los cores y uno cada min_trials trials."""
+    return max(1, min(workers, os.cpu_count() or 1, n_trials // max(1, min_trials)))
+
+def run_sharded_features(trials_df: pd.DataFrame, workers: int, emb_map: Dict[str,np.ndarray],
+                         store: Optional[EmbeddingStore] = None, emb_dir: Optional[Path] = None,
+                         sim_cache: Optional[SimilarityCache] = None, diff_root: Optional[Dict[str,Any]] = None,
+                         sim_thresh: float = 0.8, sdt: bool = False, with_sessions: bool = True,
+                         min_trials: int = SHARD_MIN_TRIALS) -> Optional[pd.DataFrame]:
+    """
+    annotate_trial_similarity + annotate_trial_sets (+ session_features_table si with_sessions) repartidos en un pool
+    de procesos por shards de sesiones. Anota trials_df en el lugar; devuelve la tabla ancha de sesiones (o None).
+    Los workers se limitan a los cores y a uno cada SHARD_MIN_TRIALS trials; si queda uno se calcula acá mismo.
+    """
+    import multiprocessing as mp
+    workers = shard_workers(len(trials_df), workers, min_trials)
+    if workers <= 1:
+        if emb_map:
+            annotate_trial_similarity(trials_df, emb_map, sim_thresh=sim_thresh, sim_cache=sim_cache)
+        if diff_root is not None:
+            annotate_trial_sets(trials_df, diff_root)
+        return session_features_table(trials_df, sim_thresh=sim_thresh, sdt=sdt) if with_sessions else None
+    shards = session_shards(trials_df, workers * 4)
+    emb_spec, shm = None, None
+    if emb_map:
+        ids = list(emb_map)
+        if store is not None:
+            emb_spec = {"kind": "store", "emb_dir": str(emb_dir), "ids": ids, "sim_cache": sim_cache is not None}
+        else:
+            shm, spec = _share_matrix(emb_matrix_from_map(emb_map)[1])
+            emb_spec = {"kind": "shm", "ids": ids, **spec}
+    diff_index = None if diff_root is None else (diff_root if isinstance(diff_root, DifficultySetIndex) else DifficultySetIndex(diff_root))
+    trials = trials_df[[c for c in SHARD_COLUMNS if c in trials_df.columns]]
+    options = {"sim_thresh": sim_thresh, "sdt": sdt, "with_sessions": with_sessions}
+    ctx = mp.get_context("fork") if "fork" in mp.get_all_start_methods() else mp.get_context()
+    try:
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards)) or 1, mp_context=ctx, initializer=_init_shard_worker,
+                                 initargs=(emb_spec, diff_index, options)) as ex:
+            results = list(ex.map(_shard_features, ((pos, trials.take(pos)) for pos in shards)))
+    finally:
+        if shm is not None:
+            shm.close(); shm.unlink()
+
+    n = len(trials_df)
+    full: Dict[str,np.ndarray] = {}
+    for r in results:
+        for c, vals in r["columns"].items():
+            if c not in full:
+                full[c] = np.full(n, np.nan) if vals.dtype.kind == "f" else np.full(n, None, dtype=object)
+            full[c][r["positions"]] = vals
+        if sim_cache is not None:
+            sim_cache.hits += r["sim_counts"][0]
+            sim_cache.misses += r["sim_counts"][1]
+            if r["sim_pairs"] is not None:
+                sim_cache.update(*r["sim_pairs"])
+    # mismo orden de creación de columnas que la corrida de un solo proceso
+    for c in SIM_AGG_COLUMNS + SET_COLUMNS:
+        if c in full:
+            trials_df[c] = full[c]
+    return merge_session_tables([r["sessions"] for r in results]) if with_sessions else None
+
+# ---------------------------
+# Incremental processing (manifest de logs ya procesados)
+# ---------------------------
+# outdir/incremental/
+#   manifest.json  -> {"version", "config", "files": {path: {size, mtime, sha256, trial_keys}}}
+#   trials.pkl / sessions.pkl -> DataFrames completos (pickle: conserva listas/dicts, a diferencia del CSV);
+#                                trials.pkl lleva además _source_file para mantener el orden de una corrida completa
+# Los archivos que desaparecen de --logs NO borran sus trials (LogManager borra los offline_logs ya reenviados).
+MANIFEST_VERSION = 1
+
+def file_sha256(path: Path, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _path_signature(path: Optional[str]):
+    if not path:
+        return None
+    p = Path(path)
+    try:
+        st = p.stat()
+        return {"path": str(p.resolve()), "size": st.st_size, "mtime": st.st_mtime}
+    except OSError:
+        return {"path": str(p.resolve())}
+
+def _embedding_signature(emb_dir: Optional[str]):
+    # con store consolidado su versión (hash de ids + matriz) identifica los embeddings mejor que el mtime del dir
+    if emb_dir and has_store(Path(emb_dir)) and not store_is_stale(Path(emb_dir)):
+        try:
+            return {"path": str(Path(emb_dir).resolve()), "store_version": load_embedding_store(Path(emb_dir)).version}
+        except Exception:
+            pass
+    return _path_signature(emb_dir)
+
+def incremental_config(args) -> Dict[str,Any]:
+    """Todo lo que cambia los features por trial: si difiere del manifest se reconstruye desde cero."""
+    return {
+        "emb_dir": _embedding_signature(args.emb_dir),
+        "difficulty_sets": _path_signature(args.difficulty_sets),
+        "sim_thresh": args.sim_thresh,
+        "keep_raw_event": not args.drop_raw_event,
+        "sdt_metrics": args.sdt_metrics,
+        # otro formato de salida -> reescritura completa (p.ej. trials/ de Parquet nunca escrito en corridas CSV)
+        "format": args.format,
+    }
+
+def _empty_manifest(config: Dict[str,Any]) -> Dict[str,Any]:
+    return {"version": MANIFEST_VERSION, "config": config, "files": {}}
+
+def load_incremental_state(state_dir: Path, config: Dict[str,Any]):
+    """Devuelve (manifest, trials_df | None, sessions_df | None); estado vacío si no existe o no es compatible."""
+    manifest_path = state_dir / "manifest.json"
+    trials_path = state_dir / "trials.pkl"
+    sessions_path = state_dir / "sessions.pkl"
+    if not manifest_path.exists():
+        return _empty_manifest(config), None, None
+    try:
+        manifest = json.loads(manifest_path.read_text(encoding="utf8"))
+        if manifest.get("version") != MANIFEST_VERSION or manifest.get("config") != config:
+            print("[INFO] Incremental: configuration changed since last run -> full rebuild")
+            return _empty_manifest(config), None, None
+        trials_df = pd.read_pickle(trials_path) if trials_path.exists() else None
+        sessions_df = pd.read_pickle(sessions_path) if sessions_path.exists() else None
+        if trials_df is None or sessions_df is None or "_source_file" not in trials_df.columns:
+            return _empty_manifest(config), None, None
+        return manifest, trials_df, sessions_df
+    except Exception as e:
+        print(f"[WARN] could not load incremental state from {state_dir} ({e}) -> full rebuild")
+        return _empty_manifest(config), None, None
+
+def incremental_state_files(state_dir: Path) -> Optional[Dict[str,Any]]:
+    """version, config y {archivo: sha256} del manifest guardado (sin cargar los pickles); None si no hay estado."""
+    try:
+        manifest = json.loads((state_dir / "manifest.json").read_text(encoding="utf8"))
+    except (OSError, ValueError):
+        return None
+    return {"version": manifest.get("version"), "config": manifest.get("config"),
+            "files": {path: entry.get("sha256") for path, entry in manifest.get("files", {}).items()}}
+
+def save_incremental_state(state_dir: Path, manifest: Dict[str,Any], trials_df: pd.DataFrame,
+                           trial_sources: np.ndarray, sessions_df: pd.DataFrame):
+    state_dir.mkdir(parents=True, exist_ok=True)
+    # los pickles primero y el manifest al final (write + replace): si el proceso muere a mitad,
+    # el manifest viejo no apunta a archivos que el nuevo estado ya no tiene
+    for name, df in [("trials.pkl", trials_df.assign(_source_file=trial_sources)), ("sessions.pkl", sessions_df)]:
+        tmp = state_dir / (name + ".tmp")
+        df.to_pickle(tmp)
+        os.replace(tmp, state_dir / name)
+    tmp = state_dir / "manifest.json.tmp"
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf8")
+    os.replace(tmp, state_dir / "manifest.json")
+
+def _key_value(v):
+    if v is None or (isinstance(v, float) and np.isnan(v)) or v is pd.NA:
+        return None
+    return v.item() if isinstance(v, np.generic) else v
+
+def trial_keys(trials_df: pd.DataFrame) -> List[Tuple[Any,Any]]:
+    if len(trials_df) == 0:
+        return []
+    return [(_key_value(sid), _key_value(idx)) for sid, idx in zip(trials_df["session_id"], trials_df["trial_index"])]
+
+def plan_incremental_files(paths: List[Path], manifest: Dict[str,Any]) -> Tuple[List[Path], Set[Tuple[Any,Any]]]:
+    """
+    Compara `paths` contra el manifest: un archivo es igual si coinciden size+mtime (o, si no, el sha256).
+    Devuelve (archivos a parsear, trial keys que produjeron las versiones viejas de los archivos modificados).
+    """
+    files = manifest["files"]
+    to_parse = []
+    stale_keys = set()
+    for p in paths:
+        key = str(p.resolve())
+        st = p.stat()
+        prev = files.get(key)
+        if prev is not None:
+            if prev.get("size") == st.st_size and prev.get("mtime") == st.st_mtime:
+                continue
+            digest = file_sha256(p)
+            if prev.get("sha256") == digest:
+                prev["mtime"] = st.st_mtime  # tocado pero sin cambios
+                continue
+            stale_keys.update(tuple(k) for k in prev.get("trial_keys", []))
+        to_parse.append(p)
+    return to_parse, stale_keys
+
+def record_parsed_files(manifest: Dict[str,Any], paths: List[Path], frames: List[pd.DataFrame]):
+    for p, df in zip(paths, frames):
+        st = p.stat()
+        manifest["files"][str(p.resolve())] = {
+            "size": st.st_size, "mtime": st.st_mtime, "sha256": file_sha256(p),
+            "trial_keys": [list(k) for k in trial_keys(df)],
+        }
+
+def merge_incremental_trials(cached_trials: Optional[pd.DataFrame], new_trials: pd.DataFrame, new_sources: np.ndarray,
+                             stale_keys: Set[Tuple[Any,Any]], log_paths: List[Path]):
+    """
+    Reemplaza en el estado cacheado los trials de archivos modificados (stale_keys) o re-emitidos con la misma
+    (session_id, trial_index) y agrega los nuevos. Las filas quedan en el orden de `log_paths` (como una corrida
+    completa); las de archivos que ya no están van primero. Devuelve (trials_df, _source_file por fila, sesiones tocadas).
+    """
+    new_keys = trial_keys(new_trials)
+    touched = {k[0] for k in new_keys}
+    if cached_trials is None or len(cached_trials) == 0:
+        return new_trials, new_sources, touched
+    cached_trials = cached_trials.copy()
+    cached_sources = cached_trials.pop("_source_file").to_numpy(dtype=object)
+    drop_keys = stale_keys | set(new_keys)
+    cached_keys = trial_keys(cached_trials)
+    drop = np.fromiter((k in drop_keys for k in cached_keys), dtype=bool, count=len(cached_keys))
+    touched.update(k[0] for k, d in zip(cached_keys, drop) if d)
+    merged = concat_trial_frames([cached_trials.loc[~drop], new_trials])
+    if len(merged) == 0:
+        merged = cached_trials.loc[~drop].reset_index(drop=True)
+    sources = np.concatenate([cached_sources[~drop], new_sources]).astype(object)
+    rank_of = {str(p.resolve()): i for i, p in enumerate(log_paths)}
+    rank = np.fromiter((rank_of.get(src, -1) for src in sources), dtype=np.int64, count=len(sources))
+    order = np.argsort(rank, kind="stable")
+    if not np.array_equal(order, np.arange(len(order))):
+        merged = merged.iloc[order].reset_index(drop=True)
+        sources = sources[order]
+    return merged, sources, touched
+
+def merge_incremental_sessions(cached_sessions: Optional[pd.DataFrame], trials_df: pd.DataFrame,
+                               touched: Set[Any], sim_thresh: float = 0.8, sdt: bool = False) -> pd.DataFrame:
+    """Recalcula solo las sesiones tocadas; el resto se toma del estado cacheado. Orden por session_id (= groupby)."""
+    if cached_sessions is None or len(cached_sessions) == 0:
+        return compute_sessions_df(trials_df, sim_thresh=sim_thresh, sdt=sdt)
+    touched = {t for t in touched if t is not None}
+    recomputed = compute_sessions_df(trials_df[trials_df["session_id"].isin(touched)], sim_thresh=sim_thresh, sdt=sdt)
+    kept = cached_sessions[~cached_sessions["session_id"].isin(touched)]
+    frames = [f for f in [kept, recomputed] if len(f) > 0]
+    if not frames:
+        return recomputed
+    merged = pd.concat(frames, ignore_index=True, sort=False)
+    return merged.sort_values("session_id", kind="stable").reset_index(drop=True)
+
+# ---------------------------
+# Parquet / Arrow output (--format parquet)
+# ---------------------------
+# Las columnas anidadas (render_group, swap_history, _raw_event, _parsed_description, accuracy_by_similarity, ...)
+# se guardan como list/struct nativos. Si Arrow no puede inferir un tipo único para una columna (p.ej. swap_history
+# mezclando dict y list) esa columna se guarda como JSON string y queda listada en la metadata "json_columns".
+PARQUET_JSON_COLUMNS_KEY = b"json_columns"
+
+def _has_empty_struct(t) -> bool:
+    # Parquet no puede escribir struct<> (p.ej. una columna donde todos los dicts están vacíos)
+    if pa.types.is_struct(t):
+        return t.num_fields == 0 or any(_has_empty_struct(t.field(i).type) for i in range(t.num_fields))
+    if pa.types.is_list(t) or pa.types.is_large_list(t):
+        return _has_empty_struct(t.value_type)
+    return False
+
+def _json_or_none(v):
+    if v is None or v is pd.NA or (isinstance(v, float) and np.isnan(v)):
+        return None
+    return json.dumps(v, ensure_ascii=False, default=str)
+
+def dataframe_to_arrow(df: pd.DataFrame) -> "pa.Table":
+    arrays, json_cols = [], []
+    for c in df.columns:
+        col = df[c]
+        try:
+            arr = pa.array(col, from_pandas=True)
+            if _has_empty_struct(arr.type):
+                raise pa.ArrowInvalid(f"empty struct in column {c}")
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            arr = pa.array([_json_or_none(v) for v in col], type=pa.string())
+            json_cols.append(c)
+        arrays.append(arr)
+    table = pa.Table.from_arrays(arrays, names=[str(c) for c in df.columns])
+    return table.replace_schema_metadata({PARQUET_JSON_COLUMNS_KEY: json.dumps(json_cols).encode("utf8")})
+
+def write_trials_parquet(trials_df: pd.DataFrame, out_dir: Path, sessions: Optional[Set[Any]] = None):
+    """
+    Dataset particionado por participant_id/session_id (hive: participant_id=.../session_id=.../part-0.parquet).
+    sessions=None reescribe el dataset completo; si no, solo las particiones de esas sesiones.
+    """
+    if sessions is None:
+        shutil.rmtree(out_dir, ignore_errors=True)
+    else:
+        trials_df = trials_df[trials_df["session_id"].isin(sessions)]
+    if len(trials_df) == 0:
+        return
+    df = trials_df.copy()
+    for c in ["participant_id", "session_id"]:
+        df[c] = df[c].astype("string")
+    pq.write_to_dataset(dataframe_to_arrow(df), root_path=str(out_dir), partition_cols=["participant_id", "session_id"],
+                        basename_template="part-{i}.parquet", existing_data_behavior="delete_matching")
+
+def write_sessions_parquet(sessions_df: pd.DataFrame, out_path: Path):
+    pq.write_table(dataframe_to_arrow(sessions_df), str(out_path))
+
+def read_parquet_table(path: Path, columns: Optional[List[str]] = None, filters=None) -> "pa.Table":
+    """
+    Lectura para análisis posterior: solo las columnas/particiones pedidas, con memory map (sin copias para
+    columnas numéricas). p.ej. read_parquet_table(out/"trials", ["session_id","sim_max"], [("participant_id","=","p1")])
+    """
+    return pq.read_table(str(path), columns=columns, filters=filters, memory_map=True)
+
+def parquet_json_columns(table: "pa.Table") -> List[str]:
+    meta = table.schema.metadata or {}
+    return json.loads(meta.get(PARQUET_JSON_COLUMNS_KEY, b"[]"))
+
+# ---------------------------
+# RF training: matriz de features (cacheada) y cross-validation
+# ---------------------------
+RF_CACHE_FILE = "rf_xy_cache.joblib"
+RF_CACHE_VERSION = 2
+RF_DROP_COLUMNS = {"session_id", "participant_id", "label"}
+
+def merge_session_labels(sessions_df: pd.DataFrame, labels_df: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """sessions + labels por participant_id (o session_id); None si no queda una columna 'label'."""
+    for key in ("participant_id", "session_id"):
+        if key in labels_df.columns:
+            merged = sessions_df.merge(labels_df, on=key, how="left")
+            if "label" in merged.columns:
+                return merged
+    return None
+
+def flatten_feature_columns(merged: pd.DataFrame) -> pd.DataFrame:
+    """
+    Versión por columnas del flatten_row por fila: columnas numéricas tal cual, dicts -> <col>__<key>, el resto
+    (strings, None, ...) se descarta; faltantes -> 0.0. Mismo orden de columnas que el DataFrame de dicts por fila
+    (orden de primera aparición: fila, columna, key del dict).
+    """
+    found = {}  # nombre -> [primera fila, columna, posición de la key en el dict, valores]
+    n = len(merged)
+    for ci, c in enumerate(merged.columns):
+        if c in RF_DROP_COLUMNS:
+            continue
+        col = merged[c]
+        if col.dtype.kind in "biuf":
+            if n:
+                found.setdefault(c, [0, ci, 0, col.to_numpy()])
+            continue
+        for ri, v in enumerate(col.tolist()):
+            if isinstance(v, dict):
+                for ki, (kk, vv) in enumerate(v.items()):
+                    name = f"{c}__{kk}"
+                    entry = found.get(name)
+                    if entry is None:
+                        entry = found[name] = [ri, ci, ki, np.full(n, np.nan, dtype=object)]
+                    entry[3][ri] = vv
+            elif isinstance(v, (int, float, np.floating, np.integer)):
+                entry = found.get(c)
+                if entry is None:
+                    entry = found[c] = [ri, ci, 0, np.full(n, np.nan, dtype=object)]
+                entry[3][ri] = v
+    order = sorted(found, key=lambda name: tuple(found[name][:3]))
+    X = pd.DataFrame({name: found[name][3] for name in order}, index=range(n))
+    obj = [name for name in order if X[name].dtype == object]
+    if obj:
+        X[obj] = X[obj].infer_objects()
+    return X.fillna(0.0)
+
+def rf_training_data(sessions_df: pd.DataFrame, labels_df: pd.DataFrame):
+    """(X, y) para el RF, o None si los labels no tienen 'label' después de los joins."""
+    merged = merge_session_labels(sessions_df, labels_df)
+    if merged is None:
+        return None
+    return flatten_feature_columns(merged), merged["label"].values
+
+def rf_cache_config(args, outdir: Path) -> Dict[str,Any]:
+    """Config que define X (la de --incremental + modo y sink de auditoría, que también se escriben en outdir)."""
+    config = {**incremental_config(args), "incremental": args.incremental, "audit_sink": args.audit_sink}
+    if args.incremental:
+        # el estado incremental conserva trials de logs que ya no están en --logs: sus archivos también definen X
+        config["state_files"] = incremental_state_files(outdir / "incremental")
+    return config
+
+def rf_cache_key(log_paths: List[Path], labels_path: Path, config: Dict[str,Any]) -> str:
+    """
+    Manifest de los logs (path, size, mtime, igual que el chequeo rápido de plan_incremental_files) + config de
+    features + sha256 del CSV de labels. Solo hace stat de los logs: se puede validar antes de parsearlos.
+    """
+    manifest = [_path_signature(str(p)) for p in log_paths]
+    blob = json.dumps({"logs": manifest, "config": config}, sort_keys=True, ensure_ascii=False, default=str)
+    return f"v{RF_CACHE_VERSION}:{hashlib.sha256(blob.encode('utf8')).hexdigest()}:{file_sha256(labels_path)}"
+
+def rf_outputs_exist(outdir: Path, fmt: str) -> bool:
+    """trials/sessions de la corrida que guardó el cache (si faltan hay que correr el pipeline igual)."""
+    if fmt == "parquet":
+        return (outdir / "trials").is_dir() and (outdir / "sessions.parquet").exists()
+    return (outdir / "trials.csv").exists() and (outdir / "sessions.csv").exists()
+
+def load_rf_cache(path: Path, key: str):
+    if not path.exists():
+        return None
+    try:
+        cached = joblib.load(path)
+    except Exception as e:
+        print(f"[WARN] could not read RF feature cache {path}: {e}")
+        return None
+    if cached.get("key") != key:
+        return None
+    return cached["X"], cached["y"]
+
+def save_rf_cache(path: Path, key: str, X: pd.DataFrame, y: np.ndarray):
+    tmp = path.with_name(path.name + ".tmp")
+    joblib.dump({"key": key, "X": X, "y": y}, tmp)
+    os.replace(tmp, path)
+
+def cross_validate_rf(rf: RandomForestClassifier, X: pd.DataFrame, y: np.ndarray, cv, n_jobs: int = -1) -> Dict[str,np.ndarray]:
+    """Un solo cross_validate con accuracy (+ ROC AUC si y es binaria): cada fold se entrena una vez, folds en paralelo."""
+    scoring = {"accuracy": "accuracy"}
+    if len(pd.unique(y)) == 2:
+        scoring["roc_auc"] = "roc_auc"
+    res = cross_validate(rf, X, y, cv=cv, scoring=scoring, n_jobs=n_jobs)
+    return {name: res[f"test_{name}"] for name in scoring}
+
+# ---------------------------
+# Main flow (integración con difficulty sets y guardado per-trial JSON)
+# ---------------------------
+def run_feature_pipeline(args, outdir: Path, log_paths: List[Path]) -> pd.DataFrame:
+    """Parseo de logs -> sim_*/set_* por trial -> auditoría -> features de sesión -> trials/sessions en outdir."""
+    if args.incremental:
+        state_dir = outdir / "incremental"
+        config = incremental_config(args)
+        manifest, cached_trials, cached_sessions = load_incremental_state(state_dir, config)
+        to_parse, stale_keys = plan_incremental_files(log_paths, manifest)
+        print(f"[INFO] Incremental: {len(to_parse)} new/changed of {len(log_paths)} log file(s)")
+    else:
+        to_parse = log_paths
+        print(f"[INFO] Parsing {len(log_paths)} log file(s)")
+    frames = load_trial_frames(to_parse, workers=args.parse_workers, stream=args.stream,
+                               chunk_size=args.chunk_size, keep_raw_event=not args.drop_raw_event)
+    if args.incremental:
+        record_parsed_files(manifest, to_parse, frames)
+        new_sources = np.repeat(np.array([str(p.resolve()) for p in to_parse], dtype=object), [len(f) for f in frames])
+    trials_df = concat_trial_frames(frames)
+    del frames
     print(f"[INFO] Extracted {len(trials_df)} trial rows")
 
     emb_map = {}
+    store, emb_dir, sim_cache = None, None, None
     if args.emb_dir:
         emb_dir = Path(args.emb_dir)
-        for idx, row in trials_df.iterrows():
-            for oid in (row.get("render_group") or []) + ([row.get("object_id")] if row.get("object_id") else []):
-                if oid and oid not in emb_map:
-                    v = load_embedding_pkl(emb_dir, oid)
-                    if v is not None: emb_map[oid] = v
+        store = open_embedding_store(emb_dir)
+        if store is not None:
+            print(f"[INFO] Using embedding store ({len(store)} vectors, version {store.version})")
+            if not args.no_sim_cache:
+                sim_cache = SimilarityCache.open(store, emb_dir)
+        emb_map = load_emb_map_for_trials(trials_df, emb_dir, store=store, workers=args.emb_workers)
         print(f"[INFO] Embeddings loaded for {len(emb_map)} unique objects")
 
     # dificultad
@@ -356,118 +1443,168 @@ def main():
         if diff_root:
             print("[INFO] Loaded difficulty sets JSON")
 
-    # compute sim-aggs per trial if emb_map not empty
-    if emb_map:
-        for i, r in trials_df.iterrows():
-            parsed = r.get("_parsed_description") or {}
-            ag = compute_similarity_aggs_for_trial(r.to_dict(), emb_map, topk=3, thresh=args.sim_thresh)
-            for k,v in ag.items():
-                trials_df.at[i, k] = v
-
-    # --- NEW: for each trial, try to find set in diff_root and annotate set_* columns
-    if diff_root is not None:
-        for i, r in trials_df.iterrows():
-            parsed = r.get("_parsed_description") or {}
-            rg = r.get("render_group") or []
-            difficulty_hint = None
-            # optional: infer difficulty hint from chosenGroup? If your system stores it, use it
-            res = find_set_for_group(diff_root, rg, difficulty_hint=difficulty_hint, category_hint=r.get("object_category"))
-            if res is not None:
-                s = res["set"]
-                trials_df.at[i, "set_intra_mean"] = s.get("intra_mean")
-                trials_df.at[i, "set_hardness_pct"] = s.get("hardness_pct")
-                trials_df.at[i, "set_easiness_pct"] = s.get("easiness_pct")
-                trials_df.at[i, "set_size"] = s.get("size")
-                trials_df.at[i, "set_difficulty"] = s.get("difficulty")
-                trials_df.at[i, "set_subpoolId"] = res.get("subpoolId")
-                trials_df.at[i, "set_category"] = res.get("category")
+    sessions_df = None
+    if args.workers > 1 and len(trials_df) > 0:
+        # sim_*, set_* y (sin --incremental) features de sesión en un pool de procesos por shards de sesiones
+        sessions_df = run_sharded_features(trials_df, args.workers, emb_map, store=store, emb_dir=emb_dir, sim_cache=sim_cache,
+                                           diff_root=diff_root, sim_thresh=args.sim_thresh, sdt=args.sdt_metrics,
+                                           with_sessions=not args.incremental)
+        print(f"[INFO] Trial/session features computed with {shard_workers(len(trials_df), args.workers)} worker process(es)")
+    else:
+        # compute sim-aggs per trial if emb_map not empty
+        if emb_map:
+            annotate_trial_similarity(trials_df, emb_map, sim_thresh=args.sim_thresh, sim_cache=sim_cache)
+
+        # --- NEW: for each trial, try to find set in diff_root and annotate set_* columns
+        if diff_root is not None:
+            annotate_trial_sets(trials_df, diff_root)
+    if sim_cache is not None:
+        print(f"[INFO] Similarity cache: {sim_cache.hits} pair hits, {sim_cache.misses} new pairs ({len(sim_cache)} cached)")
+        sim_cache.save()
+
+    # --- Auditoría: registro por trial que incluya sim_* y set_* y parsed description original
+    # (en modo incremental solo los trials nuevos: antes se borran del store los de logs modificados y los que se
+    # reescriben; si el estado incremental se reconstruye desde cero el store también)
+    if args.audit_sink != "none":
+        reset = not args.incremental or cached_trials is None
+        drop_keys = None if reset else stale_keys | set(trial_keys(trials_df))
+        with open_audit_sink(outdir, args.audit_sink, reset=reset, drop_keys=drop_keys) as sink:
+            write_trial_audits(trials_df, sink)
+        print(f"[INFO] Wrote {sink.written} audit records ({args.audit_sink}):", audit_store_path(outdir, args.audit_sink))
+
+    if args.incremental:
+        trials_df, trial_sources, touched = merge_incremental_trials(cached_trials, trials_df, new_sources, stale_keys, log_paths)
+        sessions_df = merge_incremental_sessions(cached_sessions, trials_df, touched, sim_thresh=args.sim_thresh,
+                                                 sdt=args.sdt_metrics)
+        print(f"[INFO] Incremental: {len(trials_df)} trials in total, recomputed {len(touched)} session(s)")
+    elif sessions_df is not None:
+        sessions_df = fold_label_columns(sessions_df)
+    else:
+        sessions_df = compute_sessions_df(trials_df, sim_thresh=args.sim_thresh, sdt=args.sdt_metrics)
+
+    if args.format == "parquet":
+        trials_out = outdir / "trials"
+        # solo las particiones tocadas si el dataset de la corrida anterior existe; si no, el dataset completo
+        partial = args.incremental and cached_trials is not None and trials_out.is_dir()
+        write_trials_parquet(trials_df, trials_out, sessions=touched if partial else None)
+        print("[INFO] Wrote trials Parquet dataset:", trials_out)
+        sessions_out = outdir / "sessions.parquet"
+        write_sessions_parquet(sessions_df, sessions_out)
+        print("[INFO] Wrote sessions Parquet:", sessions_out)
+    else:
+        # Save trial-by-trial CSV
+        trials_out = outdir / "trials.csv"
+        trials_df.to_csv(trials_out, index=False)
+        print("[INFO] Wrote trials CSV:", trials_out)
+
+        sessions_out = outdir / "sessions.csv"
+        sessions_df.to_csv(sessions_out, index=False)
+        print("[INFO] Wrote sessions CSV:", sessions_out)
+
+    if args.incremental:
+        save_incremental_state(state_dir, manifest, trials_df, trial_sources, sessions_df)
+        print("[INFO] Saved incremental state:", state_dir)
+    return sessions_df
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logs", required=True, nargs="+", help="Offline logs JSON: one or more files, directories or glob patterns")
+    parser.add_argument("--parse-workers", type=int, default=0, help="Processes used to parse log files (0 = cpu count)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes for similarity/set annotation and session features, sharded by session_id (output identical to 1)")
+    parser.add_argument("--stream", action="store_true", help="Stream the logs array event by event instead of loading whole files (large exports)")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="Trials per DataFrame chunk in --stream mode")
+    parser.add_argument("--drop-raw-event", action="store_true", help="Do not keep the _raw_event column (saves memory on large exports)")
+    parser.add_argument("--emb-dir", default=None, help="Optional: directory with embeddings .pkl (uses embeddings.npy store if present)")
+    parser.add_argument("--emb-workers", type=int, default=8, help="Threads used to load .pkl embeddings when there is no store")
+    parser.add_argument("--no-sim-cache", action="store_true",
+                        help="Do not read/update the pairwise similarity cache (emb_dir/similarity_cache.npz, needs the embedding store)")
+    parser.add_argument("--difficulty-sets", default=None, help="Optional: difficulty_sets_with_scores.json")
+    parser.add_argument("--labels", default=None, help="Optional CSV with columns ['participant_id' or 'session_id','label']")
+    parser.add_argument("--outdir", default="out_logs", help="Output folder")
+    parser.add_argument("--sim-thresh", type=float, default=0.8)
+    parser.add_argument("--sdt-metrics", action="store_true",
+                        help="Add hit/FA rate, criterion c, A', beta and per-label d' to the session features")
+    parser.add_argument("--rf-train", action="store_true", help="Train RandomForest if labels provided")
+    parser.add_argument("--rf-jobs", type=int, default=-1, help="Parallel CV folds / trees for --rf-train (-1 = all cores)")
+    parser.add_argument("--search", action="store_true",
+                        help="Successive-halving hyperparameter search for the session classifier (needs --labels); writes search_leaderboard.csv")
+    parser.add_argument("--search-hgb", action="store_true", help="Also search HistGradientBoostingClassifier in --search")
+    parser.add_argument("--search-factor", type=int, default=3, help="Halving factor: 1/factor of the configs survive each round")
+    parser.add_argument("--random-seed", type=int, default=0)
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                        help="Output format for trials/sessions (parquet: native list/struct columns, trials partitioned by participant_id/session_id)")
+    parser.add_argument("--audit-sink", choices=AUDIT_SINKS + ["none"], default="jsonl",
+                        help="Per-trial audit records: files (one JSON per trial in trial_jsons/), jsonl[.gz] or sqlite store")
+    parser.add_argument("--serve", default=None, metavar="ADDR",
+                        help="Watch --logs and serve per-session features over HTTP at host:port or unix:/path.sock (see feature_daemon.py)")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds between folder scans in --serve mode")
+    parser.add_argument("--track-trials", type=int, default=500_000,
+                        help="--serve: most recent trials whose contribution can still be retracted (re-sent or modified logs)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only parse new/changed log files (manifest in outdir/incremental) and recompute the sessions they touch")
+    args = parser.parse_args()
+    if args.serve:
+        from feature_daemon import serve
+        return serve(args)
+    if args.format == "parquet" and pa is None:
+        parser.error("--format parquet requires pyarrow (pip install pyarrow)")
+
+    outdir = Path(args.outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+
+    log_paths = resolve_log_paths(args.logs)
+    if not log_paths:
+        parser.error("--logs did not match any file")
+
+    # RF training / --search: X/y cacheados en outdir/rf_xy_cache.joblib. La key sale del manifest de --logs, la config
+    # de features y los labels (no de sessions.csv), así que se valida antes de parsear: si nada cambió se entrena
+    # directo con el X/y cacheado y no se vuelven a calcular los features
+    data, cache_path, use_rf = None, outdir / RF_CACHE_FILE, bool(args.labels and (args.rf_train or args.search))
+    if use_rf and rf_outputs_exist(outdir, args.format):
+        data = load_rf_cache(cache_path, rf_cache_key(log_paths, Path(args.labels), rf_cache_config(args, outdir)))
+    if data is not None:
+        print("[RF] Logs, feature config and labels unchanged: skipping feature extraction, using cached feature matrix:", cache_path)
+    else:
+        sessions_df = run_feature_pipeline(args, outdir, log_paths)
+        if use_rf:
+            data = rf_training_data(sessions_df, pd.read_csv(args.labels))
+            if data is not None:
+                # key calculada después de la corrida: con --incremental incluye el manifest que se acaba de guardar
+                save_rf_cache(cache_path, rf_cache_key(log_paths, Path(args.labels), rf_cache_config(args, outdir)), *data)
             else:
-                trials_df.at[i, "set_intra_mean"] = np.nan
-                trials_df.at[i, "set_hardness_pct"] = np.nan
-                trials_df.at[i, "set_easiness_pct"] = np.nan
-                trials_df.at[i, "set_size"] = np.nan
-                trials_df.at[i, "set_difficulty"] = None
-                trials_df.at[i, "set_subpoolId"] = None
-                trials_df.at[i, "set_category"] = None
-
-    # Save trial-by-trial CSV
-    trials_out = outdir / "trials.csv"
-    trials_df.to_csv(trials_out, index=False)
-    print("[INFO] Wrote trials CSV:", trials_out)
-
-    # --- Auditora: escribir JSON por trial que incluya sim_* y set_* y parsed description original
-    for i, r in trials_df.iterrows():
-        parsed = r.get("_parsed_description") or {}
-        audit = dict(parsed)  # start from parsed description
-        # add computed sim fields if present
-        for k in ["sim_max","sim_mean_top3","sim_count_above_0_8","sim_entropy",
-                  "set_intra_mean","set_hardness_pct","set_easiness_pct","set_size","set_difficulty","set_subpoolId","set_category"]:
-            if k in trials_df.columns:
-                audit[k] = (None if pd.isna(r.get(k)) else r.get(k))
-        # ensure minimal metadata
-        audit["_session_id"] = r.get("session_id")
-        audit["_trial_index"] = int(r.get("trial_index")) if pd.notna(r.get("trial_index")) else None
-        fname = f"{audit.get('_session_id','unknown')}_trial_{audit.get('_trial_index','idx')}.json"
-        (trial_json_dir / fname).write_text(json.dumps(audit, ensure_ascii=False, indent=2), encoding="utf8")
-
-    # Group by session_id to compute session features
-    sessions = []
-    for sid, group in trials_df.groupby("session_id"):
-        session_meta = {
-            "session_id": sid,
-            "participant_id": group["participant_id"].iloc[0] if len(group)>0 else None,
-            "n_trials": len(group)
-        }
-        feats = compute_session_features(group, sim_thresh=args.sim_thresh)
-        session_meta.update(feats)
-        sessions.append(session_meta)
-    sessions_df = pd.DataFrame(sessions)
-    sessions_out = outdir / "sessions.csv"
-    sessions_df.to_csv(sessions_out, index=False)
-    print("[INFO] Wrote sessions CSV:", sessions_out)
-
-    # RF training (unchanged from previous version)
-    if args.labels and args.rf_train:
-        labels_df = pd.read_csv(args.labels)
-        merged = sessions_df.merge(labels_df, left_on="participant_id", right_on="participant_id", how="left")
-        if "label" not in merged.columns:
-            merged = sessions_df.merge(labels_df, left_on="session_id", right_on="session_id", how="left")
-        if "label" not in merged.columns:
-            print("[WARN] Could not find 'label' after joins; labels CSV must contain 'participant_id' or 'session_id' + 'label' column.")
-        else:
-            def flatten_row(row):
-                flat = {}
-                for k,v in row.items():
-                    if isinstance(v, (int,float,np.floating,np.integer)):
-                        flat[k]=v
-                    elif isinstance(v, dict):
-                        for kk,vv in v.items():
-                            flat[f"{k}__{kk}"] = vv
-                return flat
-            feature_rows = []
-            for _, r in merged.iterrows():
-                flat = flatten_row(r.to_dict())
-                flat.pop("session_id", None); flat.pop("participant_id", None); flat.pop("label", None)
-                feature_rows.append(flat)
-            X = pd.DataFrame(feature_rows).fillna(0.0)
-            y = merged["label"].values
-            rf = RandomForestClassifier(n_estimators=200, oob_score=True, random_state=args.random_seed)
-            cv = StratifiedKFold(n_splits=5, shuffle=True, random_state=args.random_seed)
-            acc = cross_val_score(rf, X, y, cv=cv, scoring="accuracy")
-            try:
-                roc = cross_val_score(rf, X, y, cv=cv, scoring="roc_auc")
-                roc_mean = float(np.mean(roc))
-            except Exception:
-                roc_mean = float('nan')
-            print(f"[RF] CV accuracy mean: {np.mean(acc):.4f}  {np.std(acc):.4f}")
-            print(f"[RF] CV ROC AUC (if available): {roc_mean}")
-            rf.fit(X, y)
-            model_path = outdir / "rf_model.joblib"
-            joblib.dump({"model":rf, "feature_columns": list(X.columns)}, model_path)
-            fi = pd.DataFrame({"feature": X.columns, "importance": rf.feature_importances_}).sort_values("importance", ascending=False)
-            fi.to_csv(outdir / "feature_importances.csv", index=False)
-            if hasattr(rf, "oob_score_"):
-                print("[RF] OOB score:", rf.oob_score_)
+                print("[WARN] Could not find 'label' after joins; labels CSV must contain 'participant_id' or 'session_id' + 'label' column.")
+    if data is not None and args.search:
+        from model_search import run_search, recommend, search_metric
+        X, y = data
+        cv = StratifiedKFold(n_splits=5, shuffle=True, random_state=args.random_seed)
+        board = run_search(X, y, cv, ["rf", "hgb"] if args.search_hgb else ["rf"], factor=args.search_factor,
+                           n_jobs=args.rf_jobs, seed=args.random_seed)
+        board.to_csv(outdir / "search_leaderboard.csv", index=False)
+        print("[SEARCH] Wrote leaderboard:", outdir / "search_leaderboard.csv")
+        metric = search_metric(y)
+        best = recommend(board, metric)
+        if best is not None:
+            print(f"[SEARCH] Fastest config within 1 std of the best {metric}: {best['model']} {best['resource']}={best['budget']} "
+                  f"{best['params']} ({metric}={best[f'{metric}_mean']:.4f}, fit {best['fit_time_s']:.3f}s, "
+                  f"predict {best['predict_time_s']:.4f}s per fold)")
+    if data is not None and args.rf_train:
+        X, y = data
+        rf = RandomForestClassifier(n_estimators=200, oob_score=True, random_state=args.random_seed)
+        cv = StratifiedKFold(n_splits=5, shuffle=True, random_state=args.random_seed)
+        scores = cross_validate_rf(rf, X, y, cv, n_jobs=args.rf_jobs)
+        acc = scores["accuracy"]
+        roc_mean = float(np.mean(scores["roc_auc"])) if "roc_auc" in scores else float('nan')
+        print(f"[RF] CV accuracy mean: {np.mean(acc):.4f} ± {np.std(acc):.4f}")
+        print(f"[RF] CV ROC AUC (if available): {roc_mean}")
+        rf.set_params(n_jobs=args.rf_jobs)
+        rf.fit(X, y)
+        model_path = outdir / "rf_model.joblib"
+        joblib.dump({"model":rf, "feature_columns": list(X.columns)}, model_path)
+        fi = pd.DataFrame({"feature": X.columns, "importance": rf.feature_importances_}).sort_values("importance", ascending=False)
+        fi.to_csv(outdir / "feature_importances.csv", index=False)
+        if hasattr(rf, "oob_score_"):
+            print("[RF] OOB score:", rf.oob_score_)
     print("[DONE]")
 
 if __name__ == "__main__":
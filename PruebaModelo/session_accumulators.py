@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+session_accumulators.py - features por sesión en streaming (acumuladores combinables)
+
+compute_session_features / session_features_table necesitan todos los trials de la sesión. Acá cada sesión es un
+SessionAccumulator que recibe los trials de a uno (add) y se puede combinar con el de otro shard (merge), sin
+guardar los trials crudos:
+ - RunningMoments : media / desvío de reaction_time_ms (Welford; merge con la fórmula de Chan)
+ - MedianDigest   : mediana de RT; exacta mientras la sesión tenga <= exact_limit valores, después t-digest
+ - contadores     : aciertos, hits / false alarms (d', c, A', beta), swaps, sim_count_above_0_8
+ - por etiqueta   : n, aciertos, "different", hits/FA por object_similarity_label (accuracy_by_similarity, LDI)
+ - similitud      : max / suma / conteo de sim_max, sim_mean_top3, sim_entropy (salteando NaN)
+
+SessionAccumulators.table() devuelve la misma tabla ancha que session_features_table (y sessions_df() el formato
+de sessions.csv). Los valores coinciden con el cálculo por lotes salvo el redondeo de las sumas en streaming
+(~1e-12 relativo) y la mediana de sesiones de más de exact_limit trials (aproximada).
+
+  accs = SessionAccumulators()
+  for trial in trials:            # dicts con las columnas de trials.csv
+      accs.add(trial)
+  accs.merge(otros_accs)          # p.ej. el resultado de otro worker
+  sessions_df = accs.sessions_df()
+"""
+import math
+from typing import Any, Dict, Iterable, List, Mapping, Optional
+
+import numpy as np
+import pandas as pd
+
+from processTrialAndTrain import SDT_COLUMNS, fold_label_columns, len_sw
+from signal_detection import sdt_metrics
+
+def _missing(v) -> bool:
+    if v is None or v is pd.NA:
+        return True
+    try:
+        return bool(isinstance(v, (float, np.floating)) and math.isnan(v))
+    except TypeError:
+        return False
+
+def _equals(v, target) -> bool:
+    """v == target tolerando None/NaN/pd.NA (como (col == target).fillna(False))."""
+    if _missing(v):
+        return False
+    try:
+        return bool(v == target)
+    except (TypeError, ValueError):
+        return False
+
+def _as_float(v) -> float:
+    """Como pd.to_numeric(errors="coerce"): lo que no es numérico -> NaN."""
+    if _missing(v):
+        return math.nan
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return math.nan
+
+class RunningMoments:
+    """Media y varianza poblacional (ddof=0) con el algoritmo de Welford."""
+    __slots__ = ("n", "mean", "m2")
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x: float):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def merge(self, other: "RunningMoments") -> "RunningMoments":
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.n, self.mean, self.m2 = other.n, other.mean, other.m2
+            return self
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta * delta * self.n * other.n / n
+        self.n = n
+        return self
+
+    def std(self) -> float:
+        return math.sqrt(self.m2 / self.n) if self.n > 0 else math.nan
+
+class MedianDigest:
+    """
+    Cuantiles en streaming. Guarda los valores tal cual hasta exact_limit (mediana exacta, igual a pandas) y a partir
+    de ahí los resume en centroides de un t-digest (Dunning, escala k1) con `compression` como parámetro de tamaño.
+    """
+    def __init__(self, compression: float = 100.0, exact_limit: int = 2048):
+        self.compression = compression
+        self.exact_limit = exact_limit
+        self.buffer: List[float] = []
+        self.means = np.zeros(0)
+        self.weights = np.zeros(0)
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    @property
+    def exact(self) -> bool:
+        return len(self.means) == 0
+
+    def add(self, x: float):
+        self.buffer.append(x)
+        self.count += 1
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+        if self.count > self.exact_limit and len(self.buffer) >= self.exact_limit:
+            self._compress()
+
+    def merge(self, other: "MedianDigest") -> "MedianDigest":
+        if other.count == 0:
+            return self
+        self.buffer.extend(other.buffer)
+        if len(other.means):
+            self.means = np.concatenate([self.means, other.means])
+            self.weights = np.concatenate([self.weights, other.weights])
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if len(self.means) or self.count > self.exact_limit:
+            self._compress()
+        return self
+
+    def _compress(self):
+        means = np.concatenate([self.means, np.asarray(self.buffer, dtype=float)])
+        weights = np.concatenate([self.weights, np.ones(len(self.buffer))])
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        k_of = lambda q: self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+        out_m, out_w = [means[0]], [weights[0]]
+        q_left = 0.0
+        k_left = k_of(q_left)
+        for m, w in zip(means[1:], weights[1:]):
+            if k_of(q_left + (out_w[-1] + w) / total) - k_left <= 1.0:
+                out_m[-1] += (m - out_m[-1]) * w / (out_w[-1] + w)
+                out_w[-1] += w
+            else:
+                q_left += out_w[-1] / total
+                k_left = k_of(q_left)
+                out_m.append(m)
+                out_w.append(w)
+        self.means, self.weights = np.asarray(out_m), np.asarray(out_w)
+        self.buffer = []
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return math.nan
+        if self.exact:
+            return float(np.quantile(self.buffer, q))
+        if self.buffer:
+            self._compress()
+        # centro de cada centroide en la escala de rangos, con min / max en los extremos
+        centers = np.cumsum(self.weights) - self.weights / 2
+        return float(np.interp(q * self.count, np.concatenate([[0.0], centers, [self.count]]),
+                               np.concatenate([[self.min], self.means, [self.max]])))
+
+    def median(self) -> float:
+        if self.exact and self.count:
+            return float(np.median(self.buffer))
+        return self.quantile(0.5)
+
+# índices de los contadores por etiqueta
+_N, _CORRECT, _SAID_DIFF, _HITS, _N_SIGNAL, _FAS, _N_NOISE = range(7)
+
+class SessionAccumulator:
+    """Estado de una sesión; add(trial) con un dict de columnas de trials.csv, merge(otro) para combinar shards."""
+    def __init__(self, session_id: Any = None):
+        self.session_id = session_id
+        self.participant_id = None
+        self.n_trials = 0
+        self.correct = 0
+        self.hits = self.n_signal = self.fas = self.n_noise = 0
+        self.by_label: Dict[Any,List[int]] = {}
+        self.rt = RunningMoments()
+        self.rt_median = MedianDigest()
+        self.swap_count = 0
+        self.swaps_total = 0
+        self.sim_max = math.nan
+        self.top3_sum, self.top3_n = 0.0, 0
+        self.entropy_sum, self.entropy_n = 0.0, 0
+        self.count_above = 0
+        # qué columnas aparecieron (en el cálculo por lotes una columna ausente da NaN en lugar de 0)
+        self.seen = set()
+
+    def add(self, trial: Mapping[str,Any]) -> "SessionAccumulator":
+        if self.n_trials == 0:
+            self.participant_id = trial.get("participant_id")
+        self.n_trials += 1
+        self.seen.update(k for k in ("object_actual_moved", "response", "object_similarity_label", "reaction_time_ms",
+                                     "swap_event", "swap_history", "sim_max") if k in trial)
+        moved, response = trial.get("object_actual_moved"), trial.get("response")
+        is_target, is_foil = _equals(moved, True), _equals(moved, False)
+        said_diff = _equals(response, "different")
+        correct = (is_target and said_diff) or (is_foil and _equals(response, "same"))
+        self.correct += correct
+        self.hits += is_target and said_diff
+        self.n_signal += is_target
+        self.fas += is_foil and said_diff
+        self.n_noise += is_foil
+
+        label = trial.get("object_similarity_label")
+        if not _missing(label):
+            c = self.by_label.setdefault(label, [0] * 7)
+            c[_N] += 1
+            c[_CORRECT] += correct
+            c[_SAID_DIFF] += said_diff
+            c[_HITS] += is_target and said_diff
+            c[_N_SIGNAL] += is_target
+            c[_FAS] += is_foil and said_diff
+            c[_N_NOISE] += is_foil
+
+        rt = _as_float(trial.get("reaction_time_ms"))
+        if rt >= 0:  # NaN -> False
+            self.rt.add(rt)
+            self.rt_median.add(rt)
+
+        swap = trial.get("swap_event")
+        self.swap_count += (not _missing(swap)) and bool(swap)
+        self.swaps_total += len_sw(trial.get("swap_history"))
+
+        v = _as_float(trial.get("sim_max"))
+        if not math.isnan(v) and (math.isnan(self.sim_max) or v > self.sim_max):
+            self.sim_max = v
+        v = _as_float(trial.get("sim_mean_top3"))
+        if not math.isnan(v):
+            self.top3_sum += v
+            self.top3_n += 1
+        v = _as_float(trial.get("sim_entropy"))
+        if not math.isnan(v):
+            self.entropy_sum += v
+            self.entropy_n += 1
+        self.count_above += _as_float(trial.get("sim_count_above_0_8")) > 0
+        return self
+
+    def merge(self, other: "SessionAccumulator") -> "SessionAccumulator":
+        """Suma el estado de otro acumulador de la misma sesión (p.ej. de otro shard / archivo de log)."""
+        if self.n_trials == 0:
+            self.participant_id = other.participant_id
+        self.n_trials += other.n_trials
+        self.correct += other.correct
+        self.hits += other.hits
+        self.n_signal += other.n_signal
+        self.fas += other.fas
+        self.n_noise += other.n_noise
+        for label, counts in other.by_label.items():
+            mine = self.by_label.setdefault(label, [0] * 7)
+            for i, c in enumerate(counts):
+                mine[i] += c
+        self.rt.merge(other.rt)
+        self.rt_median.merge(other.rt_median)
+        self.swap_count += other.swap_count
+        self.swaps_total += other.swaps_total
+        if not math.isnan(other.sim_max) and (math.isnan(self.sim_max) or other.sim_max > self.sim_max):
+            self.sim_max = other.sim_max
+        self.top3_sum += other.top3_sum
+        self.top3_n += other.top3_n
+        self.entropy_sum += other.entropy_sum
+        self.entropy_n += other.entropy_n
+        self.count_above += other.count_above
+        self.seen |= other.seen
+        return self
+
+    def features(self, labels: Optional[List[Any]] = None, sdt: bool = False) -> Dict[str,Any]:
+        """Fila de la tabla ancha de session_features_table (labels = etiquetas de las columnas por etiqueta)."""
+        labels = sorted(self.by_label) if labels is None else labels
+        n = self.n_trials
+        has_resp = {"object_actual_moved", "response"} <= self.seen
+        has_label = "object_similarity_label" in self.seen
+        counts = np.array([self.by_label.get(lab, [0] * 7) for lab in labels], dtype=float).reshape(-1, 7)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            lab_acc = np.where(counts[:, _N] > 0, counts[:, _CORRECT] / counts[:, _N], np.nan)
+            lab_pdiff = np.where(counts[:, _N] > 0, counts[:, _SAID_DIFF] / counts[:, _N], np.nan)
+        nan = math.nan
+        s = {"session_id": self.session_id, "participant_id": self.participant_id, "n_trials": n,
+             "accuracy_overall": self.correct / n if has_resp and n else nan}
+        if has_label:
+            s.update({f"accuracy_by_similarity__{lab}": float(v) for lab, v in zip(labels, lab_acc)})
+        if "reaction_time_ms" in self.seen:
+            s["reaction_time_mean"] = self.rt.mean if self.rt.n else nan
+            s["reaction_time_median"] = self.rt_median.median()
+            s["reaction_time_std"] = self.rt.std() if self.rt.n > 1 else 0.0
+        else:
+            s.update({"reaction_time_mean": nan, "reaction_time_median": nan, "reaction_time_std": nan})
+        if "swap_event" in self.seen:
+            s["swap_count"] = int(self.swap_count)
+            s["swap_rate"] = self.swap_count / n if n else 0.0
+            s["avg_swaps_per_trial"] = self.swaps_total / n if "swap_history" in self.seen and n else nan
+        else:
+            s.update({"swap_count": 0, "swap_rate": 0.0, "avg_swaps_per_trial": nan})
+        if "sim_max" in self.seen:
+            s["max_similarity_to_any"] = self.sim_max
+            s["mean_top3_similarity"] = self.top3_sum / self.top3_n if self.top3_n else nan
+            s["count_sim_above_0_8"] = int(self.count_above)
+            s["similarity_entropy_mean"] = self.entropy_sum / self.entropy_n if self.entropy_n else nan
+        else:
+            s.update({"max_similarity_to_any": nan, "mean_top3_similarity": nan, "count_sim_above_0_8": 0,
+                      "similarity_entropy_mean": nan})
+        p_diff = dict(zip(labels, lab_pdiff.tolist())) if has_label else {}
+        if has_label:
+            s.update({f"p_diff_by_label__{lab}": v for lab, v in p_diff.items()})
+        ldi_high = p_diff.get("high", nan) - p_diff.get("target", nan)
+        ldi_low = p_diff.get("low", nan) - p_diff.get("target", nan)
+        s["MDTS_LDI_high"], s["MDTS_LDI_low"] = ldi_high, ldi_low
+        s["MDTS_LDI_mean"] = ldi_low if math.isnan(ldi_high) else ldi_high if math.isnan(ldi_low) else (ldi_high + ldi_low) / 2
+        if has_resp:
+            metrics = {k: float(v) for k, v in sdt_metrics(self.hits, self.n_signal, self.fas, self.n_noise).items()}
+        else:
+            metrics = {k: nan for k in SDT_COLUMNS + ["dprime"]}
+        s["dprime"] = metrics["dprime"]
+        if sdt:
+            s.update({k: metrics[k] for k in SDT_COLUMNS})
+            if has_resp and has_label:
+                by_lab = sdt_metrics(counts[:, _HITS], counts[:, _N_SIGNAL], counts[:, _FAS], counts[:, _N_NOISE])["dprime"]
+                s.update({f"dprime_by_label__{lab}": float(v) for lab, v in zip(labels, by_lab)})
+        return s
+
+class SessionAccumulators:
+    """session_id -> SessionAccumulator. Los trials sin session_id se ignoran (como en session_features_table)."""
+    def __init__(self):
+        self.sessions: Dict[Any,SessionAccumulator] = {}
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, session_id):
+        return session_id in self.sessions
+
+    def add(self, trial: Mapping[str,Any]):
+        sid = trial.get("session_id")
+        if _missing(sid):
+            return
+        acc = self.sessions.get(sid)
+        if acc is None:
+            acc = self.sessions[sid] = SessionAccumulator(sid)
+        acc.add(trial)
+
+    def add_trials(self, trials: Iterable[Mapping[str,Any]]):
+        for t in trials:
+            self.add(t)
+
+    def add_frame(self, trials_df: pd.DataFrame):
+        """Pliega las filas de un DataFrame de trials (solo se leen las columnas que usan las features)."""
+        cols = [c for c in TRIAL_FIELDS if c in trials_df.columns]
+        self.add_trials(trials_df[cols].to_dict("records"))
+
+    def merge(self, other: "SessionAccumulators") -> "SessionAccumulators":
+        for sid, acc in other.sessions.items():
+            mine = self.sessions.get(sid)
+            if mine is None:
+                self.sessions[sid] = mine = SessionAccumulator(sid)
+            mine.merge(acc)
+        return self
+
+    def discard(self, session_ids: Iterable[Any]):
+        for sid in session_ids:
+            self.sessions.pop(sid, None)
+
+    def table(self, sdt: bool = False) -> pd.DataFrame:
+        """Tabla ancha (mismas columnas y orden que session_features_table), una fila por sesión ordenada por session_id."""
+        sids = sorted(self.sessions)
+        labels = sorted({lab for acc in self.sessions.values() for lab in acc.by_label})
+        rows = [self.sessions[sid].features(labels, sdt=sdt) for sid in sids]
+        if not rows:
+            return pd.DataFrame()
+        return pd.DataFrame(rows)
+
+    def sessions_df(self, sdt: bool = False) -> pd.DataFrame:
+        """Formato de sessions.csv (= compute_sessions_df)."""
+        table = self.table(sdt=sdt)
+        return fold_label_columns(table) if len(table) else table
+
+# columnas de trials.csv que leen los acumuladores
+TRIAL_FIELDS = ["session_id", "participant_id", "object_actual_moved", "response", "object_similarity_label",
+                "reaction_time_ms", "swap_event", "swap_history", "sim_max", "sim_mean_top3", "sim_count_above_0_8",
+                "sim_entropy"]
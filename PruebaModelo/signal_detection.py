@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+signal_detection.py - métricas de detección de señales vectorizadas (d', c, A', beta)
+
+Señal = el objeto se movió (object_actual_moved), respuesta "sí" = el participante dijo "different".
+Todas las funciones reciben arrays de conteos de cualquier forma (sesiones, sesiones x etiqueta, ...)
+y devuelven arrays de la misma forma: una sola llamada de NumPy para todas las sesiones/condiciones.
+
+Tasas con corrección log-lineal (Hautus, 1995), la misma que usaba compute_session_features:
+    hit_rate = (hits + 0.5) / (n_signal + 1)      fa_rate = (fas + 0.5) / (n_noise + 1)
+así nunca son 0 ni 1 y d' queda finito incluso con 0 errores.
+
+norm_ppf usa scipy.special.ndtri si está instalado (los mismos valores que scipy.stats.norm.ppf) y si no
+la aproximación racional de Acklam en NumPy puro (error relativo < 1.2e-9), sin bucles por elemento.
+"""
+from typing import Dict
+
+import numpy as np
+
+try:
+    from scipy.special import ndtri as _ndtri
+except Exception:
+    _ndtri = None
+
+# coeficientes de Acklam para la inversa de la normal estándar
+_A = (-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+      1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00)
+_B = (-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+      6.680131188771972e+01, -1.328068155288572e+01)
+_C = (-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+      -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00)
+_D = (7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00, 3.754408661907416e+00)
+_P_LOW = 0.02425
+
+def _poly(coefs, x):
+    out = np.zeros_like(x)
+    for c in coefs:
+        out = out * x + c
+    return out
+
+def norm_ppf_acklam(p) -> np.ndarray:
+    """Inversa de la CDF normal estándar en NumPy puro (Acklam). p fuera de (0, 1) se recorta a [1e-10, 1-1e-10]."""
+    p = np.clip(np.asarray(p, dtype=float), 1e-10, 1 - 1e-10)
+    out = np.empty_like(p)
+    low, high = p < _P_LOW, p > 1 - _P_LOW
+    mid = ~(low | high)
+    q = p[mid] - 0.5
+    r = q * q
+    out[mid] = q * _poly(_A, r) / (_poly(_B, r) * r + 1.0)
+    for mask, sign, tail in ((low, 1.0, p[low]), (high, -1.0, 1.0 - p[high])):
+        q = np.sqrt(-2.0 * np.log(tail))
+        out[mask] = sign * _poly(_C, q) / (_poly(_D, q) * q + 1.0)
+    return out
+
+def norm_ppf(p) -> np.ndarray:
+    """Inversa de la CDF normal estándar (vectorizada)."""
+    if _ndtri is not None:
+        return _ndtri(np.asarray(p, dtype=float))
+    return norm_ppf_acklam(p)
+
+def corrected_rates(hits, n_signal, fas, n_noise):
+    """(hit_rate, fa_rate) con corrección log-lineal +0.5 / +1."""
+    hits, n_signal = np.asarray(hits, dtype=float), np.asarray(n_signal, dtype=float)
+    fas, n_noise = np.asarray(fas, dtype=float), np.asarray(n_noise, dtype=float)
+    return (hits + 0.5) / (n_signal + 1.0), (fas + 0.5) / (n_noise + 1.0)
+
+def dprime(hits, n_signal, fas, n_noise) -> np.ndarray:
+    h, f = corrected_rates(hits, n_signal, fas, n_noise)
+    return norm_ppf(h) - norm_ppf(f)
+
+def a_prime(h, f) -> np.ndarray:
+    """A' no paramétrico (Grier, 1971) a partir de las tasas."""
+    h, f = np.asarray(h, dtype=float), np.asarray(f, dtype=float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        above = 0.5 + ((h - f) * (1 + h - f)) / (4 * h * (1 - f))
+        below = 0.5 - ((f - h) * (1 + f - h)) / (4 * f * (1 - h))
+    return np.where(h >= f, above, below)
+
+def sdt_metrics(hits, n_signal, fas, n_noise) -> Dict[str,np.ndarray]:
+    """hit_rate, fa_rate, dprime, criterion_c, a_prime y beta para arrays de conteos (misma forma)."""
+    h, f = corrected_rates(hits, n_signal, fas, n_noise)
+    zh, zf = norm_ppf(h), norm_ppf(f)
+    return {
+        "hit_rate": h,
+        "fa_rate": f,
+        "dprime": zh - zf,
+        "criterion_c": -(zh + zf) / 2.0,
+        "a_prime": a_prime(h, f),
+        "beta": np.exp((zf * zf - zh * zh) / 2.0),
+    }
+
+def grouped_counts(codes: np.ndarray, n_groups: int, is_signal: np.ndarray, is_noise: np.ndarray, said_yes: np.ndarray,
+                   label_codes: np.ndarray = None, n_labels: int = 0):
+    """
+    (hits, n_signal, fas, n_noise) por grupo (codes = 0..n_groups-1 por trial) a partir de flags por trial;
+    con label_codes (-1 = sin etiqueta) la forma es (n_groups, n_labels) en lugar de (n_groups,).
+    """
+    is_signal = np.asarray(is_signal, dtype=bool)
+    is_noise = np.asarray(is_noise, dtype=bool)
+    said_yes = np.asarray(said_yes, dtype=bool)
+    if label_codes is not None:
+        ok = label_codes >= 0
+        cells = codes[ok] * n_labels + label_codes[ok]
+        size, shape = n_groups * n_labels, (n_groups, n_labels)
+        is_signal, said_yes, is_noise = is_signal[ok], said_yes[ok], is_noise[ok]
+    else:
+        cells, size, shape = codes, n_groups, (n_groups,)
+    def count(flag):
+        return np.bincount(cells, weights=flag, minlength=size).reshape(shape)
+    return count(is_signal & said_yes), count(is_signal), count(is_noise & said_yes), count(is_noise)